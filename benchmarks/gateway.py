@@ -0,0 +1,127 @@
+"""
+Benchmarks the per-call latency of :class: `general.AfricasTalkingGateway.AfricasTalkingGateway`
+against a local stub of the SMS API, with the pooled keep-alive client, and with a new connection
+per call through `urllib.request`, as the gateway used to.
+
+The stub is plain HTTP, so the numbers leave out the TLS handshakes that the pool also saves
+against the real API.
+
+Usage:
+    python -m benchmarks.gateway [--calls 500] [--delay 0.0]
+"""
+
+import argparse
+import json
+import statistics
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from general.AfricasTalkingGateway import (AfricasTalkingGateway, AfricasTalkingGatewayException,
+                                           getConnectionPool)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    delay = 0.0
+    connections = 0
+
+    def setup(self):
+        super(StubHandler, self).setup()
+        StubHandler.connections += 1
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(self.delay)
+        body = json.dumps({'SMSMessageData': {'Message': 'Sent to 1/1 Total Cost: KES 0.8000', 'Recipients': [
+            {'number': '+254701234567', 'status': 'Success', 'messageId': 'ATXid_1', 'cost': 'KES 0.8000'}]}})
+        self.send_response(201)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    def log_message(self, *args):
+        pass
+
+
+class StubServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def start_stub(delay=0.0):
+    """
+    Starts the stub SMS API on a free local port.
+
+    Returns:
+        tuple: Of the form (server, url)
+    """
+    StubHandler.delay = delay
+    server = StubServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:%s' % server.server_port
+
+
+class StubGateway(AfricasTalkingGateway):
+    url = None
+
+    def getApiHost(self):
+        return self.url
+
+
+class UrllibGateway(StubGateway):
+    """
+    The gateway's former HTTP access, with a new connection per call.
+    """
+    def urlopen(self, method, urlString, body, headers):
+        request = urllib.request.Request(urlString, body, headers=headers, method=method)
+        try:
+            response = urllib.request.urlopen(request)
+        except urllib.error.HTTPError as e:
+            raise AfricasTalkingGatewayException(e.read())
+        self.responseCode = response.getcode()
+        return b''.join(response.readlines())
+
+
+def measure(gateway, calls):
+    latencies = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        gateway.sendMessage(to_='+254701234567', message_='CLASS REP Verification Code: 123456', from_='KOTS')
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        'mean_ms': statistics.mean(latencies),
+        'p50_ms': latencies[len(latencies) // 2],
+        'p95_ms': latencies[int(len(latencies) * 0.95)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calls', type=int, default=500)
+    parser.add_argument('--delay', type=float, default=0.0, help="Seconds the stub takes per call")
+    args = parser.parse_args()
+
+    server, StubGateway.url = start_stub(args.delay)
+    try:
+        results = dict()
+        for name, gateway in [('urlopen', UrllibGateway('sandbox', 'key')),
+                              ('pooled', StubGateway('sandbox', 'key', pool_=getConnectionPool()))]:
+            StubHandler.connections = 0
+            results[name] = measure(gateway, args.calls)
+            results[name]['connections'] = StubHandler.connections
+    finally:
+        server.shutdown()
+
+    print("%-8s %10s %10s %10s %12s" % ('client', 'mean (ms)', 'p50 (ms)', 'p95 (ms)', 'connections'))
+    for name, result in results.items():
+        print("%-8s %10.3f %10.3f %10.3f %12d" % (
+            name, result['mean_ms'], result['p50_ms'], result['p95_ms'], result['connections']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+"""
+Replays scripted Telegram updates through the bot's handlers, on a throwaway database seeded with
+a campus of courses, classes, units, lessons, class groups and 20k students, and measures how long
+each update takes to handle, how many queries it makes, and how many updates a second are handled.
+
+The handlers are added to a dispatcher as the bot adds them, in
+:func: `general.conversation.add_handlers`, with the conversations' states in the
+`CONVERSATION_STORE`, so the numbers include loading and saving them. The bot is a fake that
+records the calls to the Telegram API, and the replies queued by the group handlers are sent by the
+`SEND_QUEUE`, with its rate limits lifted.
+
+The scripts are:
+    1. lessons: A student asks for /lessons, /now and /next in private.
+    2. group: A student asks for /lessons in the class's group, then taps This Week, and Today.
+    3. timetable: A student views their units and lessons, through /timetable.
+    4. units: A student finds one of their units, to edit it, by a part of its code.
+    5. registration: Someone new starts registering, up to choosing Student. The class isn't
+        chosen, since the verification codes would be sent by SMS and email.
+
+The results are written to a JSON file, and, given the results of an earlier run, compared with
+them.
+
+The database is the test database of the `default` connection, created and destroyed by the
+benchmark, so it's in memory with SQLite, and `test_<name>` on PostgreSQL.
+
+Usage:
+    python -m benchmarks.handlers [--students 20000] [--users 200] [--output handlers.json]
+        [--baseline previous.json]
+"""
+
+import os
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "class_rep_bot.settings")
+django.setup()
+
+import argparse
+import datetime
+import itertools
+import json
+import logging
+import platform
+import random
+import statistics
+import threading
+import time
+from queue import Queue
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
+from telegram import Update
+from telegram.ext import Dispatcher
+from chats.groups import get_group_registry
+from chats.models import GroupChat
+from general.conversation import add_handlers
+from general.outbox import get_send_queue
+from timetable.models import Course, StudentClass, Unit, Period, Lesson, Lecturer, Venue, Student
+
+SUBJECTS = ['Mechanics', 'Thermodynamics', 'Control', 'Circuits', 'Hydraulics', 'Robotics', 'Statistics',
+            'Calculus', 'Materials', 'Electronics', 'Design', 'Programming', 'Signals', 'Machines']
+LEVELS = ['Engineering', 'Systems', 'Analysis', 'Theory', 'Laboratory']
+PREFIXES = ['EMT', 'EEE', 'ECE', 'SMA', 'ICS', 'BCH', 'CIV', 'MEC']
+
+SCRIPTS = ['lessons', 'group', 'timetable', 'units', 'registration']
+
+
+class FakeBot(object):
+    """
+    Records the calls to the Telegram API, from the handlers and the send queue's threads.
+    """
+    id = 1
+    first_name = 'ClassRep'
+    username = 'ClassRepBot'
+
+    def __init__(self):
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def sendMessage(self, chat_id, text, **kwargs):
+        with self._lock:
+            self.calls += 1
+
+    def editMessageText(self, text=None, chat_id=None, message_id=None, **kwargs):
+        with self._lock:
+            self.calls += 1
+
+    def answerCallbackQuery(self, callback_query_id, **kwargs):
+        with self._lock:
+            self.calls += 1
+
+    send_message = sendMessage
+    edit_message_text = editMessageText
+    answer_callback_query = answerCallbackQuery
+
+
+class ErrorCounter(logging.Handler):
+    """
+    Counts the errors the dispatcher logs, which it does rather than raise them.
+    """
+    def __init__(self):
+        logging.Handler.__init__(self, logging.ERROR)
+        self.errors = 0
+
+    def emit(self, record):
+        self.errors += 1
+
+
+def seed(students, courses=40):
+    """
+    Seeds a campus of `courses` courses, of five years each, with eight units and ten lessons a
+    class, a group for each class, and the students spread over the classes.
+
+    Returns:
+        dict: The classes' primary keys mapped to their groups' chat ids, and unit codes, and the
+            students, as tuples of the form (chat_id, student_class).
+    """
+    rng = random.Random(0)
+    Course.objects.bulk_create([Course(name='BSc. %s %s' % (SUBJECTS[i % len(SUBJECTS)], LEVELS[i % len(LEVELS)]))
+                                for i in range(courses)])
+    StudentClass.objects.bulk_create([StudentClass(course=course, year=year, semester=rng.randint(1, 2))
+                                      for course in Course.objects.all() for year in range(1, 6)])
+    classes = list(StudentClass.objects.values_list('pk', flat=True))
+    Lecturer.objects.bulk_create([Lecturer(name='Lecturer %s' % i, chat_id=10000 + i) for i in range(500)])
+    lecturers = list(Lecturer.objects.values_list('pk', flat=True))
+    Venue.objects.bulk_create([Venue(name='Room %s' % i) for i in range(60)])
+    venues = list(Venue.objects.values_list('pk', flat=True))
+    Period.objects.bulk_create([Period(day=day, start=datetime.time(hour), stop=datetime.time(hour + 2))
+                                for day in range(2, 7) for hour in range(7, 17, 2)])
+    periods = list(Period.objects.values_list('pk', flat=True))
+
+    Unit.objects.bulk_create([Unit(code='%s %04d' % (PREFIXES[i % len(PREFIXES)], 1000 + i),
+                                   name='%s %s' % (SUBJECTS[i % len(SUBJECTS)], LEVELS[i // len(SUBJECTS) % len(LEVELS)]),
+                                   lecturer_id=rng.choice(lecturers)) for i in range(len(classes) * 8)])
+    units = list(Unit.objects.order_by('pk').values_list('pk', 'code'))
+    class_units = StudentClass.units.through
+    class_units.objects.bulk_create([class_units(studentclass_id=pk, unit_id=units[i * 8 + j][0])
+                                     for i, pk in enumerate(classes) for j in range(8)])
+
+    Lesson.objects.bulk_create([Lesson(unit_id=units[i * 8 + j % 8][0], venue_id=rng.choice(venues),
+                                       type=rng.randint(1, 2), period_id=rng.choice(periods))
+                                for i in range(len(classes)) for j in range(10)])
+    lessons = list(Lesson.objects.order_by('pk').values_list('pk', flat=True))
+    class_lessons = StudentClass.lessons.through
+    class_lessons.objects.bulk_create([class_lessons(studentclass_id=pk, lesson_id=lessons[i * 10 + j])
+                                       for i, pk in enumerate(classes) for j in range(10)])
+
+    GroupChat.objects.bulk_create([GroupChat(chat_id=-1000000 - pk, title='Class %s' % pk, student_class_id=pk)
+                                   for pk in classes])
+    Student.objects.bulk_create([Student(name='Student %s' % i, student_class_id=classes[i % len(classes)],
+                                         chat_id=100000000 + i) for i in range(students)], batch_size=500)
+    return {
+        'groups': dict((pk, -1000000 - pk) for pk in classes),
+        'units': dict((pk, [code for unit, code in units[i * 8:i * 8 + 8]]) for i, pk in enumerate(classes)),
+        'students': list(Student.objects.values_list('chat_id', 'student_class_id')),
+    }
+
+
+class Script(object):
+    """
+    Builds the updates of a user's script.
+
+    Args:
+        campus (dict): As seeded.
+        rng (:class: `random.Random`): Picks the users.
+    """
+    def __init__(self, campus, rng):
+        self.campus = campus
+        self.rng = rng
+        self.update_ids = itertools.count(1)
+        self.new_users = itertools.count(900000000)
+
+    @staticmethod
+    def get_user(user_id):
+        return {'id': user_id, 'first_name': 'Student', 'username': 'student%s' % user_id}
+
+    def message(self, user_id, text, chat=None, **kwargs):
+        update_id = next(self.update_ids)
+        data = {'message_id': update_id, 'date': int(time.time()), 'from': self.get_user(user_id),
+                'chat': chat or {'id': user_id, 'type': 'private', 'username': 'student%s' % user_id}}
+        if text is not None:
+            data['text'] = text
+        if text and text.startswith('/'):
+            data['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        data.update(kwargs)
+        return {'update_id': update_id, 'message': data}
+
+    def callback(self, user_id, data, chat):
+        update_id = next(self.update_ids)
+        return {'update_id': update_id, 'callback_query': {
+            'id': str(update_id), 'from': self.get_user(user_id), 'chat_instance': str(chat['id']), 'data': data,
+            'message': {'message_id': update_id, 'date': int(time.time()), 'chat': chat,
+                        'from': {'id': FakeBot.id, 'first_name': FakeBot.first_name}, 'text': 'Lessons'}}}
+
+    def lessons(self):
+        user_id, student_class = self.rng.choice(self.campus['students'])
+        return [self.message(user_id, text) for text in ['/lessons', '/now', '/next']]
+
+    def group(self):
+        user_id, student_class = self.rng.choice(self.campus['students'])
+        chat = {'id': self.campus['groups'][student_class], 'type': 'group', 'title': 'Class %s' % student_class}
+        return [self.message(user_id, '/lessons', chat=chat), self.callback(user_id, 'This Week', chat),
+                self.callback(user_id, 'Today', chat)]
+
+    def timetable(self):
+        user_id, student_class = self.rng.choice(self.campus['students'])
+        return [self.message(user_id, text) for text in ['/timetable', '/view', '/units', '/lessons']]
+
+    def units(self):
+        user_id, student_class = self.rng.choice(self.campus['students'])
+        code = self.rng.choice(self.campus['units'][student_class])
+        return [self.message(user_id, text) for text in
+                ['/timetable', '/edit', '/units', '/edit', code.split()[1], '/cancel']]
+
+    def registration(self):
+        user_id = next(self.new_users)
+        email = 'student%s@students.example.com' % user_id
+        return [
+            self.message(user_id, '/start'),
+            self.message(user_id, '/register'),
+            self.message(user_id, 'Jane Wanjiku'),
+            self.message(user_id, None, contact={'phone_number': '2547%08d' % (user_id % 100000000),
+                                                 'first_name': 'Jane', 'user_id': user_id}),
+            self.message(user_id, email, entities=[{'type': 'email', 'offset': 0, 'length': len(email)}]),
+            self.message(user_id, 'Student'),
+        ]
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def drain(outbox, timeout=30):
+    """
+    Waits for the send queue to make the calls queued so far.
+    """
+    deadline = time.time() + timeout
+    while sum(outbox.depth().values()) and time.time() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)
+
+
+def measure(dispatcher, bot, errors, script, users):
+    """
+    Replays a script for a number of users, one update after the other.
+
+    Returns:
+        dict: The script's numbers.
+    """
+    updates = [Update.de_json(data, bot) for _ in range(users) for data in script()]
+    calls, error_count = bot.calls, errors.errors
+    latencies = []
+    queries = []
+    start = time.perf_counter()
+    for update in updates:
+        # The log of the queries only keeps the latest 9000
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as context:
+            began = time.perf_counter()
+            dispatcher.process_update(update)
+            latencies.append((time.perf_counter() - began) * 1000)
+        queries.append(len(context.captured_queries))
+    elapsed = time.perf_counter() - start
+    drain(get_send_queue())
+
+    latencies.sort()
+    return {
+        'updates': len(updates),
+        'mean_ms': statistics.mean(latencies),
+        'p50_ms': percentile(latencies, 0.5),
+        'p95_ms': percentile(latencies, 0.95),
+        'p99_ms': percentile(latencies, 0.99),
+        'max_ms': latencies[-1],
+        'queries_per_update': statistics.mean(queries),
+        'max_queries': max(queries),
+        'updates_per_second': len(updates) / elapsed,
+        'calls_per_update': float(bot.calls - calls) / len(updates),
+        'errors': errors.errors - error_count,
+    }
+
+
+def compare(results, baseline):
+    """
+    Prints the change of each script's numbers since an earlier run.
+    """
+    print("\nSince %s:" % baseline['date'])
+    print("%-13s %12s %12s %12s %12s" % ('script', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'queries'))
+    for name, result in results['scripts'].items():
+        before = baseline['scripts'].get(name)
+        if before is None:
+            continue
+        print("%-13s %+11.1f%% %+11.1f%% %+11.1f%% %+12.1f" % (
+            name, *[(result[key] / before[key] - 1) * 100 if before[key] else 0.0
+                    for key in ['p50_ms', 'p95_ms', 'p99_ms']],
+            result['queries_per_update'] - before['queries_per_update']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=20000)
+    parser.add_argument('--courses', type=int, default=40, help="Courses, of five classes each")
+    parser.add_argument('--users', type=int, default=200, help="Users replaying each script")
+    parser.add_argument('--scripts', nargs='+', choices=SCRIPTS, default=SCRIPTS)
+    parser.add_argument('--output', default='handlers.json', help="Where the results are written")
+    parser.add_argument('--baseline', help="The results of an earlier run, to compare with")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    # Lift the send queue's rate limits, so the replies don't pile up behind them
+    limits = override_settings(SEND_QUEUE={'RATE': 1e9, 'CHAT_RATE': 1e9, 'GROUP_RATE': 1e9, 'BURST': 1e9})
+    limits.enable()
+    name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        start = time.perf_counter()
+        campus = seed(args.students, args.courses)
+        print("Seeded %s classes and %s students in %.1f s" % (
+            len(campus['groups']), args.students, time.perf_counter() - start))
+        get_group_registry().load()
+
+        bot = FakeBot()
+        dispatcher = Dispatcher(bot, Queue())
+        add_handlers(dispatcher)
+        errors = ErrorCounter()
+        dispatcher.logger.addHandler(errors)
+
+        script = Script(campus, random.Random(0))
+        results = {
+            'date': datetime.datetime.now().isoformat(),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'options': vars(args),
+            'scripts': dict(),
+        }
+        for script_name in args.scripts:
+            results['scripts'][script_name] = measure(dispatcher, bot, errors, getattr(script, script_name),
+                                                      args.users)
+    finally:
+        connection.creation.destroy_test_db(name, verbosity=0)
+        limits.disable()
+
+    print("%-13s %8s %9s %9s %9s %9s %10s %7s" % ('script', 'updates', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)',
+                                                  'queries', 'updates/s', 'errors'))
+    for script_name, result in results['scripts'].items():
+        print("%-13s %8s %9.2f %9.2f %9.2f %9.1f %10.0f %7s" % (
+            script_name, result['updates'], result['p50_ms'], result['p95_ms'], result['p99_ms'],
+            result['queries_per_update'], result['updates_per_second'], result['errors']))
+
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+    print("\nWrote %s" % args.output)
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            compare(results, json.load(baseline))
+
+
+if __name__ == '__main__':
+    main()
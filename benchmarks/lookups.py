@@ -0,0 +1,156 @@
+"""
+Measures the latency of the bot's hot lookups, on a throwaway database seeded with a campus of
+50k students, before and after the migrations that made the chat ids integers and added the
+timetable's composite indexes. That is, from `timetable.0017` and `chats.0005`, with the chat ids
+as strings, to the latest migrations. The time the migrations take on the seeded tables is
+reported as well.
+
+The lookups are made in SQL, the same statements on both schemas, with the chat ids passed as
+strings to the old schema, and as integers to the new one, like the models do.
+
+The database is the test database of the `default` connection, created and destroyed by the
+benchmark, so it's in memory with SQLite, and `test_<name>` on PostgreSQL.
+
+Usage:
+    python -m benchmarks.lookups [--students 50000] [--lookups 2000]
+"""
+
+import os
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "class_rep_bot.settings")
+django.setup()
+
+import argparse
+import datetime
+import logging
+import random
+import statistics
+import time
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+
+BEFORE = [('timetable', '0017_student_is_rep'), ('chats', '0005_groupchat')]
+
+LOOKUPS = [
+    ('student by chat id', "SELECT id, student_class_id FROM timetable_student WHERE chat_id = %s", 'chat_id'),
+    ('identity', "SELECT 1, id, student_class_id FROM timetable_student WHERE chat_id = %s "
+                 "UNION ALL SELECT 2, id, NULL FROM timetable_lecturer WHERE chat_id = %s", 'chat_id'),
+    ('chat by chat id', "SELECT id, student_id FROM chats_studentchat WHERE chat_id = %s", 'chat_id'),
+    ('periods of a day', "SELECT id FROM timetable_period WHERE day = %s ORDER BY start", 'day'),
+    ('lessons of a day', "SELECT l.id FROM timetable_lesson l "
+                         "INNER JOIN timetable_studentclass_lessons t ON t.lesson_id = l.id "
+                         "INNER JOIN timetable_period p ON p.id = l.period_id "
+                         "WHERE t.studentclass_id = %s AND p.day = %s ORDER BY p.start", 'class_day'),
+    ('classes of a lesson', "SELECT studentclass_id FROM timetable_studentclass_lessons WHERE lesson_id = %s",
+     'lesson'),
+]
+
+
+def seed(apps, students):
+    """
+    Seeds a campus, through the models of the migration state the database is at.
+
+    Returns:
+        dict: The numbers of classes and lessons, and the first chat id.
+    """
+    Course = apps.get_model('timetable', 'Course')
+    StudentClass = apps.get_model('timetable', 'StudentClass')
+    Unit = apps.get_model('timetable', 'Unit')
+    Period = apps.get_model('timetable', 'Period')
+    Lesson = apps.get_model('timetable', 'Lesson')
+    Lecturer = apps.get_model('timetable', 'Lecturer')
+    Student = apps.get_model('timetable', 'Student')
+    StudentChat = apps.get_model('chats', 'StudentChat')
+    first_chat_id = 100000000
+
+    Course.objects.bulk_create([Course(name='Course %s' % i) for i in range(40)])
+    StudentClass.objects.bulk_create([StudentClass(course=course, year=year, semester=1)
+                                      for course in Course.objects.all() for year in range(1, 6)])
+    classes = list(StudentClass.objects.values_list('pk', flat=True))
+    Lecturer.objects.bulk_create([Lecturer(name='Lecturer %s' % i, chat_id=str(first_chat_id - 1 - i))
+                                  for i in range(500)])
+    Period.objects.bulk_create([Period(day=day, start=datetime.time(hour), stop=datetime.time(hour + 2))
+                                for day in range(2, 7) for hour in range(7, 17, 2)])
+    periods = list(Period.objects.values_list('pk', flat=True))
+    Unit.objects.bulk_create([Unit(code='UNT %04d' % i, name='Unit %s' % i) for i in range(len(classes) * 8)])
+    units = list(Unit.objects.values_list('pk', flat=True))
+
+    Lesson.objects.bulk_create([Lesson(unit_id=units[(i * 8 + j % 8)], period_id=periods[(i + j) % len(periods)])
+                                for i in range(len(classes)) for j in range(10)])
+    lessons = list(Lesson.objects.values_list('pk', flat=True))
+    through = StudentClass.lessons.through
+    through.objects.bulk_create([through(studentclass_id=pk, lesson_id=lessons[i * 10 + j])
+                                 for i, pk in enumerate(classes) for j in range(10)])
+
+    Student.objects.bulk_create([Student(name='Student %s' % i, student_class_id=classes[i % len(classes)],
+                                         chat_id=str(first_chat_id + i)) for i in range(students)], batch_size=500)
+    StudentChat.objects.bulk_create([StudentChat(student_id=pk, chat_id=str(chat_id)) for pk, chat_id in
+                                     Student.objects.values_list('pk', 'chat_id')], batch_size=500)
+    return {'classes': classes, 'lessons': lessons, 'first_chat_id': first_chat_id}
+
+
+def measure(campus, students, lookups, integers):
+    rng = random.Random(0)
+    params = []
+    for _ in range(lookups):
+        chat_id = campus['first_chat_id'] + rng.randrange(students)
+        chat_id = chat_id if integers else str(chat_id)
+        params.append({
+            'chat_id': [chat_id],
+            'day': [rng.randrange(2, 7)],
+            'class_day': [rng.choice(campus['classes']), rng.randrange(2, 7)],
+            'lesson': [rng.choice(campus['lessons'])],
+        })
+
+    results = dict()
+    with connection.cursor() as cursor:
+        for name, query, kind in LOOKUPS:
+            latencies = []
+            rows = 0
+            for param in params:
+                param = param[kind] * query.count('%s') if kind == 'chat_id' else param[kind]
+                start = time.perf_counter()
+                cursor.execute(query, param)
+                rows += len(cursor.fetchall())
+                latencies.append((time.perf_counter() - start) * 1000000)
+            latencies.sort()
+            results[name] = {'mean_us': statistics.mean(latencies), 'p50_us': latencies[len(latencies) // 2],
+                             'p95_us': latencies[int(len(latencies) * 0.95)], 'rows': float(rows) / lookups}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=50000)
+    parser.add_argument('--lookups', type=int, default=2000, help="Lookups of each kind")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        executor = MigrationExecutor(connection)
+        executor.migrate(BEFORE)
+        executor.loader.build_graph()
+        start = time.perf_counter()
+        campus = seed(executor.loader.project_state(BEFORE).apps, args.students)
+        print("Seeded %s students in %.1f s" % (args.students, time.perf_counter() - start))
+        before = measure(campus, args.students, args.lookups, integers=False)
+
+        executor.loader.build_graph()
+        start = time.perf_counter()
+        executor.migrate(executor.loader.graph.leaf_nodes())
+        print("Migrated in %.1f s" % (time.perf_counter() - start))
+        after = measure(campus, args.students, args.lookups, integers=True)
+    finally:
+        connection.creation.destroy_test_db(name, verbosity=0)
+
+    print("%-20s %12s %12s %12s %12s %6s" % ('lookup', 'before p50', 'after p50', 'before p95', 'after p95', 'rows'))
+    for lookup, query, kind in LOOKUPS:
+        print("%-20s %10.1fus %10.1fus %10.1fus %10.1fus %6.1f" % (
+            lookup, before[lookup]['p50_us'], after[lookup]['p50_us'], before[lookup]['p95_us'],
+            after[lookup]['p95_us'], after[lookup]['rows']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Measures the throughput of the verification mails, offline, through
+:class: `general.mail.LocalBackend`, which stands in for the SendGrid API with a fixed delay per
+request. One request per mail, as `chats.utils.Mail` used to send them, is compared with the batches
+of :class: `general.mail.MailDispatcher`. All the mails are queued at once, like the codes of a
+registration rush, and the time until the last one is sent is measured.
+
+Usage:
+    python -m benchmarks.mail [--mails 200] [--delay 0.2]
+"""
+
+import argparse
+import time
+from general.mail import MailDispatcher, LocalBackend
+
+
+def measure(dispatcher, mails):
+    start = time.perf_counter()
+    futures = [dispatcher.send('student%s@kots.io' % i, 'EMAIL VERIFICATION',
+                               'CLASS REP Verification Code: -code-', {'-code-': '%06d' % i})
+               for i in range(mails)]
+    for future in futures:
+        future.result()
+    elapsed = time.perf_counter() - start
+    return {'seconds': elapsed, 'mails_per_second': mails / elapsed, 'requests': dispatcher.requests}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mails', type=int, default=200)
+    parser.add_argument('--delay', type=float, default=0.2, help="Seconds the stand-in API takes per request")
+    args = parser.parse_args()
+
+    results = [
+        ('single', measure(MailDispatcher(backend=LocalBackend(args.delay), window=0, size=1), args.mails)),
+        ('batched', measure(MailDispatcher(backend=LocalBackend(args.delay)), args.mails)),
+    ]
+    print("%-8s %10s %12s %10s" % ('mode', 'seconds', 'mails/s', 'requests'))
+    for name, result in results:
+        print("%-8s %10.2f %12.1f %10d" % (name, result['seconds'], result['mails_per_second'], result['requests']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,190 @@
+"""
+Measures the end-to-end latency of the bot, from a message being sent to Telegram until the bot's
+reply reaches Telegram, when the updates are polled for, and when they are posted to the webhook.
+
+It runs against a local fake of the Telegram Bot API, which answers `getUpdates` as a long poll,
+like Telegram does, posts the updates to the webhook once one is set, and records the replies. The
+bot only echoes the messages, so that the numbers are about receiving the updates, not handling
+them. `--rtt` adds a simulated round trip time to Telegram.
+
+Usage:
+    python -m benchmarks.webhook [--messages 100] [--rtt 0.05] [--burst 1]
+"""
+
+import argparse
+import json
+import logging
+import socket
+import statistics
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from telegram.ext import MessageHandler, Filters
+from general.conversation import start_webhook
+from general.webhook import WebhookUpdater
+
+TOKEN = '123456:fake-token'
+
+
+class FakeTelegram(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, rtt=0.0):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakeTelegramHandler)
+        self.rtt = rtt
+        self.updates = []
+        self.webhook = ''
+        self.replies = dict()
+        self.condition = threading.Condition()
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%s/bot' % self.server_port
+
+    def get_updates(self, offset, timeout):
+        deadline = time.time() + timeout
+        with self.condition:
+            while True:
+                updates = [update for update in self.updates if update['update_id'] >= offset]
+                if updates or time.time() >= deadline:
+                    return updates
+                self.condition.wait(deadline - time.time())
+
+    def send(self, update_id, text):
+        """
+        Sends a message to the bot, as Telegram would, either to the webhook, or to the long poll.
+        """
+        update = {
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': 42, 'type': 'private'},
+                'from': {'id': 42, 'first_name': 'Student'},
+                'text': text,
+            },
+        }
+        if self.webhook:
+            def post():
+                time.sleep(self.rtt / 2)
+                request = urllib.request.Request(self.webhook, json.dumps(update).encode(),
+                                                 headers={'Content-Type': 'application/json'})
+                urllib.request.urlopen(request).read()
+            threading.Thread(target=post, daemon=True).start()
+        else:
+            with self.condition:
+                self.updates.append(update)
+                self.condition.notify_all()
+
+    def reply(self, text):
+        with self.condition:
+            self.replies[text] = time.perf_counter()
+            self.condition.notify_all()
+
+    def wait_reply(self, text, timeout=30):
+        with self.condition:
+            self.condition.wait_for(lambda: text in self.replies, timeout)
+            return self.replies.get(text)
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        data = json.loads(self.rfile.read(length).decode() or '{}')
+        method = self.path.rsplit('/', 1)[-1]
+
+        if method == 'getUpdates':
+            result = server.get_updates(data.get('offset') or 0, data.get('timeout', 0))
+        elif method == 'setWebhook':
+            server.webhook = data.get('url', '')
+            result = True
+        elif method == 'getMe':
+            result = {'id': 1, 'first_name': 'ClassRep', 'username': 'ClassRepBot'}
+        elif method == 'sendMessage':
+            result = {'message_id': 1, 'date': int(time.time()), 'text': data['text'],
+                      'chat': {'id': data['chat_id'], 'type': 'private'}}
+            server.reply(data['text'])
+        else:
+            result = True
+
+        time.sleep(server.rtt / 2)
+        body = json.dumps({'ok': True, 'result': result}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def echo(bot, update):
+    update.message.reply_text(update.message.text)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def measure(mode, messages, rtt, burst):
+    telegram = FakeTelegram(rtt)
+    threading.Thread(target=telegram.serve_forever, daemon=True).start()
+
+    updater = WebhookUpdater(TOKEN, base_url=telegram.url)
+    updater.dispatcher.add_handler(MessageHandler(Filters.text, echo))
+    if mode == 'webhook':
+        port = free_port()
+        start_webhook(updater, '127.0.0.1', port, 'hook', 'http://127.0.0.1:%s' % port)
+        # Wait for the webhook's server to come up
+        while not getattr(updater, 'httpd', None):
+            time.sleep(0.01)
+    else:
+        updater.start_polling(timeout=10)
+
+    latencies = []
+    try:
+        for first in range(1, messages + 1, burst):
+            sent = dict()
+            for update_id in range(first, min(first + burst, messages + 1)):
+                text = 'message %s' % update_id
+                sent[text] = time.perf_counter()
+                telegram.send(update_id, text)
+            for text, start in sent.items():
+                latencies.append((telegram.wait_reply(text) - start) * 1000)
+    finally:
+        updater.stop()
+        telegram.shutdown()
+
+    latencies.sort()
+    return {
+        'mean_ms': statistics.mean(latencies),
+        'p50_ms': latencies[len(latencies) // 2],
+        'p95_ms': latencies[int(len(latencies) * 0.95)],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--rtt', type=float, default=0.05, help="Simulated round trip time to Telegram, in seconds")
+    parser.add_argument('--burst', type=int, default=1, help="Messages sent at once")
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.WARNING)
+
+    print("%-8s %10s %10s %10s" % ('mode', 'mean (ms)', 'p50 (ms)', 'p95 (ms)'))
+    for mode in ['polling', 'webhook']:
+        result = measure(mode, args.messages, args.rtt, args.burst)
+        print("%-8s %10.1f %10.1f %10.1f" % (mode, result['mean_ms'], result['p50_ms'], result['p95_ms']))
+
+
+if __name__ == '__main__':
+    main()
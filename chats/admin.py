@@ -1,12 +1,22 @@
 from django.contrib import admin
-from .models import StudentChat, LecturerChat
+from .models import StudentChat, LecturerChat, Broadcast, GroupChat
 
 
 class StudentChatAdmin(admin.ModelAdmin):
     list_display = ('student', 'chat_id', 'mobile_code', 'email_code', 'mobile_verified', 'email_verified', 'latest_chat')
 
 
+class BroadcastAdmin(admin.ModelAdmin):
+    list_display = ('student_class', 'sender_chat_id', 'created', 'status', 'total', 'sent', 'failed')
+
+
+class GroupChatAdmin(admin.ModelAdmin):
+    list_display = ('title', 'chat_id', 'student_class', 'created')
+
+
 admin.site.register(StudentChat, StudentChatAdmin)
+admin.site.register(GroupChat, GroupChatAdmin)
+admin.site.register(Broadcast, BroadcastAdmin)
 
 
 
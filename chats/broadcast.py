@@ -0,0 +1,278 @@
+"""
+This module contains :class: `chats.broadcast.Broadcaster`, which sends a class rep's, or a
+lecturer's, announcement to everyone in a class.
+
+The recipients are resolved in a single query: the class's students, and the lecturers of its
+units, that have a chat with the bot. A :class: `chats.models.BroadcastDelivery` is then created
+for each recipient, in bulk, and the announcement is fanned out over the bulk lane of
+:mod: `general.outbox`, whose workers keep within Telegram's rate limits.
+
+As the deliveries are made, their states are gathered and written back in bulk, a query or two
+for every batch, rather than one per recipient. A broadcast that was cut short, like by a restart,
+is resumed by :func: `~chats.broadcast.Broadcaster.resume`, from the deliveries that are still
+pending, so it's never sent twice to the recipients whose deliveries were recorded.
+
+Every process of the bot resumes the broadcasts, so a process first claims the deliveries it
+sends, in a single UPDATE, and the others leave them be. A claim that's older than the `LEASE`
+setting, like that of a process that died while sending, may be taken over.
+"""
+
+import datetime as dt
+import logging
+import threading
+import time
+import uuid
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from telegram.error import TelegramError
+from chats.models import Broadcast, BroadcastDelivery
+from general.outbox import get_send_queue, BULK
+from timetable.models import Student, Lecturer, Unit, StudentClass
+
+logger = logging.getLogger(__name__)
+
+
+class Broadcaster(object):
+    """
+    Sends the broadcasts, and keeps track of their deliveries.
+
+    Attributes:
+        outbox (:class: `general.outbox.SendQueue`): The queue the announcements are sent through.
+        batch (int): The most delivery states written at a time.
+        interval (float): Seconds between writing the delivery states.
+        lease (float): Seconds after which another process may take over the deliveries a
+            process claimed, but didn't record.
+
+    Args:
+        outbox (Optional[:class: `general.outbox.SendQueue`]): As above. Default is the process
+            wide queue.
+        batch (Optional[int]): As above. Default is 500.
+        interval (Optional[float]): As above. Default is 1.
+        lease (Optional[float]): As above. Default is 600.
+        threaded (Optional[bool]): Whether to write the delivery states from a background thread.
+            If False, they are only written on :func: `~chats.broadcast.Broadcaster.flush`.
+            Default is True.
+    """
+    def __init__(self, outbox=None, batch=500, interval=1.0, lease=600.0, threaded=True):
+        self.outbox = outbox or get_send_queue()
+        self.batch = batch
+        self.interval = interval
+        self.lease = lease
+        self.threaded = threaded
+        self._results = []
+        self._condition = threading.Condition()
+        self._thread = None
+
+    @staticmethod
+    def get_recipients(student_class):
+        """
+        Get the chats of a class's students, and of the lecturers of its units, in a single query.
+
+        Args:
+            student_class (:class: `timetable.models.StudentClass` or int): The class, or its primary key.
+
+        Returns:
+            list: The chat ids, without duplicates.
+        """
+        student_class = getattr(student_class, 'pk', student_class)
+        units = StudentClass.units.through._meta
+        query = (
+            "SELECT chat_id FROM {student} WHERE student_class_id = %s AND chat_id IS NOT NULL "
+            "UNION "
+            "SELECT l.chat_id FROM {lecturer} l "
+            "INNER JOIN {unit} u ON u.lecturer_id = l.id "
+            "INNER JOIN {units} su ON su.{unit_column} = u.id "
+            "WHERE su.{class_column} = %s AND l.chat_id IS NOT NULL"
+        ).format(student=Student._meta.db_table, lecturer=Lecturer._meta.db_table,
+                 unit=Unit._meta.db_table, units=units.db_table,
+                 unit_column=units.get_field('unit').column, class_column=units.get_field('studentclass').column)
+        with connection.cursor() as cursor:
+            cursor.execute(query, [student_class, student_class])
+            return [row[0] for row in cursor.fetchall()]
+
+    @staticmethod
+    def get_classes(chat_id):
+        """
+        Get the classes the owner of a chat may broadcast to. That is, a class rep's own class, or
+        the classes taking a lecturer's units.
+
+        Returns:
+            list: The :class: `timetable.models.StudentClass` objects.
+        """
+        classes = StudentClass.objects.filter(student__chat_id=chat_id, student__is_rep=True)
+        if not classes:
+            classes = StudentClass.objects.filter(units__lecturer__chat_id=chat_id).distinct()
+        return list(classes)
+
+    @transaction.atomic
+    def create(self, student_class, sender_chat_id, text):
+        """
+        Creates a broadcast, with a pending delivery for each of its recipients.
+
+        Returns:
+            chats.models.Broadcast
+        """
+        recipients = [chat_id for chat_id in self.get_recipients(student_class) if chat_id != sender_chat_id]
+        broadcast = Broadcast.objects.create(student_class=student_class, sender_chat_id=sender_chat_id,
+                                             text=text, total=len(recipients))
+        BroadcastDelivery.objects.bulk_create(
+            [BroadcastDelivery(broadcast=broadcast, chat_id=chat_id) for chat_id in recipients], batch_size=500)
+        return broadcast
+
+    def send(self, bot, student_class, sender_chat_id, text):
+        """
+        Creates a broadcast, and starts sending it.
+
+        Args:
+            bot (:class: `telegram.Bot`): The bot it's sent through.
+            student_class (:class: `timetable.models.StudentClass`): The class it's sent to.
+            sender_chat_id (int): The chat of the rep, or lecturer, sending it.
+            text (str): The announcement.
+
+        Returns:
+            chats.models.Broadcast
+        """
+        broadcast = self.create(student_class, sender_chat_id, text)
+        self.start(bot, broadcast)
+        return broadcast
+
+    def claim(self, broadcast):
+        """
+        Claims the pending deliveries of a broadcast, and those whose claim has lapsed, so that
+        no other process sends them too.
+
+        Returns:
+            list: Tuples of the form (pk, chat_id), of the deliveries claimed.
+        """
+        token = uuid.uuid4().hex
+        now = timezone.now()
+        lapsed = Q(status=BroadcastDelivery.QUEUED, queued__lt=now - dt.timedelta(seconds=self.lease))
+        broadcast.deliveries.filter(Q(status=BroadcastDelivery.PENDING) | lapsed).update(
+            status=BroadcastDelivery.QUEUED, claim=token, queued=now)
+        return list(broadcast.deliveries.filter(claim=token).values_list('pk', 'chat_id'))
+
+    def start(self, bot, broadcast):
+        """
+        Claims the pending deliveries of a broadcast, and queues them.
+
+        Returns:
+            int: The number of deliveries queued.
+        """
+        deliveries = self.claim(broadcast)
+        if not deliveries and not broadcast.deliveries.filter(
+                status__in=[BroadcastDelivery.PENDING, BroadcastDelivery.QUEUED]).exists():
+            self.finish(bot, broadcast.pk)
+        for pk, chat_id in deliveries:
+            future = self.outbox.send(bot.sendMessage, chat_id, BULK, text=broadcast.text)
+            future.add_done_callback(lambda future, pk=pk: self.delivered(bot, broadcast.pk, pk, future))
+        return len(deliveries)
+
+    def resume(self, bot):
+        """
+        Carries on with the broadcasts that were cut short.
+
+        Returns:
+            int: The number of deliveries queued.
+        """
+        return sum(self.start(bot, broadcast) for broadcast in Broadcast.objects.filter(status=Broadcast.SENDING))
+
+    def delivered(self, bot, broadcast, delivery, future):
+        error = future.exception()
+        if error is not None and not isinstance(error, TelegramError):
+            logger.error("Failed to deliver broadcast %s: %s", broadcast, error)
+        status = BroadcastDelivery.SENT if error is None else BroadcastDelivery.FAILED
+        with self._condition:
+            self._results.append((bot, broadcast, delivery, status))
+            if self.threaded and self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='Broadcaster', daemon=True)
+                self._thread.start()
+            if len(self._results) >= self.batch:
+                self._condition.notify()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                self._condition.wait(self.interval)
+            try:
+                while self.flush():
+                    pass
+            except Exception:
+                logger.exception("Failed to save the states of the broadcasts' deliveries")
+                time.sleep(self.interval)
+
+    def flush(self):
+        """
+        Writes the states of the deliveries made so far, and finishes the broadcasts that are done.
+
+        Returns:
+            int: The number of delivery states written.
+        """
+        with self._condition:
+            results, self._results = self._results[:self.batch], self._results[self.batch:]
+        if not results:
+            return 0
+
+        updates = dict()
+        bots = dict()
+        for bot, broadcast, delivery, status in results:
+            updates.setdefault((broadcast, status), []).append(delivery)
+            bots[broadcast] = bot
+        try:
+            with transaction.atomic():
+                for (broadcast, status), deliveries in updates.items():
+                    BroadcastDelivery.objects.filter(pk__in=deliveries).update(status=status)
+                    counter = 'sent' if status == BroadcastDelivery.SENT else 'failed'
+                    Broadcast.objects.filter(pk=broadcast).update(**{counter: F(counter) + len(deliveries)})
+        except Exception:
+            with self._condition:
+                self._results[:0] = results
+            raise
+
+        for broadcast, bot in bots.items():
+            if not BroadcastDelivery.objects.filter(
+                    broadcast=broadcast, status__in=[BroadcastDelivery.PENDING, BroadcastDelivery.QUEUED]).exists():
+                self.finish(bot, broadcast)
+        return len(results)
+
+    def finish(self, bot, broadcast):
+        """
+        Marks a broadcast as done, and lets its sender know how it went.
+        """
+        if not Broadcast.objects.filter(pk=broadcast, status=Broadcast.SENDING).update(status=Broadcast.DONE):
+            return
+        broadcast = Broadcast.objects.select_related('student_class__course').get(pk=broadcast)
+        future = self.outbox.send(bot.sendMessage, broadcast.sender_chat_id,
+                                  text="Your announcement to %s was delivered to %s of %s people." % (
+                                      broadcast.student_class, broadcast.sent, broadcast.total))
+        future.add_done_callback(lambda future: self.notified(broadcast.pk, broadcast.sender_chat_id, future))
+
+    @staticmethod
+    def notified(broadcast, chat_id, future):
+        error = future.exception()
+        if isinstance(error, TelegramError):
+            logger.warning("Failed to tell %s how broadcast %s went: %s", chat_id, broadcast, error)
+        elif error is not None:
+            logger.error("Failed to tell %s how broadcast %s went: %s", chat_id, broadcast, error)
+
+
+_broadcaster = None
+_broadcaster_lock = threading.Lock()
+
+
+def get_broadcaster():
+    """
+    Get the process wide broadcaster, configured by the `BROADCAST` setting, creating it the
+    first time.
+
+    Returns:
+        chats.broadcast.Broadcaster
+    """
+    global _broadcaster
+    with _broadcaster_lock:
+        if _broadcaster is None:
+            options = getattr(settings, 'BROADCAST', {})
+            _broadcaster = Broadcaster(batch=options.get('BATCH', 500), interval=options.get('INTERVAL', 1.0),
+                                       lease=options.get('LEASE', 600.0))
+        return _broadcaster
@@ -2,6 +2,7 @@ from telegram import (ReplyKeyboardMarkup, ReplyKeyboardRemove, ParseMode)
 from telegram.keyboardbutton import KeyboardButton
 from telegram.ext import (CommandHandler, MessageHandler, Filters, ConversationHandler, CallbackQueryHandler)
 from chats.utils import GeneralChat
+from chats.broadcast import get_broadcaster
 from telegram import (InlineKeyboardButton, InlineKeyboardMarkup)
 
 
@@ -46,7 +47,7 @@ def register(bot, update, user_data):
     except AttributeError:
         chat = GeneralChat(chat_id=update.callback_query.message.chat_id)
 
-    if update.message.chat.type == 'group' and update.message.chat_id == -176518514:
+    if update.message.chat.type != 'private':
         keyboard = [[InlineKeyboardButton(
             text="Chat in Private",
             url="http://t.me/ClassRepBot?start=register")]]
@@ -292,6 +293,30 @@ def cancel(bot, update):
     )
 
 
+def broadcast(bot, update, args):
+    """
+    Sends an announcement, like `/broadcast The CAT is on Monday`, to everyone in the sender's
+    class, if they are a class rep, or in the classes taking their units, if they are a lecturer.
+    """
+    text = update.message.text.split(None, 1)[1].strip() if args else ''
+    broadcaster = get_broadcaster()
+    classes = broadcaster.get_classes(update.message.from_user.id)
+    if not classes:
+        message = "Only class reps and lecturers may send announcements."
+    elif not text:
+        message = "Send the announcement along with the command, like:\n/broadcast The CAT is on Monday"
+    else:
+        broadcasts = [broadcaster.send(bot, student_class, update.message.from_user.id, text)
+                      for student_class in classes]
+        message = "Sending your announcement to %s people. I'll let you know once it's delivered." % sum(
+            item.total for item in broadcasts)
+    update.message.reply_text(message)
+
+
+def get_broadcast_handler():
+    return CommandHandler('broadcast', broadcast, pass_args=True)
+
+
 def get_chats_conversation_handler():
     conversation_handler = ConversationHandler(
         entry_points=[CommandHandler('start', start, pass_user_data=True, pass_args=True)],
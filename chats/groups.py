@@ -0,0 +1,155 @@
+"""
+This module contains :class: `chats.groups.GroupRegistry`, an in-memory index of the Telegram
+groups the bot is in, and the classes they belong to.
+
+Each group is a :class: `chats.models.GroupChat`. The registry loads them all in a single query,
+the first time it's used, and is kept up to date by the model's signals, so finding the class of
+the group a message came from is a dict lookup, rather than a query, or two, per message. The
+groups edited by other processes, like in the admin, are picked up by a periodic reload.
+"""
+
+import threading
+from django.db.models.signals import post_save, post_delete
+from telegram.ext import Job
+from chats.models import GroupChat
+from timetable.models import Student, Lecturer, StudentClass
+
+
+class GroupRegistry(object):
+    """
+    The groups the bot is in, by their chat ids.
+
+    Attributes:
+        classes (dict): The groups' chat ids mapped to the primary keys of their classes,
+            or None if the group's class isn't known.
+    """
+    def __init__(self):
+        self.classes = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Loads the groups from the database.
+
+        Returns:
+            int: The number of groups.
+        """
+        classes = dict(GroupChat.objects.values_list('chat_id', 'student_class_id'))
+        with self._lock:
+            self.classes = classes
+        return len(classes)
+
+    def __contains__(self, chat_id):
+        if self.classes is None:
+            self.load()
+        return chat_id in self.classes
+
+    def get(self, chat_id):
+        """
+        Get the class of a group.
+
+        Args:
+            chat_id (int): The group's chat id.
+
+        Returns:
+            int: The primary key of the group's :class: `timetable.models.StudentClass`. None if
+                the group isn't known, or its class isn't.
+        """
+        if self.classes is None:
+            self.load()
+        return self.classes.get(chat_id)
+
+    def update(self, chat_id, student_class):
+        with self._lock:
+            if self.classes is not None:
+                self.classes[chat_id] = student_class
+
+    def remove(self, chat_id):
+        with self._lock:
+            if self.classes is not None:
+                self.classes.pop(chat_id, None)
+
+    @staticmethod
+    def get_class(user_id):
+        """
+        Get the class of a user, for a group they added the bot to. That is, their own class if
+        they are a student, or the class taking their units, if they are a lecturer of a single class.
+
+        Returns:
+            int: The class's primary key. None if it can't be told.
+        """
+        student_class = Student.objects.filter(chat_id=user_id).values_list('student_class_id', flat=True).first()
+        if student_class is None and Lecturer.objects.filter(chat_id=user_id).exists():
+            classes = StudentClass.objects.filter(units__lecturer__chat_id=user_id).distinct()
+            classes = list(classes.values_list('pk', flat=True)[:2])
+            if len(classes) == 1:
+                student_class = classes[0]
+        return student_class
+
+    def register(self, chat_id, title, user_id=None):
+        """
+        Registers a group the bot was added to, with the class of the user who added it, unless
+        the group's class is already known.
+
+        Returns:
+            chats.models.GroupChat
+        """
+        group, created = GroupChat.objects.get_or_create(chat_id=chat_id, defaults={'title': title or ''})
+        if group.student_class_id is None and user_id is not None:
+            group.student_class_id = self.get_class(user_id)
+            if group.student_class_id is not None:
+                group.save(update_fields=['student_class'])
+        return group
+
+    def unregister(self, chat_id):
+        GroupChat.objects.filter(chat_id=chat_id).delete()
+
+    def migrate(self, chat_id, new_chat_id):
+        """
+        Moves a group that Telegram upgraded to a supergroup, and so gave a new chat id.
+        """
+        if GroupChat.objects.filter(chat_id=chat_id).update(chat_id=new_chat_id):
+            student_class = self.get(chat_id)
+            self.remove(chat_id)
+            self.update(new_chat_id, student_class)
+
+    def start(self, job_queue, interval=300):
+        """
+        Reloads the registry every so often on the given job queue, to pick up the groups edited
+        by other processes, like in the admin.
+
+        Args:
+            job_queue (:class: `telegram.ext.JobQueue`): Like the updater's job queue.
+            interval (Optional[int]): Seconds between reloads. Default is 300.
+
+        Returns:
+            telegram.ext.Job
+        """
+        job = Job(lambda bot, job: self.load(), interval)
+        job_queue.put(job, next_t=0)
+        return job
+
+
+_group_registry = GroupRegistry()
+
+
+def get_group_registry():
+    """
+    Get the process's :class: `chats.groups.GroupRegistry`.
+
+    Returns:
+        chats.groups.GroupRegistry
+    """
+    return _group_registry
+
+
+def group_saved_callback(sender, **kwargs):
+    group = kwargs['instance']
+    _group_registry.update(group.chat_id, group.student_class_id)
+
+
+def group_deleted_callback(sender, **kwargs):
+    _group_registry.remove(kwargs['instance'].chat_id)
+
+post_save.connect(group_saved_callback, sender=GroupChat)
+post_delete.connect(group_deleted_callback, sender=GroupChat)
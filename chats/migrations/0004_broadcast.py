@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 16:06
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timetable', '0017_student_is_rep'),
+        ('chats', '0003_conversationstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Broadcast',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sender_chat_id', models.CharField(max_length=50)),
+                ('text', models.TextField()),
+                ('status', models.IntegerField(choices=[(1, 'Sending'), (2, 'Done')], db_index=True, default=1)),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('sent', models.PositiveIntegerField(default=0)),
+                ('failed', models.PositiveIntegerField(default=0)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('student_class', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='timetable.StudentClass')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='BroadcastDelivery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chat_id', models.CharField(max_length=50)),
+                ('status', models.IntegerField(choices=[(0, 'Pending'), (1, 'Sent'), (2, 'Failed')], default=0)),
+                ('broadcast', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deliveries', to='chats.Broadcast')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='broadcastdelivery',
+            unique_together=set([('broadcast', 'chat_id')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='broadcastdelivery',
+            index_together=set([('broadcast', 'status')]),
+        ),
+    ]
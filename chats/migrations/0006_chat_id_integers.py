@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 16:17
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def delete_invalid_chat_ids(apps, schema_editor):
+    # Blank, or otherwise non-numeric, chat ids can't be cast to integers, and these columns can't
+    # be null, so the rows are deleted. A single DELETE for each table keeps this cheap on big tables.
+    for model_name, field in (('StudentChat', 'chat_id'), ('LecturerChat', 'chat_id'), ('GroupChat', 'chat_id'),
+                              ('BroadcastDelivery', 'chat_id'), ('Broadcast', 'sender_chat_id')):
+        model = apps.get_model('chats', model_name)
+        model.objects.exclude(**{field + '__regex': r'^-?[0-9]+$'}).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0005_groupchat'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_invalid_chat_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='broadcast',
+            name='sender_chat_id',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='broadcastdelivery',
+            name='chat_id',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='groupchat',
+            name='chat_id',
+            field=models.BigIntegerField(unique=True),
+        ),
+        migrations.AlterField(
+            model_name='lecturerchat',
+            name='chat_id',
+            field=models.BigIntegerField(unique=True),
+        ),
+        migrations.AlterField(
+            model_name='studentchat',
+            name='chat_id',
+            field=models.BigIntegerField(unique=True),
+        ),
+    ]
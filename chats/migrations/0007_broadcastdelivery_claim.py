@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 16:45
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chats', '0006_chat_id_integers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='broadcastdelivery',
+            name='claim',
+            field=models.CharField(blank=True, max_length=32),
+        ),
+        migrations.AddField(
+            model_name='broadcastdelivery',
+            name='queued',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='broadcastdelivery',
+            name='status',
+            field=models.IntegerField(choices=[(0, 'Pending'), (3, 'Queued'), (1, 'Sent'), (2, 'Failed')], default=0),
+        ),
+    ]
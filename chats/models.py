@@ -2,13 +2,13 @@ from django.db import models
 """
 I'd like to describe models that hold data on the chats with various students and lecturers
 """
-from timetable.models import Student, Lecturer
+from timetable.models import Student, Lecturer, StudentClass
 
 
 class StudentChat(models.Model):
     student = models.ForeignKey(to=Student, on_delete=models.CASCADE, null=True)
 
-    chat_id = models.CharField(max_length=15, unique=True)
+    chat_id = models.BigIntegerField(unique=True)
 
     mobile_code = models.CharField(max_length=6)
     email_code = models.CharField(max_length=6)
@@ -23,7 +23,7 @@ class StudentChat(models.Model):
 class LecturerChat(models.Model):
     lecturer = models.ForeignKey(to=Lecturer, on_delete=models.CASCADE)
 
-    chat_id = models.CharField(max_length=15, unique=True)
+    chat_id = models.BigIntegerField(unique=True)
 
     mobile_code = models.CharField(max_length=6)
     email_code = models.CharField(max_length=6)
@@ -35,4 +35,91 @@ class LecturerChat(models.Model):
     latest_chat = models.DateTimeField(auto_now=True)
 
 
+class ConversationState(models.Model):
+    """
+    The state of a user's conversations with the bot, and their `user_data`, shared by the bot's
+    processes. See :mod: `chats.state`.
+    """
+    key = models.CharField(max_length=64, unique=True)
+    data = models.TextField(default='{}')
+    version = models.PositiveIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
 
+
+class Broadcast(models.Model):
+    """
+    An announcement to everyone in a class, by a class rep or a lecturer. See :mod: `chats.broadcast`.
+
+    Attributes:
+        student_class (:class: `timetable.models.StudentClass`): The class it's sent to.
+        sender_chat_id (:class: `models.BigIntegerField`): The chat of the rep, or lecturer, who sent it.
+        text (:class: `models.TextField`): The announcement.
+        status (:class: `models.IntegerField`): As in `STATUS`.
+        total (:class: `models.PositiveIntegerField`): The number of recipients.
+        sent (:class: `models.PositiveIntegerField`): The number of recipients it was delivered to.
+        failed (:class: `models.PositiveIntegerField`): The number of recipients it couldn't be
+            delivered to.
+    """
+    SENDING, DONE = range(1, 3)
+    STATUS = (
+        (SENDING, 'Sending'),
+        (DONE, 'Done'),
+    )
+    student_class = models.ForeignKey(to=StudentClass, on_delete=models.CASCADE)
+    sender_chat_id = models.BigIntegerField()
+    text = models.TextField()
+    status = models.IntegerField(choices=STATUS, default=SENDING, db_index=True)
+    total = models.PositiveIntegerField(default=0)
+    sent = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return "Broadcast to %s" % self.student_class
+
+
+class BroadcastDelivery(models.Model):
+    """
+    The delivery of a broadcast to a single recipient.
+
+    Attributes:
+        status (:class: `models.IntegerField`): As in `STATUS`. A delivery is `QUEUED` once a
+            process has claimed it, to send it.
+        claim (:class: `models.CharField`): The token of the claim of the process sending it.
+        queued (Optional[:class: `models.DateTimeField`]): When it was claimed.
+    """
+    PENDING, SENT, FAILED, QUEUED = range(4)
+    STATUS = (
+        (PENDING, 'Pending'),
+        (QUEUED, 'Queued'),
+        (SENT, 'Sent'),
+        (FAILED, 'Failed'),
+    )
+    broadcast = models.ForeignKey(to=Broadcast, on_delete=models.CASCADE, related_name='deliveries')
+    chat_id = models.BigIntegerField()
+    status = models.IntegerField(choices=STATUS, default=PENDING)
+    claim = models.CharField(max_length=32, blank=True)
+    queued = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('broadcast', 'chat_id')
+        index_together = ('broadcast', 'status')
+
+
+class GroupChat(models.Model):
+    """
+    A Telegram group the bot is in, and the class it belongs to. See :mod: `chats.groups`.
+
+    Attributes:
+        chat_id (:class: `models.BigIntegerField`): The group's chat id.
+        title (:class: `models.CharField`): The group's title.
+        student_class (Optional[:class: `timetable.models.StudentClass`]): The class. It's set to
+            the class of whoever added the bot to the group, and may be changed in the admin.
+    """
+    chat_id = models.BigIntegerField(unique=True)
+    title = models.CharField(max_length=255, blank=True)
+    student_class = models.ForeignKey(to=StudentClass, on_delete=models.SET_NULL, null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.title or str(self.chat_id)
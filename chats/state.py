@@ -0,0 +1,288 @@
+"""
+This module contains the shared conversation state, of:
+    1. :class: `chats.state.DatabaseStore`
+    2. :class: `chats.state.RedisStore`
+    3. :class: `chats.state.LocalStore`
+    4. :class: `chats.state.SharedState`
+
+The conversation handlers keep the state of each conversation, and the dispatcher keeps each user's
+`user_data`, in the process's memory. :class: `chats.state.SharedState` loads both from a store
+before an update is handled, and saves them back after, so that a restart doesn't drop half
+finished conversations, and several bot processes can take the updates.
+
+Each user's state is saved with a version. Saving it over a version other than the one it was
+loaded with, as when two processes handle updates of the same user at once, fails with
+:class: `chats.state.StaleStateError`, rather than silently overwriting the other's changes.
+
+The store is chosen by the `CONVERSATION_STORE` setting, like:
+
+    CONVERSATION_STORE = {
+        'BACKEND': 'chats.state.RedisStore',
+        'OPTIONS': {'url': 'redis://localhost:6379/0'},
+    }
+"""
+
+import json
+import logging
+import threading
+from django.conf import settings
+from django.db import transaction, IntegrityError
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from telegram import Update
+from telegram.ext import TypeHandler
+from telegram.utils.helpers import extract_chat_and_user
+from chats.models import ConversationState
+
+logger = logging.getLogger(__name__)
+
+
+class StaleStateError(Exception):
+    """
+    Raised when saving a state over a version other than the one it was loaded with.
+    """
+    pass
+
+
+class DatabaseStore(object):
+    """
+    Keeps the states in the :class: `chats.models.ConversationState` table.
+    """
+    def load(self, key):
+        """
+        Args:
+            key (str): The state's key.
+
+        Returns:
+            tuple: Of the form (data, version). ({}, 0) if there is no such state.
+        """
+        state = ConversationState.objects.filter(key=key).values_list('data', 'version').first()
+        if state is None:
+            return dict(), 0
+        return json.loads(state[0]), state[1]
+
+    def save(self, key, data, version):
+        """
+        Saves a state, if it is still at `version`.
+
+        Args:
+            key (str): The state's key.
+            data (dict): The state. It must be JSON serializable.
+            version (int): The version the state was loaded with.
+
+        Returns:
+            int: The state's new version.
+
+        Raises:
+            StaleStateError: If the state has been saved since it was loaded.
+        """
+        if version == 0:
+            try:
+                with transaction.atomic():
+                    ConversationState.objects.create(key=key, data=json.dumps(data), version=1)
+            except IntegrityError:
+                raise StaleStateError(key)
+            return 1
+
+        updated = ConversationState.objects.filter(key=key, version=version).update(
+            data=json.dumps(data), version=F('version') + 1, updated=timezone.now())
+        if not updated:
+            raise StaleStateError(key)
+        return version + 1
+
+
+class RedisStore(object):
+    """
+    Keeps the states in Redis, or anything that speaks its protocol, as hashes of their data and
+    version. Needs the `redis` package.
+
+    Args:
+        url (Optional[str]): Like 'redis://localhost:6379/0'. Default is the `REDIS_URL` setting.
+        prefix (Optional[str]): Prefixed to the keys. Default is 'classrep:state:'.
+    """
+    def __init__(self, url=None, prefix='classrep:state:'):
+        import redis
+        self.redis = redis.StrictRedis.from_url(url or settings.REDIS_URL)
+        self.prefix = prefix
+        self.WatchError = redis.WatchError
+
+    def load(self, key):
+        data, version = self.redis.hmget(self.prefix + key, 'data', 'version')
+        if version is None:
+            return dict(), 0
+        return json.loads(data.decode()), int(version)
+
+    def save(self, key, data, version):
+        name = self.prefix + key
+        with self.redis.pipeline() as pipe:
+            try:
+                pipe.watch(name)
+                if int(pipe.hget(name, 'version') or 0) != version:
+                    raise StaleStateError(key)
+                pipe.multi()
+                pipe.hmset(name, {'data': json.dumps(data), 'version': version + 1})
+                pipe.execute()
+            except self.WatchError:
+                raise StaleStateError(key)
+        return version + 1
+
+
+class LocalStore(object):
+    """
+    Keeps the states in memory. It is only shared within a process, and is meant for tests.
+    """
+    def __init__(self):
+        self.states = dict()
+        self._lock = threading.Lock()
+
+    def load(self, key):
+        with self._lock:
+            data, version = self.states.get(key, ('{}', 0))
+        return json.loads(data), version
+
+    def save(self, key, data, version):
+        with self._lock:
+            if self.states.get(key, (None, 0))[1] != version:
+                raise StaleStateError(key)
+            self.states[key] = (json.dumps(data), version + 1)
+        return version + 1
+
+
+class SharedState(object):
+    """
+    Keeps the conversations' states and `user_data` of a dispatcher in a store.
+
+    A user's state is loaded by a handler in the first group of handlers, and saved by one in the
+    last group, around the bot's own handlers. It is only saved if it changed.
+
+    Each user has a single state, of the form:
+
+        {'user_data': {...}, 'conversations': {'<handler name>:<chat_id>': <state>}}
+
+    Only the JSON serializable values of `user_data` are kept. The others, like the
+    :class: `timetable.sessions.ChatSession`, stay in the process's memory.
+
+    A user's `user_data` is shared by all their chats, so the dispatcher should handle a user's
+    updates one at a time, like :class: `general.aio.AsyncDispatcher` does.
+
+    Attributes:
+        store: The store, like :class: `chats.state.DatabaseStore`.
+        dispatcher (:class: `telegram.ext.Dispatcher`): The dispatcher.
+        handlers (dict): Names mapped to the :class: `telegram.ext.ConversationHandler` objects.
+        conflicts (int): The number of states that could not be saved, since they were stale.
+
+    Args:
+        store: As above.
+        dispatcher (:class: `telegram.ext.Dispatcher`): As above.
+        handlers (dict): As above.
+    """
+    LOAD_GROUP = -100
+    SAVE_GROUP = 100
+
+    def __init__(self, store, dispatcher, handlers):
+        self.store = store
+        self.dispatcher = dispatcher
+        self.handlers = handlers
+        self.conflicts = 0
+        self._loaded = dict()
+
+    def attach(self):
+        """
+        Adds the handlers that load and save the states to the dispatcher.
+
+        Returns:
+            chats.state.SharedState
+        """
+        self.dispatcher.add_handler(TypeHandler(Update, self.load), group=self.LOAD_GROUP)
+        self.dispatcher.add_handler(TypeHandler(Update, self.save), group=self.SAVE_GROUP)
+        return self
+
+    @staticmethod
+    def get_keys(update):
+        """
+        Returns:
+            tuple: Of the form (user_id, chat_id). Both are None if the update has no user.
+        """
+        chat, user = extract_chat_and_user(update)
+        if user is None:
+            return None, None
+        return user.id, chat.id if chat else None
+
+    @staticmethod
+    def serializable(value):
+        try:
+            json.dumps(value)
+        except (TypeError, ValueError):
+            return False
+        return True
+
+    def load(self, bot, update):
+        """
+        Loads the state of the update's user into the dispatcher's `user_data`, and the conversation
+        handlers.
+        """
+        user_id, chat_id = self.get_keys(update)
+        if user_id is None:
+            return
+        data, version = self.store.load(str(user_id))
+        # By update, so that the loads of a user's concurrent updates, if any, don't mix
+        self._loaded[update.update_id] = (data, version)
+
+        user_data = self.dispatcher.user_data[user_id]
+        local = dict((key, value) for key, value in user_data.items() if not self.serializable(value))
+        user_data.clear()
+        user_data.update(data.get('user_data', {}))
+        user_data.update(local)
+
+        conversations = data.get('conversations', {})
+        for name, handler in self.handlers.items():
+            state = conversations.get('%s:%s' % (name, chat_id))
+            if state is None:
+                handler.conversations.pop((chat_id, user_id), None)
+            else:
+                handler.conversations[(chat_id, user_id)] = state
+
+    def save(self, bot, update):
+        """
+        Saves the state of the update's user, if it changed.
+        """
+        user_id, chat_id = self.get_keys(update)
+        if update.update_id not in self._loaded:
+            return
+        loaded, version = self._loaded.pop(update.update_id)
+
+        conversations = dict(loaded.get('conversations', {}))
+        for name, handler in self.handlers.items():
+            key = '%s:%s' % (name, chat_id)
+            state = handler.conversations.get((chat_id, user_id))
+            if state is None or not self.serializable(state):
+                conversations.pop(key, None)
+            else:
+                conversations[key] = state
+        data = {
+            'user_data': dict((key, value) for key, value in self.dispatcher.user_data[user_id].items()
+                              if self.serializable(value)),
+            'conversations': conversations,
+        }
+        if data == loaded:
+            return
+
+        try:
+            self.store.save(str(user_id), data, version)
+        except StaleStateError:
+            self.conflicts += 1
+            logger.warning("The state of user %s changed while handling update %s, so it was not saved",
+                           user_id, update.update_id)
+
+
+def get_state_store():
+    """
+    Get a new instance of the store in the `CONVERSATION_STORE` setting.
+
+    Returns:
+        object: Like :class: `chats.state.DatabaseStore`
+    """
+    config = getattr(settings, 'CONVERSATION_STORE', {})
+    store = import_string(config.get('BACKEND', 'chats.state.DatabaseStore'))
+    return store(**config.get('OPTIONS', {}))
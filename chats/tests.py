@@ -1,3 +1,766 @@
-from django.test import TestCase
+import asyncio
+import json
+import socket
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from queue import Queue
+from django.core.exceptions import ImproperlyConfigured
+from django.test import SimpleTestCase, TestCase, override_settings
+from telegram import Bot, Update
+from telegram.error import RetryAfter
+from telegram.ext import Dispatcher, ConversationHandler, CommandHandler, MessageHandler, Filters
+from concurrent.futures import Future
+from general.delivery import Delivery, DeliveryQueue
+from general import conversation
+from general.webhook import WebhookUpdater
+from general.aio import AsyncRuntime
+from general.outbox import SendQueue, INTERACTIVE, BULK
+from chats.state import SharedState, DatabaseStore, StaleStateError
+from general.mail import MailDispatcher, LocalBackend
+from general.sms import SMSDispatcher, SMSStatus
+from general.AfricasTalkingGateway import AfricasTalkingGateway, AfricasTalkingGatewayException
+from chats.models import ConversationState, Broadcast, BroadcastDelivery
+from chats.broadcast import Broadcaster
+from chats.groups import GroupRegistry, get_group_registry
+from chats.models import GroupChat
+from timetable.chats.group_chat import get_chat, group_status, sent
+from telegram.error import TelegramError
+from timetable.models import Student, Lecturer, Unit, Course, StudentClass
+from chats.utils import Text, Mail, GeneralChat
+from timetable.classes import get_class_directory
+from timetable.identity import IdentityCache, get_identity_cache, STUDENT, LECTURER
+from chats.models import StudentChat, LecturerChat
 
-# Create your tests here.
+
+class FakeGateway(object):
+    def __init__(self, fail=()):
+        self.requests = []
+        self.fail = fail
+
+    def sendMessage(self, to_, message_, from_=None, **kwargs):
+        self.requests.append((to_, message_, from_))
+        if message_ in self.fail:
+            raise AfricasTalkingGatewayException('Invalid senderId')
+        # The gateway reports the numbers in the international format, and drops invalid ones
+        return [{'number': '+254' + number[-9:], 'status': 'Success', 'messageId': 'ATXid_%s' % i,
+                 'cost': 'KES 0.8000'} for i, number in enumerate(to_.split(',')) if number != 'invalid']
+
+
+class SMSDispatcherTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.gateway = FakeGateway(fail=['Broken'])
+        self.dispatcher = SMSDispatcher(gateway=self.gateway, size=2, threaded=False)
+
+    def test_batching(self):
+        first = self.dispatcher.send('0701234567', 'Reminder')
+        second = self.dispatcher.send('+254701234568', 'Reminder')
+        third = self.dispatcher.send('+254701234569', 'Reminder')
+        other = self.dispatcher.send('+254701234567', 'Another message', sender='CLASSREP')
+        invalid = self.dispatcher.send('invalid', 'Another message', sender='CLASSREP')
+        broken = self.dispatcher.send('+254701234567', 'Broken')
+        self.assertEqual(self.dispatcher.flush(), 6)
+
+        # Grouped by message and sender, in batches of two
+        self.assertEqual([request[0] for request in self.gateway.requests], [
+            '0701234567,+254701234568', '+254701234569', '+254701234567,invalid', '+254701234567'])
+        self.assertEqual(self.dispatcher.requests, 4)
+        self.assertEqual(self.gateway.requests[2][2], 'CLASSREP')
+
+        self.assertEqual(first.result(), SMSStatus('+254701234567', 'Success', 'ATXid_0', 'KES 0.8000'))
+        self.assertEqual(second.result().message_id, 'ATXid_1')
+        self.assertTrue(third.result().success)
+        self.assertTrue(other.result().success)
+        self.assertFalse(invalid.result().success)
+        self.assertEqual(broken.result().status, 'Invalid senderId')
+
+    def test_background_thread(self):
+        dispatcher = SMSDispatcher(gateway=self.gateway, window=0.05)
+        futures = [dispatcher.send('+25470123456%s' % i, 'Reminder') for i in range(5)]
+        self.assertTrue(all(future.result(5).success for future in futures))
+        self.assertEqual(dispatcher.requests, 1)
+
+    def test_text(self):
+        text = Text('+254701234567', '123456', dispatcher=SMSDispatcher(gateway=self.gateway, window=0))
+        self.assertTrue(text.send().success)
+        self.assertEqual(self.gateway.requests[-1],
+                         ('+254701234567', 'CLASS REP Verification Code: 123456', 'KOTS'))
+
+
+class FakeResponse(object):
+    def __init__(self, status, data):
+        self.status = status
+        self.data = data
+
+
+class FakePool(object):
+    def __init__(self, *responses):
+        self.requests = []
+        self.responses = list(responses)
+
+    def urlopen(self, method, url, body=None, headers=None):
+        self.requests.append((method, url, body, headers))
+        return self.responses.pop(0)
+
+
+class AfricasTalkingGatewayTestCase(SimpleTestCase):
+
+    def test_pooled_requests(self):
+        pool = FakePool(
+            FakeResponse(201, b'{"SMSMessageData": {"Message": "Sent", "Recipients": [{"number": "+254701234567", '
+                              b'"status": "Success", "messageId": "ATXid_0", "cost": "KES 0.8000"}]}}'),
+            FakeResponse(200, b'{"SMSMessageData": {"Messages": []}}'),
+            FakeResponse(401, b'The supplied authentication is invalid'),
+        )
+        gateway = AfricasTalkingGateway('sandbox', 'key', pool_=pool)
+
+        recipients = gateway.sendMessage(to_='+254701234567', message_='Hello', from_='KOTS')
+        self.assertEqual(recipients[0]['messageId'], 'ATXid_0')
+        method, url, body, headers = pool.requests[0]
+        self.assertEqual((method, url), ('POST', 'https://api.africastalking.com/version1/messaging'))
+        self.assertIn(b'to=%2B254701234567', body)
+        self.assertEqual(headers['apikey'], 'key')
+
+        self.assertEqual(gateway.fetchMessages(), [])
+        self.assertEqual(pool.requests[1][0], 'GET')
+
+        with self.assertRaises(AfricasTalkingGatewayException):
+            gateway.sendMessage(to_='+254701234567', message_='Hello')
+
+
+class DeliveryQueueTestCase(SimpleTestCase):
+
+    def test_retries_and_dead_letters(self):
+        deliveries = DeliveryQueue(workers=2, attempts=3, backoff=0.01)
+        done = threading.Event()
+        calls = []
+
+        def flaky(name):
+            calls.append(name)
+            if len([call for call in calls if call == name]) < 2:
+                raise RuntimeError('Try again')
+            done.set()
+
+        def broken():
+            raise RuntimeError('Broken')
+
+        self.assertTrue(deliveries.put('sms', broken))
+        self.assertTrue(deliveries.put('sms', flaky, 'flaky'))
+        self.assertTrue(done.wait(5))
+        for _ in range(500):
+            if deliveries.dead_letters:
+                break
+            threading.Event().wait(0.01)
+
+        self.assertEqual(calls, ['flaky', 'flaky'])
+        self.assertEqual(deliveries.delivered, 1)
+        dead_letter, = deliveries.dead_letters
+        self.assertEqual((dead_letter.attempts, str(dead_letter.error)), (3, 'Broken'))
+
+    def test_bounded(self):
+        deliveries = DeliveryQueue(workers=1, maxsize=1)
+        release = threading.Event()
+        self.assertTrue(deliveries.put('mail', release.wait))
+        # Until the worker takes the first one, the second fills the queue
+        for _ in range(500):
+            if deliveries.pending() == 0:
+                break
+            threading.Event().wait(0.01)
+        self.assertTrue(deliveries.put('mail', release.wait))
+        self.assertFalse(deliveries.put('mail', release.wait))
+        self.assertEqual(len(deliveries.dead_letters), 1)
+        release.set()
+
+    def test_futures(self):
+        deliveries = DeliveryQueue(workers=1, attempts=2, backoff=0.01)
+        dispatcher = MailDispatcher(backend=LocalBackend(), threaded=False)
+        broken = Future()
+        broken.set_exception(RuntimeError('Broken'))
+        deliveries.run(Delivery('mail', dispatcher.send, 'student@kots.io', 'WELCOME', 'Welcome!'))
+        deliveries.run(Delivery('mail', lambda: broken))
+        # The worker did not wait for the mail
+        self.assertEqual(deliveries.delivered, 0)
+        dispatcher.flush()
+        self.assertEqual(deliveries.delivered, 1)
+        self.assertEqual(deliveries.pending(), 1)
+
+    def test_delay(self):
+        deliveries = DeliveryQueue(backoff=1.0, max_backoff=30.0)
+        for attempts in range(1, 10):
+            self.assertLessEqual(deliveries.get_delay(attempts), min(30.0, 2 ** (attempts - 1)))
+
+
+class MailDispatcherTestCase(SimpleTestCase):
+
+    def test_batching(self):
+        backend = LocalBackend()
+        dispatcher = MailDispatcher(backend=backend, size=2, threaded=False)
+        futures = [dispatcher.send('student%s@kots.io' % i, 'EMAIL VERIFICATION', 'Code: -code-', {'-code-': str(i)})
+                   for i in range(3)]
+        futures.append(dispatcher.send('student@kots.io', 'WELCOME', 'Welcome!'))
+        self.assertEqual(dispatcher.flush(), 4)
+        self.assertEqual([future.result() for future in futures], [202] * 4)
+
+        self.assertEqual(dispatcher.requests, 3)
+        first, second, third = backend.outbox
+        self.assertEqual(first['content'], [{'type': 'text/plain', 'value': 'Code: -code-'}])
+        self.assertEqual(first['personalizations'], [
+            {'to': [{'email': 'student0@kots.io'}], 'substitutions': {'-code-': '0'}},
+            {'to': [{'email': 'student1@kots.io'}], 'substitutions': {'-code-': '1'}},
+        ])
+        self.assertEqual(len(second['personalizations']), 1)
+        self.assertEqual(third['subject'], 'WELCOME')
+
+    def test_failure(self):
+        class BrokenBackend(object):
+            def send(self, data):
+                return 400
+
+        mail = Mail('student@kots.io', '123456', dispatcher=MailDispatcher(backend=BrokenBackend(), window=0))
+        with self.assertRaises(RuntimeError):
+            mail.send()
+
+    def test_invalid_address(self):
+        class StrictBackend(LocalBackend):
+            def send(self, data):
+                if any(p['to'][0]['email'] == 'invalid' for p in data['personalizations']):
+                    return 400
+                return LocalBackend.send(self, data)
+
+        backend = StrictBackend()
+        dispatcher = MailDispatcher(backend=backend, threaded=False)
+        futures = [dispatcher.send(to, 'EMAIL VERIFICATION', 'Code: -code-', {'-code-': '123456'})
+                   for to in ['student1@kots.io', 'invalid', 'student2@kots.io']]
+        dispatcher.flush()
+
+        # Only the invalid address fails
+        self.assertEqual([futures[0].result(), futures[2].result()], [202, 202])
+        with self.assertRaises(RuntimeError):
+            futures[1].result()
+        self.assertEqual(dispatcher.requests, 4)
+        self.assertEqual(len(backend.outbox), 2)
+
+
+class WebhookUpdaterTestCase(SimpleTestCase):
+
+    def test_webhook(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        updater = WebhookUpdater('123456:token')
+        updater.start_webhook(listen='127.0.0.1', port=port, url_path='secret')
+        try:
+            for _ in range(500):
+                if getattr(updater, 'httpd', None) and updater.httpd.is_running:
+                    break
+                threading.Event().wait(0.01)
+            update = {'update_id': 1, 'message': {'message_id': 1, 'date': 0, 'text': 'Hi',
+                                                  'chat': {'id': 42, 'type': 'private'}}}
+            request = urllib.request.Request('http://127.0.0.1:%s/secret' % port, json.dumps(update).encode(),
+                                             headers={'Content-Type': 'application/json'})
+            self.assertEqual(urllib.request.urlopen(request).getcode(), 200)
+        finally:
+            updater.stop()
+
+    def test_webhook_url_required(self):
+        for runtime in ['threads', 'asyncio']:
+            with override_settings(CLASSREP_BOT_TOKEN='123456:token',
+                                   WEBHOOK={'URL': None, 'PATH': 'secret', 'LISTEN': '127.0.0.1', 'PORT': 0}):
+                with self.assertRaises(ImproperlyConfigured):
+                    conversation.main(mode='webhook', runtime=runtime)
+
+    def test_webhook_token_required(self):
+        webhook = {'URL': 'https://classrep.herokuapp.com', 'PATH': None, 'LISTEN': '127.0.0.1', 'PORT': 0}
+        for runtime in ['threads', 'asyncio']:
+            with override_settings(CLASSREP_BOT_TOKEN=None, WEBHOOK=webhook):
+                with self.assertRaises(ImproperlyConfigured):
+                    conversation.main(mode='webhook', runtime=runtime)
+
+
+class SharedStateTestCase(TestCase):
+    NAME = 0
+
+    def get_dispatcher(self):
+        def start(bot, update, user_data):
+            user_data['local'] = object()
+            return self.NAME
+
+        def name(bot, update, user_data):
+            user_data['name'] = update.message.text
+            self.names.append((update.message.text, 'local' in user_data))
+            return ConversationHandler.END
+
+        handler = ConversationHandler(
+            entry_points=[CommandHandler('start', start, pass_user_data=True)],
+            states={self.NAME: [MessageHandler(Filters.text, name, pass_user_data=True)]},
+            fallbacks=[],
+        )
+        dispatcher = Dispatcher(Bot('123456:token'), Queue())
+        dispatcher.add_handler(handler)
+        SharedState(DatabaseStore(), dispatcher, {'register': handler}).attach()
+        return dispatcher, handler
+
+    @staticmethod
+    def get_update(update_id, text):
+        return Update.de_json({'update_id': update_id, 'message': {
+            'message_id': update_id, 'date': 0, 'text': text,
+            'chat': {'id': 42, 'type': 'private'}, 'from': {'id': 42, 'first_name': 'Student'}}}, None)
+
+    def setUp(self):
+        self.names = []
+
+    def test_shared_conversation(self):
+        first, first_handler = self.get_dispatcher()
+        first.process_update(self.get_update(1, '/start'))
+        self.assertEqual(first_handler.conversations, {(42, 42): self.NAME})
+        self.assertEqual(ConversationState.objects.get(key='42').version, 1)
+
+        # Another process carries on with the conversation
+        second, second_handler = self.get_dispatcher()
+        second.process_update(self.get_update(2, 'Floyd Kots'))
+        self.assertEqual(self.names, [('Floyd Kots', False)])
+        self.assertEqual(second_handler.conversations, {})
+
+        # The first process no longer thinks the conversation is going on
+        first.process_update(self.get_update(3, 'Floyd Kots'))
+        self.assertEqual(self.names, [('Floyd Kots', False)])
+        self.assertEqual(first.user_data[42]['name'], 'Floyd Kots')
+        self.assertIn('local', first.user_data[42])
+
+        state = ConversationState.objects.get(key='42')
+        self.assertEqual(state.version, 2)
+
+    def test_stale_state(self):
+        store = DatabaseStore()
+        self.assertEqual(store.load('42'), ({}, 0))
+        self.assertEqual(store.save('42', {'user_data': {}}, 0), 1)
+        with self.assertRaises(StaleStateError):
+            store.save('42', {'user_data': {'name': 'Floyd'}}, 0)
+        self.assertEqual(store.save('42', {'user_data': {'name': 'Floyd'}}, 1), 2)
+        with self.assertRaises(StaleStateError):
+            store.save('42', {'user_data': {}}, 1)
+        self.assertEqual(store.load('42'), ({'user_data': {'name': 'Floyd'}}, 2))
+
+
+class FakeTelegram(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, ('127.0.0.1', 0), FakeTelegramHandler)
+        self.replies = Queue()
+
+
+class FakeTelegramHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        data = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        result = {'message_id': 1, 'date': 0, 'text': data.get('text'), 'chat': {'id': 42, 'type': 'private'}}
+        body = json.dumps({'ok': True, 'result': result}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if data.get('text') == 'chunked':
+            self.send_header('Transfer-Encoding', 'chunked')
+            self.end_headers()
+            for i in range(0, len(body), 10):
+                self.wfile.write(b'%x\r\n%s\r\n' % (len(body[i:i + 10]), body[i:i + 10]))
+            self.wfile.write(b'0\r\n\r\n')
+        else:
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        self.server.replies.put(data.get('text'))
+
+    def log_message(self, *args):
+        pass
+
+
+class AsyncRuntimeTestCase(SimpleTestCase):
+    NAME = 0
+
+    def setUp(self):
+        self.telegram = FakeTelegram()
+        threading.Thread(target=self.telegram.serve_forever, daemon=True).start()
+        self.runtime = AsyncRuntime('123456:token', base_url='http://127.0.0.1:%s/bot' % self.telegram.server_port,
+                                    workers=2, pool_size=2)
+        self.runtime.start()
+
+    def tearDown(self):
+        self.runtime.stop()
+        self.telegram.shutdown()
+        self.telegram.server_close()
+
+    @staticmethod
+    def get_update(update_id, text, chat_id=42):
+        return Update.de_json({'update_id': update_id, 'message': {
+            'message_id': update_id, 'date': 0, 'text': text,
+            'chat': {'id': chat_id, 'type': 'private'}, 'from': {'id': chat_id, 'first_name': 'Student'}}}, None)
+
+    def test_handlers(self):
+        runtime = self.runtime
+
+        async def ping(bot, update):
+            await runtime.call('sendMessage', chat_id=update.message.chat_id, text='pong')
+
+        def start(bot, update):
+            update.message.reply_text('Your name?')
+            return self.NAME
+
+        def name(bot, update):
+            update.message.reply_text('Hi %s' % update.message.text)
+            return ConversationHandler.END
+
+        handler = ConversationHandler(
+            entry_points=[CommandHandler('start', start)],
+            states={self.NAME: [MessageHandler(Filters.text, name)]},
+            fallbacks=[],
+        )
+        runtime.dispatcher.add_handler(CommandHandler('ping', ping))
+        runtime.dispatcher.add_handler(handler)
+
+        for update_id, text, chat_id in [(1, '/ping', 42), (2, '/start', 42), (3, '/start', 43),
+                                         (4, 'Floyd', 42), (5, 'Kots', 43)]:
+            update = self.get_update(update_id, text, chat_id)
+            update.message.bot = runtime.bot
+            runtime.dispatcher.update_queue.put(update)
+
+        replies = [self.telegram.replies.get(timeout=5) for _ in range(5)]
+        self.assertEqual(sorted(replies), ['Hi Floyd', 'Hi Kots', 'Your name?', 'Your name?', 'pong'])
+        # Each chat's updates are handled in order
+        self.assertLess(replies.index('Your name?'), replies.index('Hi Floyd'))
+        for _ in range(500):
+            if not handler.conversations:
+                break
+            threading.Event().wait(0.01)
+        self.assertEqual(handler.conversations, {})
+        self.assertLessEqual(runtime.pool.connections, 2)
+
+    def test_user_serialized(self):
+        active = []
+        overlaps = []
+        lock = threading.Lock()
+
+        def lessons(bot, update):
+            with lock:
+                active.append(update.update_id)
+                overlaps.append(len(active))
+            threading.Event().wait(0.05)
+            with lock:
+                active.remove(update.update_id)
+            update.message.reply_text('Lessons')
+
+        self.runtime.dispatcher.add_handler(CommandHandler('lessons', lessons))
+        # The same user, in private, and in a group
+        for update_id, chat in [(1, {'id': 42, 'type': 'private'}), (2, {'id': -1001, 'type': 'group'})]:
+            update = Update.de_json({'update_id': update_id, 'message': {
+                'message_id': update_id, 'date': 0, 'text': '/lessons', 'chat': chat,
+                'from': {'id': 42, 'first_name': 'Student'}}}, self.runtime.bot)
+            self.runtime.dispatcher.update_queue.put(update)
+
+        self.assertEqual([self.telegram.replies.get(timeout=5) for _ in range(2)], ['Lessons'] * 2)
+        self.assertEqual(overlaps, [1, 1])
+        # Until the second update's task is done
+        for _ in range(500):
+            if not self.runtime.dispatcher._locks:
+                break
+            threading.Event().wait(0.01)
+
+    def test_chunked_response(self):
+        message = self.runtime.bot.sendMessage(chat_id=42, text='chunked')
+        self.assertEqual(message.text, 'chunked')
+        self.runtime.bot.sendMessage(chat_id=42, text='again')
+        self.assertEqual(self.runtime.pool.connections, 1)
+
+    def test_blocking_call_on_loop(self):
+        async def reply():
+            return self.runtime.bot.sendMessage(chat_id=42, text='blocked')
+
+        future = asyncio.run_coroutine_threadsafe(reply(), self.runtime.loop)
+        with self.assertRaises(RuntimeError):
+            future.result(timeout=5)
+
+
+class SendQueueTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.sent = []
+        self.retry = set()
+
+    def send(self, chat_id, text):
+        if text in self.retry:
+            self.retry.discard(text)
+            raise RetryAfter(0.05)
+        self.sent.append((chat_id, text))
+        return text
+
+    def test_priority_and_rate_limits(self):
+        outbox = SendQueue(burst=2, threaded=False)
+        for i in range(3):
+            outbox.send(self.send, 1, BULK, text='reminder %s' % i)
+        outbox.send(self.send, 2, BULK, text='reminder')
+        outbox.send(self.send, 1, INTERACTIVE, text='reply')
+        self.assertEqual(outbox.depth(), {'interactive': 1, 'bulk': 4})
+
+        # The reply goes ahead of the reminders, and chat 1 only gets a burst of two at once
+        self.assertEqual(outbox.flush(), 3)
+        self.assertEqual(self.sent, [(1, 'reply'), (1, 'reminder 0'), (2, 'reminder')])
+        self.assertEqual(outbox.depth(), {'interactive': 0, 'bulk': 2})
+        self.assertEqual(outbox.stats()['sent'], 3)
+
+    def test_retry_after(self):
+        outbox = SendQueue(threaded=False)
+        self.retry.add('first')
+        first = outbox.send(self.send, 1, text='first')
+        second = outbox.send(self.send, 1, text='second')
+
+        # The chat is held back as long as Telegram asked, and its messages kept in order
+        self.assertEqual(outbox.flush(), 1)
+        self.assertEqual(outbox.retried, 1)
+        self.assertEqual(self.sent, [])
+        threading.Event().wait(0.06)
+        self.assertEqual(outbox.flush(), 2)
+        self.assertEqual(self.sent, [(1, 'first'), (1, 'second')])
+        self.assertEqual((first.result(), second.result()), ('first', 'second'))
+
+    def test_threaded(self):
+        outbox = SendQueue(workers=2)
+        futures = [outbox.send(self.send, chat_id, text='hello') for chat_id in range(10)]
+        self.assertEqual([future.result(timeout=5) for future in futures], ['hello'] * 10)
+        self.assertIsNotNone(outbox.stats()['latency_p95_ms'])
+
+
+class FakeBot(object):
+    def __init__(self, blocked=()):
+        self.sent = []
+        self.blocked = blocked
+
+    def sendMessage(self, chat_id, text, **kwargs):
+        if chat_id in self.blocked:
+            raise TelegramError('Forbidden: bot was blocked by the user')
+        self.sent.append((chat_id, text))
+
+
+class BroadcasterTestCase(TestCase):
+
+    def setUp(self):
+        course = Course.objects.create(name='BSc. Mechatronics Engineering')
+        self.student_class = StudentClass.objects.create(year=4, semester=2, course=course)
+        other_class = StudentClass.objects.create(year=3, semester=2, course=course)
+        Student.objects.create(name='Class Rep', student_class=self.student_class, chat_id=1, is_rep=True)
+        for chat_id in [2, 3, 4]:
+            Student.objects.create(name='Student %s' % chat_id, student_class=self.student_class, chat_id=chat_id)
+        Student.objects.create(name='SMS Student', student_class=self.student_class, mobile='+254701234567')
+        Student.objects.create(name='Other Student', student_class=other_class, chat_id=9)
+        lecturer = Lecturer.objects.create(name='Dr. Somebody', chat_id=5)
+        self.student_class.units.add(Unit.objects.create(code='EMT 2445', name='Research Methodology',
+                                                         lecturer=lecturer))
+
+        self.bot = FakeBot(blocked=[3])
+        self.outbox = SendQueue(threaded=False)
+        self.broadcaster = Broadcaster(outbox=self.outbox, threaded=False)
+
+    def test_recipients(self):
+        with self.assertNumQueries(1):
+            recipients = self.broadcaster.get_recipients(self.student_class)
+        self.assertEqual(sorted(recipients), [1, 2, 3, 4, 5])
+        self.assertEqual(self.broadcaster.get_classes(1), [self.student_class])
+        self.assertEqual(self.broadcaster.get_classes(5), [self.student_class])
+        self.assertEqual(self.broadcaster.get_classes(2), [])
+
+    def test_broadcast(self):
+        broadcast = self.broadcaster.send(self.bot, self.student_class, 1, 'The CAT is on Monday')
+        self.assertEqual(broadcast.total, 4)
+        self.assertEqual(self.outbox.flush(), 4)
+        self.assertEqual(sorted(chat_id for chat_id, text in self.bot.sent), [2, 4, 5])
+
+        # Two updates for each state, and the broadcast is finished, however many recipients it has
+        with self.assertNumQueries(9):
+            self.assertEqual(self.broadcaster.flush(), 4)
+        broadcast.refresh_from_db()
+        self.assertEqual((broadcast.status, broadcast.sent, broadcast.failed), (Broadcast.DONE, 3, 1))
+        self.assertEqual(broadcast.deliveries.get(chat_id=3).status, BroadcastDelivery.FAILED)
+
+        # The sender hears how it went
+        self.outbox.flush()
+        self.assertEqual(self.bot.sent[-1], (1, 'Your announcement to %s was delivered to 3 of 4 people.'
+                                             % self.student_class))
+
+    def test_resume(self):
+        broadcast = self.broadcaster.create(self.student_class, 1, 'The CAT is on Monday')
+        broadcast.deliveries.filter(chat_id__in=[2, 4]).update(status=BroadcastDelivery.SENT)
+
+        self.assertEqual(self.broadcaster.resume(self.bot), 2)
+        self.outbox.flush()
+        self.assertEqual(self.bot.sent, [(5, 'The CAT is on Monday')])
+
+    def test_sender_blocked(self):
+        bot = FakeBot(blocked=[1])
+        self.broadcaster.send(bot, self.student_class, 1, 'The CAT is on Monday')
+        self.outbox.flush()
+        self.broadcaster.flush()
+        with self.assertLogs('chats.broadcast', 'WARNING') as logs:
+            self.outbox.flush()
+        self.assertIn('Failed to tell 1 how broadcast', logs.output[0])
+
+    def test_resume_once(self):
+        broadcast = self.broadcaster.create(self.student_class, 1, 'The CAT is on Monday')
+        self.assertEqual(self.broadcaster.resume(self.bot), 4)
+        # Another process leaves the claimed deliveries be, until the claim lapses
+        other = Broadcaster(outbox=SendQueue(threaded=False), lease=0, threaded=False)
+        self.assertEqual(Broadcaster(outbox=other.outbox, threaded=False).resume(self.bot), 0)
+        self.assertEqual(other.resume(self.bot), 4)
+        self.assertEqual(broadcast.deliveries.filter(status=BroadcastDelivery.QUEUED).count(), 4)
+
+        self.outbox.flush()
+        self.broadcaster.flush()
+        broadcast.refresh_from_db()
+        self.assertEqual((broadcast.status, broadcast.sent, broadcast.failed), (Broadcast.DONE, 3, 1))
+
+
+class GroupRegistryTestCase(TestCase):
+
+    def setUp(self):
+        course = Course.objects.create(name='BSc. Mechatronics Engineering')
+        self.student_class = StudentClass.objects.create(year=4, semester=2, course=course)
+        Student.objects.create(name='Class Rep', student_class=self.student_class, chat_id=1, is_rep=True)
+        get_group_registry().load()
+
+    @staticmethod
+    def get_message(chat_id, **kwargs):
+        data = {'message_id': 1, 'date': 0, 'chat': {'id': chat_id, 'type': 'group', 'title': 'Mechatronics'},
+                'from': {'id': 1, 'first_name': 'Rep'}}
+        data.update(kwargs)
+        return Update.de_json({'update_id': 1, 'message': data}, None).message
+
+    def test_registry(self):
+        registry = get_group_registry()
+        registry.register(-1001, 'Mechatronics', user_id=1)
+        registry.register(-1002, 'Unknown', user_id=2)
+        self.assertEqual(GroupChat.objects.count(), 2)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(registry.get(-1001), self.student_class.pk)
+            self.assertIsNone(registry.get(-1002))
+            self.assertIsNone(registry.get(-1003))
+            chat = get_chat(self.get_message(-1001), 2)
+        self.assertEqual(chat.student.student_class_id, self.student_class.pk)
+
+        # A new process loads the groups in a single query
+        with self.assertNumQueries(1):
+            self.assertEqual(GroupRegistry().get(-1001), self.student_class.pk)
+
+        registry.migrate(-1001, -1009)
+        self.assertEqual(registry.get(-1009), self.student_class.pk)
+        self.assertEqual(GroupRegistry().get(-1009), self.student_class.pk)
+        self.assertNotIn(-1001, registry)
+
+    def test_failed_reply(self):
+        future = Future()
+        future.set_exception(TelegramError('Forbidden: bot was kicked from the group chat'))
+        with self.assertLogs('timetable.chats.group_chat', 'WARNING') as logs:
+            future.add_done_callback(sent(-1001))
+        self.assertIn('Failed to reply in -1001', logs.output[0])
+
+    def test_group_status(self):
+        bot = FakeBot()
+        bot.id = 99
+        group_status(bot, Update.de_json({'update_id': 1, 'message': {
+            'message_id': 1, 'date': 0, 'chat': {'id': -1001, 'type': 'group', 'title': 'Mechatronics'},
+            'from': {'id': 1, 'first_name': 'Rep'}, 'new_chat_member': {'id': 99, 'first_name': 'ClassRep'}}}, None))
+        self.assertEqual(get_group_registry().get(-1001), self.student_class.pk)
+
+        group_status(bot, Update.de_json({'update_id': 2, 'message': {
+            'message_id': 2, 'date': 0, 'chat': {'id': -1001, 'type': 'group', 'title': 'Mechatronics'},
+            'from': {'id': 1, 'first_name': 'Rep'}, 'left_chat_member': {'id': 99, 'first_name': 'ClassRep'}}}, None))
+        self.assertNotIn(-1001, get_group_registry())
+        self.assertFalse(GroupChat.objects.exists())
+
+
+class ClassDirectoryTestCase(TestCase):
+
+    def setUp(self):
+        get_class_directory().invalidate()
+        self.course = Course.objects.create(name='BSc. Mechatronics Engineering')
+        self.classes = [StudentClass.objects.create(year=year, semester=2, course=self.course) for year in (1, 4)]
+
+    def test_directory(self):
+        labels = ['BSc. Mechatronics Engineering First Year', 'BSc. Mechatronics Engineering Fourth Year']
+        with self.assertNumQueries(1):
+            self.assertEqual(GeneralChat.get_student_classes(), labels)
+            self.assertTrue(GeneralChat.valid_student_class(labels[1]))
+        # A label that isn't found is looked for again in a fresh load
+        with self.assertNumQueries(1):
+            self.assertFalse(GeneralChat.valid_student_class('BSc. Mechatronics Engineering Fifth Year'))
+
+        chat = GeneralChat('5')
+        chat.is_student()
+        chat.add_student({'name': 'Student Somebody', 'mobile': '+254701234567', 'email': 'stud@students.jkuat.ac.ke',
+                          'student_class': labels[1], 'username': 'studsome', 'chat_id': '5'})
+        self.assertEqual(Student.objects.get(chat_id='5').student_class, self.classes[1])
+
+        # Renaming the course is picked up
+        self.course.name = 'BSc. Mechatronic Engineering'
+        self.course.save()
+        self.assertTrue(GeneralChat.valid_student_class('BSc. Mechatronic Engineering First Year'))
+
+        # So is a class made by another process, whose signals don't reach this one
+        StudentClass.objects.bulk_create([StudentClass(year=5, semester=2, course=self.course)])
+        self.assertTrue(GeneralChat.valid_student_class('BSc. Mechatronic Engineering Fifth Year'))
+
+
+class ChatIdentityTestCase(TestCase):
+
+    def setUp(self):
+        get_identity_cache().clear()
+        course = Course.objects.create(name='BSc. Mechatronics Engineering')
+        self.student_class = StudentClass.objects.create(year=4, semester=2, course=course)
+        self.student = Student.objects.create(name='Student Somebody', student_class=self.student_class, chat_id='1')
+        StudentChat.objects.create(student=self.student, chat_id='1')
+        self.lecturer = Lecturer.objects.create(name='Dr. Somebody', chat_id='2')
+        LecturerChat.objects.create(lecturer=self.lecturer, chat_id='2')
+
+    def test_identity(self):
+        with self.assertNumQueries(3):
+            self.assertFalse(GeneralChat(1).new)
+            self.assertFalse(GeneralChat(2).new)
+            self.assertTrue(GeneralChat(3).new)
+
+        # Warm, telling who is chatting takes no queries, and their chats are loaded on use
+        with self.assertNumQueries(0):
+            chat = GeneralChat(1)
+            self.assertEqual(chat.identity, (STUDENT, self.student.pk, self.student_class.pk))
+            self.assertEqual(GeneralChat(2).identity.role, LECTURER)
+        with self.assertNumQueries(1):
+            self.assertEqual(chat.student_chat.student_id, self.student.pk)
+            self.assertIsNone(chat.lecturer_chat)
+
+        # Registering is picked up
+        Student.objects.create(name='Student Newcomer', student_class=self.student_class, chat_id='3')
+        self.assertFalse(GeneralChat(3).new)
+        self.lecturer.chat_id = '4'
+        self.lecturer.save()
+        self.assertTrue(GeneralChat(2).new)
+        self.assertEqual(GeneralChat(4).identity.pk, self.lecturer.pk)
+
+    def test_ttl(self):
+        identities = IdentityCache(ttl=0)
+        self.assertEqual(identities.get(1).role, STUDENT)
+        # Deleted without this cache hearing of it, as if in another process
+        Student.objects.filter(pk=self.student.pk).delete()
+        self.assertIsNone(identities.get(1).role)
+
+    def test_group_lessons(self):
+        message = Update.de_json({'update_id': 1, 'message': {
+            'message_id': 1, 'date': 0, 'chat': {'id': -1005, 'type': 'group', 'title': 'Unknown'},
+            'from': {'id': 1, 'first_name': 'Student'}}}, None).message
+        get_group_registry().load()
+        get_chat(message, 1).get_day_lessons_string('Monday')
+
+        # Warm, a group's /lessons takes no queries, not even to tell who asked
+        with self.assertNumQueries(0):
+            chat = get_chat(message, 1)
+            chat.get_day_lessons_string('Monday')
+        self.assertEqual(chat.student.pk, self.student.pk)
+        self.assertIsNone(get_chat(message, 2))
@@ -1,92 +1,84 @@
-import time
-import sendgrid
-import smtplib
-from sendgrid.helpers.mail import Mail as Sendgrid_Mail
-from sendgrid.helpers.mail import *
-from urllib.error import HTTPError
-from io import BytesIO
-from django.conf import settings
+import logging
 from chats.models import StudentChat, LecturerChat
 from timetable.models import StudentClass, Student, Lecturer
+from timetable.classes import get_class_directory
+from timetable.identity import get_identity_cache, STUDENT, LECTURER
 from django.utils.crypto import get_random_string
 from telegram import (ReplyKeyboardMarkup, ReplyKeyboardRemove, KeyboardButton)
-from general.AfricasTalkingGateway import AfricasTalkingGateway, AfricasTalkingGatewayException
+from general.delivery import get_delivery_queue
+from general.mail import get_mail_dispatcher
+from general.sms import get_sms_dispatcher
 
-from telegram.ext.dispatcher import run_async
+logger = logging.getLogger(__name__)
 
 
 class Text(object):
-    username = settings.USERNAME
-    apikey = settings.APIKEY
     sender = "KOTS"
 
-    def __init__(self, mobile, code):
+    def __init__(self, mobile, code, dispatcher=None):
         self.mobile = mobile
-        self.gateway = AfricasTalkingGateway(self.username, self.apikey)
+        self.dispatcher = dispatcher or get_sms_dispatcher()
         self.code = code
 
-    def send(self):
-        message = "CLASS REP Verification Code: %s" % self.code
+    def send(self, timeout=60):
+        """
+        Queues the verification code on the SMS dispatcher, which batches it with the other texts
+        going out, and waits for its status.
 
-        try:
-            results = self.gateway.sendMessage(
-                to_=self.mobile,
-                message_=message,
-                from_=self.sender
-            )
-            for recipient in results:
-                # status is either "Success" or "error message"
-                print('number=%s;status=%s;messageId=%s;cost=%s' % (
-                    recipient['number'],
-                    recipient['status'],
-                    recipient['messageId'],
-                    recipient['cost']))
+        Returns:
+            general.sms.SMSStatus
 
-        except AfricasTalkingGatewayException as e:
-                print('Encountered an error while sending: %s' % str(e))
+        Raises:
+            RuntimeError: If the text was not sent.
+        """
+        message = "CLASS REP Verification Code: %s" % self.code
+
+        status = self.dispatcher.send(self.mobile, message, sender=self.sender).result(timeout)
+        if not status.success:
+            logger.warning("Verification text to %s failed: %s", status.number, status.status)
+            raise RuntimeError(status.status)
+        logger.info("Verification text to %s sent, messageId=%s, cost=%s", status.number, status.message_id,
+                    status.cost)
+        return status
 
 
 class Mail(object):
-    host = settings.HOST
-    username = settings.USERNAME
-    password = settings.PASSWORD
-    apikey = settings.SENDGRID_API_KEY
-    from_address = "classrep@kots.io"
+    subject = "EMAIL VERIFICATION"
 
-    def __init__(self, to, code):
+    def __init__(self, to, code, dispatcher=None):
         self.to = to
         self.code = code
-
-    def send(self):
-        message = "CLASS REP Verification Code: %s" % self.code
-        sg = sendgrid.SendGridAPIClient(
-            apikey=self.apikey
+        self.dispatcher = dispatcher or get_mail_dispatcher()
+
+    def queue(self):
+        """
+        Queues the verification code on the mail dispatcher, which sends it in a single request
+        with the other codes going out.
+
+        Returns:
+            :class: `concurrent.futures.Future`: Resolves to the request's status code. Fails if
+                the request failed.
+        """
+        return self.dispatcher.send(
+            self.to,
+            self.subject,
+            "CLASS REP Verification Code: -code-",
+            {'-code-': self.code}
         )
 
-        email = Sendgrid_Mail()
-        email.set_from(Email('classrep@kots.io'))
-        email.set_subject("EMAIL VERIFICATION")
-        email.add_content(Content("text/plain", message))
-        personalization = Personalization()
-        personalization.add_to(Email(self.to))
-        email.add_personalization(personalization)
-        tracking_settings = TrackingSettings()
-        tracking_settings.set_click_tracking(
-            ClickTracking(True, True))
-        tracking_settings.set_open_tracking(OpenTracking(True))
-        email.set_tracking_settings(tracking_settings)
-
-        data = email.get()
+    def send(self, timeout=60):
+        """
+        Like :func: `~chats.utils.Mail.queue`, but waits for the request.
 
-        try:
-            response = sg.client.mail.send.post(request_body=data)
-            print(response.status_code)
-            if response.status_code < 200 or response.status_code >= 300:
-                raise RuntimeError
-        except HTTPError as HE:
-            msg = HE.read()
-            print(msg)
-            raise HTTPError(HE.url, HE.code, HE.reason, HE.headers, BytesIO(msg))
+        Returns:
+            int: The request's status code.
+
+        Raises:
+            RuntimeError: If the request failed.
+        """
+        status_code = self.queue().result(timeout)
+        logger.info("Verification mail to %s sent, status %s", self.to, status_code)
+        return status_code
 
 
 class GeneralChat(object):
@@ -97,23 +89,41 @@ class GeneralChat(object):
         )]
     # Verification status
     already_verified, newly_verified, fully_verified, failed_verification = range(4)
+    # Marks the chats not loaded yet
+    unloaded = object()
 
     def __init__(self, chat_id):
         assert chat_id is not None
         self.chat_id = chat_id
-        self.student_chat = None
-        self.lecturer_chat = None
-        try:
-            self.student_chat = StudentChat.objects.get(chat_id=chat_id)
-            if StudentChat.objects.get(student__chat_id=chat_id):
-                self.new = False
-        except StudentChat.DoesNotExist:
-            try:
-                self.lecturer_chat = LecturerChat.objects.get(chat_id=chat_id)
-                if LecturerChat.objects.get(lecturer__chat_id=chat_id):
-                    self.new = False
-            except LecturerChat.DoesNotExist:
-                self.new = True
+        # Who is chatting is told by the identity cache, in a query at most. Their chat, with its
+        # verification codes, is only loaded if it's used.
+        self.identity = get_identity_cache().get(chat_id)
+        self.new = self.identity.role is None
+        self._student_chat = self._lecturer_chat = self.unloaded
+
+    @property
+    def student_chat(self):
+        if self._student_chat is self.unloaded:
+            self._student_chat = None
+            if self.identity.role != LECTURER:
+                self._student_chat = StudentChat.objects.filter(chat_id=self.chat_id).first()
+        return self._student_chat
+
+    @student_chat.setter
+    def student_chat(self, student_chat):
+        self._student_chat = student_chat
+
+    @property
+    def lecturer_chat(self):
+        if self._lecturer_chat is self.unloaded:
+            self._lecturer_chat = None
+            if self.identity.role != STUDENT and not self.student_chat:
+                self._lecturer_chat = LecturerChat.objects.filter(chat_id=self.chat_id).first()
+        return self._lecturer_chat
+
+    @lecturer_chat.setter
+    def lecturer_chat(self, lecturer_chat):
+        self._lecturer_chat = lecturer_chat
 
     def is_student(self):
         self.student_chat, created = StudentChat.objects.get_or_create(
@@ -166,24 +176,20 @@ class GeneralChat(object):
     @staticmethod
     def get_student_classes(as_objects=False):
         if as_objects:
-            return [s_class for s_class in StudentClass.objects.all()]
+            return list(StudentClass.objects.select_related('course'))
         else:
-            return [str(s_class) for s_class in StudentClass.objects.all()]
+            return get_class_directory().labels()
 
     @staticmethod
     def valid_student_class(student_class):
-        return student_class in GeneralChat.get_student_classes()
+        return student_class in get_class_directory()
 
     def add_student(self, user_data):
-        s_class_dict = {}
-        for s_class in StudentClass.objects.all():
-            s_class_dict.update({str(s_class): s_class})
-
         student = Student.objects.create(
             name=user_data['name'],
             mobile=user_data['mobile'],
             email=user_data['email'],
-            student_class=s_class_dict[user_data['student_class']],
+            student_class_id=get_class_directory().get(user_data['student_class']),
             username=user_data['username'],
             chat_id=user_data['chat_id']
         )
@@ -276,33 +282,22 @@ class GeneralChat(object):
         return GeneralChat.failed_verification
 
     @staticmethod
-    @run_async
     def text_verification_code(mobile, code):
         text = Text(
             mobile=mobile,
             code=code
         )
-        for count in range(5):
-            try:
-                text.send()
-                break
-            except:
-                time.sleep(3)
+        # Retried, with a backoff, by the delivery queue's workers
+        return get_delivery_queue().put('sms', text.send)
 
     @staticmethod
-    @run_async
     def mail_verification_code(email, code):
         mail = Mail(
             to=email,
             code=code
         )
-        for count in range(5):
-            try:
-                mail.send()
-                print("Sent mail successfully!")
-                break
-            except Exception as e:
-                print(e)
+        # The worker doesn't wait for the mail, so that it's batched with the others going out
+        return get_delivery_queue().put('mail', mail.queue)
 
 
 
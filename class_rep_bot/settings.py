@@ -140,18 +140,139 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# TIMETABLE CACHE
+# Rendered timetables, per class. The edits made through the admin, or by `import_timetable`, reach
+# the bot's worker within `ttl` seconds. 'timetable.cache.DjangoCacheBackend' shares them at once,
+# given a shared cache, like memcached, configured in CACHES.
+TIMETABLE_CACHE = {
+    'BACKEND': 'timetable.cache.LRUBackend',
+    'OPTIONS': {'maxsize': 1024, 'ttl': 60},
+}
+
+# UNIT INDEX
+# Seconds the in-memory unit search indexes are kept, before they're loaded again, to pick up the
+# units edited in other processes.
+UNIT_INDEX = {
+    'TTL': 60,
+}
+
+# LESSON REMINDERS
+# Minutes before a lesson that its reminder is sent, and minutes of lessons queued at a time.
+REMINDER_LEAD = 15
+REMINDER_HORIZON = 60
+
+# SMS BATCHING
+# Seconds the texts are gathered for, and the most recipients of a single request to the gateway.
+SMS_BATCH = {
+    'WINDOW': 0.5,
+    'SIZE': 100,
+}
+
+# TELEGRAM SEND QUEUE
+# Telegram's flood limits: calls a second overall, to a private chat, and to a group, and the most
+# calls to a chat at once.
+SEND_QUEUE = {
+    'RATE': 30.0,
+    'CHAT_RATE': 1.0,
+    'GROUP_RATE': 20 / 60,
+    'BURST': 3,
+    'WORKERS': 8,
+    'ATTEMPTS': 3,
+}
+
+# BROADCASTS
+# The most delivery states written at a time, seconds between the writes, and seconds after which
+# the deliveries a process claimed, but didn't record, may be sent by another process.
+BROADCAST = {
+    'BATCH': 500,
+    'INTERVAL': 1.0,
+    'LEASE': 600.0,
+}
+
+# IDENTITY CACHE
+# The most chats whose identities, student, lecturer or new, are kept in memory, and for how many
+# seconds, for the students and lecturers edited in the admin to be picked up.
+IDENTITY_CACHE = {
+    'MAXSIZE': 10000,
+    'TTL': 60,
+}
+
+# INLINE QUERIES
+# Seconds Telegram may cache a user's answer, the most classes whose results are kept in memory,
+# and the most units in an answer.
+INLINE_QUERIES = {
+    'CACHE_TIME': 300,
+    'MAXSIZE': 10000,
+    'LIMIT': 10,
+}
+
+# OUTBOUND DELIVERIES
+# The worker threads and size of the queue of verification texts and mails, and their retries.
+# Backoffs are in seconds.
+DELIVERY_QUEUE = {
+    'WORKERS': 4,
+    'MAXSIZE': 1000,
+    'ATTEMPTS': 5,
+    'BACKOFF': 1.0,
+    'MAX_BACKOFF': 30.0,
+}
+
 # AFRICASTALKING CREDENTIALS
 USERNAME = os.environ.get("username")
 APIKEY = os.environ.get("apikey")
 
+# The keep-alive connection pool to the AfricasTalking API. Timeouts are in seconds.
+AFRICASTALKING_HTTP = {
+    'POOL_SIZE': 10,
+    'CONNECT_TIMEOUT': 5.0,
+    'READ_TIMEOUT': 30.0,
+    'RETRIES': 3,
+    'BACKOFF_FACTOR': 0.5,
+}
+
 # SENDGRID CREDENTIALS
 HOST = "smtp.sendgrid.net"
 USER = os.environ.get("USER")
 PASSWORD = os.environ.get("PASSWORD")
 SENDGRID_API_KEY = os.environ.get("SENDGRID_API_KEY")
+
+# The mail transport. 'general.mail.LocalBackend' sends nothing, for measuring offline.
+MAIL_BACKEND = {
+    'BACKEND': 'general.mail.SendGridBackend',
+    'OPTIONS': {},
+}
 EMAIL_USE_TLS = True
 SERVER_EMAIL = 'webmaster@class-rep-bot.kots.io'
 ADMINS = (('Floyd Kots', 'floydkots@gmail.com'),)
 
 # CLASSREP_BOT TOKEN
-CLASSREP_BOT_TOKEN = os.environ.get("TOKEN")
\ No newline at end of file
+CLASSREP_BOT_TOKEN = os.environ.get("TOKEN")
+
+# CONVERSATION STATE
+# Where the conversations' states and user_data are kept, so that several bot processes can share them.
+# 'chats.state.RedisStore' takes a 'url' option.
+CONVERSATION_STORE = {
+    'BACKEND': 'chats.state.DatabaseStore',
+    'OPTIONS': {},
+}
+
+# TELEGRAM UPDATES
+# Either 'polling', or 'webhook', where the updates are posted by Telegram to URL/PATH, and received
+# on LISTEN:PORT. PATH should be kept secret, so it defaults to the token.
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+WEBHOOK = {
+    'URL': os.environ.get("WEBHOOK_URL"),
+    'PATH': os.environ.get("WEBHOOK_PATH", CLASSREP_BOT_TOKEN),
+    'LISTEN': '0.0.0.0',
+    'PORT': int(os.environ.get("PORT", 8443)),
+}
+
+# Either 'threads', for python-telegram-bot's updater, or 'asyncio', where the updates are handled as
+# tasks on an event loop. The blocking handlers, and the database, are then run on EXECUTOR_WORKERS
+# threads, and the calls to Telegram share POOL_SIZE keep-alive connections.
+BOT_RUNTIME = os.environ.get("BOT_RUNTIME", "threads")
+ASYNC_RUNTIME = {
+    'EXECUTOR_WORKERS': 16,
+    'POOL_SIZE': 20,
+    'CONCURRENCY': 500,
+}
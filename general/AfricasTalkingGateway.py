@@ -13,20 +13,51 @@
 """
 
 import json
-import urllib.error
+import threading
 import urllib.parse
-import urllib.request
+
+import certifi
+import urllib3
+from urllib3.util.retry import Retry
 
 
 class AfricasTalkingGatewayException(Exception):
     pass
 
 
+# Connection pools shared by all the gateways with the same settings, keyed by those settings
+_pools = {}
+_poolsLock = threading.Lock()
+
+
+def getConnectionPool(poolSize_=10, connectTimeout_=5.0, readTimeout_=30.0, retries_=3, backoffFactor_=0.5):
+    """
+    Get a keep-alive connection pool, so that every request doesn't pay for a new TCP and TLS handshake.
+
+    Failed connections are retried, with an exponential backoff, for every request. Failed reads and
+    5xx responses are only retried for GET requests, since a POST, like sending a message, may
+    have gone through.
+    """
+    key = (poolSize_, connectTimeout_, readTimeout_, retries_, backoffFactor_)
+    with _poolsLock:
+        if key not in _pools:
+            _pools[key] = urllib3.PoolManager(
+                num_pools=4,
+                maxsize=poolSize_,
+                timeout=urllib3.Timeout(connect=connectTimeout_, read=readTimeout_),
+                retries=Retry(total=retries_, backoff_factor=backoffFactor_,
+                              status_forcelist=(500, 502, 503, 504), raise_on_status=False),
+                cert_reqs='CERT_REQUIRED',
+                ca_certs=certifi.where())
+        return _pools[key]
+
+
 class AfricasTalkingGateway:
-    def __init__(self, username_, apiKey_, environment_='production'):
+    def __init__(self, username_, apiKey_, environment_='production', pool_=None):
         self.username = username_
         self.apiKey = apiKey_
         self.environment = environment_
+        self.pool = pool_ or getConnectionPool()
 
         self.HTTP_RESPONSE_OK = 200
         self.HTTP_RESPONSE_CREATED = 201
@@ -274,43 +305,34 @@ class AfricasTalkingGateway:
 
     # HTTP access method
     def sendRequest(self, urlString, data_=None):
-        try:
-            headers = {'Accept': 'application/json',
-                       'apikey': self.apiKey}
-            if data_ is not None:
-                data = urllib.parse.urlencode(data_)
-                request = urllib.request.Request(urlString, data.encode(), headers=headers)
-            else:
-                request = urllib.request.Request(urlString, headers=headers)
-            response = urllib.request.urlopen(request)
-        except urllib.error.HTTPError as e:
-            raise AfricasTalkingGatewayException(e.read())
-        else:
-            self.responseCode = response.getcode()
-            response = b''.join(response.readlines())
-            if self.Debug:
-                print("Raw response: " + response.decode())
-
-            return response
+        headers = {'Accept': 'application/json',
+                   'apikey': self.apiKey}
+        if data_ is not None:
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+            return self.urlopen('POST', urlString, urllib.parse.urlencode(data_).encode(), headers)
+        return self.urlopen('GET', urlString, None, headers)
 
     def sendJSONRequest(self, urlString, data_):
+        headers = {'Accept': 'application/json',
+                   'Content-Type': 'application/json',
+                   'apikey': self.apiKey}
+        if isinstance(data_, str):
+            data_ = data_.encode()
+        return self.urlopen('POST', urlString, data_, headers)
+
+    def urlopen(self, method, urlString, body, headers):
         try:
-            headers = {'Accept': 'application/json',
-                       'Content-Type': 'application/json',
-                       'apikey': self.apiKey}
-            request = urllib.request.Request(urlString,
-                                             data_,
-                                             headers=headers)
-            response = urllib.request.urlopen(request)
-        except urllib.error.HTTPError as e:
-            raise AfricasTalkingGatewayException(e.read())
-        else:
-            self.responseCode = response.getcode()
-            response = ''.join(response.readlines())
-            if self.Debug:
-                print("Raw response: " + response)
+            response = self.pool.urlopen(method, urlString, body=body, headers=headers)
+        except urllib3.exceptions.HTTPError as e:
+            raise AfricasTalkingGatewayException(str(e))
+        if response.status >= 400:
+            raise AfricasTalkingGatewayException(response.data)
+
+        self.responseCode = response.status
+        if self.Debug:
+            print("Raw response: " + response.data.decode())
 
-            return response
+        return response.data
 
     def getApiHost(self):
         if self.environment == 'sandbox':
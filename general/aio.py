@@ -0,0 +1,458 @@
+"""
+This module contains the asyncio runtime of the bot, of:
+    1. :class: `general.aio.AsyncConnectionPool`
+    2. :class: `general.aio.AsyncRequest`
+    3. :class: `general.aio.AsyncDispatcher`
+    4. :class: `general.aio.AsyncRuntime`
+
+The runtime handles the updates as tasks on an event loop, instead of on a handful of threads.
+All the calls to the Telegram API go through a single pool of keep-alive connections on that loop,
+so hundreds of conversations may be waiting on Telegram at once without hundreds of threads.
+
+Handlers whose callbacks are coroutines run on the loop, and may reach the database through
+:func: `~general.aio.AsyncRuntime.orm`. The existing, blocking handlers keep working as they are:
+they are run on a bounded executor, where the ORM calls belong, and their `reply_text` and other
+bot calls are handed over to the loop's connection pool by :class: `general.aio.AsyncRequest`.
+"""
+
+import asyncio
+import functools
+import json
+import logging
+import ssl
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+from telegram import Bot, Update
+from telegram.error import TelegramError, Unauthorized, BadRequest, InvalidToken, NetworkError, TimedOut
+from telegram.ext import ConversationHandler, JobQueue
+from telegram.utils.helpers import extract_chat_and_user
+from telegram.utils.request import Request
+from telegram.utils.webhookhandler import WebhookHandler
+from general.webhook import ThreadedWebhookServer
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncConnectionPool(object):
+    """
+    A pool of keep-alive HTTP/1.1 connections, on an event loop.
+
+    Attributes:
+        maxsize (int): The most requests in flight at once, across all the hosts.
+        connections (int): The number of connections opened so far.
+        loop_thread (int): The identifier of the loop's thread, once the loop is running. None
+            until then.
+
+    Args:
+        maxsize (Optional[int]): As above. Default is 20.
+        loop (Optional[:class: `asyncio.AbstractEventLoop`]): The loop. Default is the current one.
+    """
+    def __init__(self, maxsize=20, loop=None):
+        self.maxsize = maxsize
+        self.loop = loop or asyncio.get_event_loop()
+        self.connections = 0
+        self.loop_thread = None
+        self._idle = defaultdict(list)
+        # Made on the loop, by the first request, since it belongs to the loop that makes it
+        self._semaphore = None
+        self._ssl = ssl.create_default_context()
+
+    async def _connect(self, scheme, host, port):
+        self.connections += 1
+        return await asyncio.open_connection(
+            host, port, ssl=self._ssl if scheme == 'https' else None)
+
+    async def request(self, method, url, body=None, headers=None, timeout=None):
+        """
+        Makes a request, over an idle connection to the host if there is one.
+
+        Args:
+            method (str): Like 'POST'.
+            url (str): The URL.
+            body (Optional[bytes]): The request's body.
+            headers (Optional[dict]): The request's headers.
+            timeout (Optional[float]): Seconds to wait for the response.
+
+        Returns:
+            tuple: Of the form (status, data)
+        """
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        key = (parts.scheme, parts.hostname, port)
+        target = parts.path + ('?' + parts.query if parts.query else '')
+
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.maxsize)
+        async with self._semaphore:
+            idle = self._idle[key]
+            reused = bool(idle)
+            connection = idle.pop() if reused else await self._connect(*key)
+            try:
+                response = await asyncio.wait_for(
+                    self._send(connection, method, target, parts.netloc, body or b'', headers or {}),
+                    timeout)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                connection[1].close()
+                if not reused:
+                    raise
+                # The server closed the idle connection, before it got the request
+                connection = await self._connect(*key)
+                response = await asyncio.wait_for(
+                    self._send(connection, method, target, parts.netloc, body or b'', headers or {}),
+                    timeout)
+            except BaseException:
+                connection[1].close()
+                raise
+
+            status, data, keep_alive = response
+            if keep_alive:
+                idle.append(connection)
+            else:
+                connection[1].close()
+            return status, data
+
+    @staticmethod
+    async def _send(connection, method, target, host, body, headers):
+        reader, writer = connection
+        lines = ['%s %s HTTP/1.1' % (method, target), 'Host: %s' % host, 'Content-Length: %s' % len(body)]
+        lines.extend('%s: %s' % header for header in headers.items())
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError('The connection was closed')
+        version, status = status_line.split()[:2]
+        response_headers = dict()
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, value = line.decode('latin-1').split(':', 1)
+            response_headers[name.strip().lower()] = value.strip()
+
+        keep_alive = version == b'HTTP/1.1' and response_headers.get('connection', '').lower() != 'close'
+        if response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readexactly(2)
+            data = b''.join(chunks)
+        elif 'content-length' in response_headers:
+            data = await reader.readexactly(int(response_headers['content-length']))
+        else:
+            data = await reader.read()
+            keep_alive = False
+        return int(status), data, keep_alive
+
+    def close(self):
+        for connections in self._idle.values():
+            for reader, writer in connections:
+                writer.close()
+        self._idle.clear()
+
+
+class AsyncRequest(Request):
+    """
+    Makes the bot's requests through an :class: `general.aio.AsyncConnectionPool`, for a
+    :class: `telegram.Bot`. Called from any thread but the loop's, it waits for the response.
+
+    Args:
+        pool (:class: `general.aio.AsyncConnectionPool`): The pool.
+        timeout (Optional[float]): Seconds to wait for a response, unless the call says otherwise.
+            Default is 30.
+    """
+    def __init__(self, pool, timeout=30.0):
+        self.pool = pool
+        self.timeout = timeout
+
+    def stop(self):
+        self.pool.loop.call_soon_threadsafe(self.pool.close)
+
+    @classmethod
+    def check(cls, status, data):
+        """
+        Raises the library's errors for the failed responses, like `Request` does.
+
+        Returns:
+            bytes: The response's data.
+        """
+        if 200 <= status <= 299:
+            return data
+        try:
+            message = cls._parse(data)
+        except ValueError:
+            raise NetworkError('Unknown HTTPError {0}'.format(status))
+        if status in (401, 403):
+            raise Unauthorized()
+        elif status == 400:
+            raise BadRequest(repr(message))
+        elif status == 404:
+            raise InvalidToken()
+        elif status == 502:
+            raise NetworkError('Bad Gateway')
+        raise NetworkError('{0} ({1})'.format(message, status))
+
+    async def request_async(self, method, url, body=None, headers=None, timeout=None):
+        try:
+            status, data = await self.pool.request(method, url, body, headers, timeout or self.timeout)
+        except asyncio.TimeoutError:
+            raise TimedOut()
+        except OSError as e:
+            raise NetworkError('Connection failed: {0}'.format(e))
+        return self.check(status, data)
+
+    async def post_async(self, url, data, timeout=None):
+        """
+        Like `post`, as a coroutine, for the handlers that run on the loop.
+        """
+        result = await self.request_async('POST', url, json.dumps(data).encode(),
+                                          {'Content-Type': 'application/json'}, timeout)
+        return self._parse(result)
+
+    def _request_wrapper(self, method, url, body=None, headers=None, timeout=None, **kwargs):
+        if threading.get_ident() == self.pool.loop_thread:
+            raise RuntimeError("Blocking bot calls can't be made on the loop. Use AsyncRuntime.call instead.")
+        if isinstance(timeout, (int, float)):
+            # Long polls, like getUpdates, need a while longer than the usual timeout
+            timeout = max(timeout, self.timeout)
+        future = asyncio.run_coroutine_threadsafe(
+            self.request_async(method, url, body, headers, timeout), self.pool.loop)
+        return future.result()
+
+    def download(self, url, filename):
+        data = self._request_wrapper('GET', url)
+        with open(filename, 'wb') as fobj:
+            fobj.write(data)
+
+
+class AsyncDispatcher(object):
+    """
+    Dispatches the updates to the handlers, like :class: `telegram.ext.Dispatcher`, each update as
+    a task on the loop. The updates of a user are still handled one at a time, in order, whichever
+    chats they come from, since they share the user's `user_data`, and their state in the
+    :class: `chats.state.SharedState`. The updates without a user are handled in order for each chat.
+
+    Attributes:
+        bot (:class: `telegram.Bot`): The bot.
+        loop (:class: `asyncio.AbstractEventLoop`): The loop.
+        executor (:class: `concurrent.futures.ThreadPoolExecutor`): Runs the blocking handlers.
+        concurrency (int): The most updates handled at once.
+        job_queue (:class: `telegram.ext.JobQueue`): The job queue.
+        update_queue: Takes updates from other threads, like the webhook's.
+        user_data (dict): As in :class: `telegram.ext.Dispatcher`.
+        chat_data (dict): As in :class: `telegram.ext.Dispatcher`.
+
+    Args:
+        bot (:class: `telegram.Bot`): As above.
+        loop (:class: `asyncio.AbstractEventLoop`): As above.
+        executor (:class: `concurrent.futures.ThreadPoolExecutor`): As above.
+        concurrency (Optional[int]): The most updates handled at once. Default is 500.
+        job_queue (Optional[:class: `telegram.ext.JobQueue`]): As above.
+    """
+    def __init__(self, bot, loop, executor, concurrency=500, job_queue=None):
+        self.bot = bot
+        self.loop = loop
+        self.executor = executor
+        self.job_queue = job_queue
+        self.update_queue = _LoopQueue(self)
+        self.user_data = defaultdict(dict)
+        self.chat_data = defaultdict(dict)
+        self.handlers = dict()
+        self.groups = []
+        self.concurrency = concurrency
+        self._semaphore = None
+        self._locks = dict()
+
+    def add_handler(self, handler, group=0):
+        if group not in self.handlers:
+            self.handlers[group] = []
+            self.groups = sorted(self.groups + [group])
+        self.handlers[group].append(handler)
+
+    def put(self, update):
+        """
+        Handles an update, as a task on the loop. Must be called on the loop.
+
+        Returns:
+            :class: `asyncio.Task`
+        """
+        return asyncio.ensure_future(self.process_update(update))
+
+    async def process_update(self, update):
+        if not isinstance(update, Update):
+            return
+        chat, user = extract_chat_and_user(update)
+        key = ('user', user.id) if user else ('chat', chat.id if chat else None)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            async with lock:
+                try:
+                    await self._process(update)
+                finally:
+                    if not lock._waiters:
+                        self._locks.pop(key, None)
+
+    async def _process(self, update):
+        for group in self.groups:
+            for handler in self.handlers[group]:
+                try:
+                    if not handler.check_update(update):
+                        continue
+                    if isinstance(handler, ConversationHandler):
+                        # The conversation handler keeps its pick between check_update and
+                        # handle_update, so it's read here, before another chat's update comes in
+                        key, current_handler = handler.current_conversation, handler.current_handler
+                        handler.update_state(await self.handle(current_handler, update), key)
+                    else:
+                        await self.handle(handler, update)
+                except TelegramError:
+                    logger.warning('A TelegramError was raised while processing the Update.', exc_info=True)
+                except Exception:
+                    logger.exception('An uncaught error was raised while processing the update')
+                break
+
+    async def handle(self, handler, update):
+        """
+        Runs a handler, on the loop if its callback is a coroutine, or on the executor otherwise.
+
+        Returns:
+            object: What the callback returned, like a conversation's next state.
+        """
+        if asyncio.iscoroutinefunction(getattr(handler, 'callback', None)):
+            return await handler.handle_update(update, self)
+        return await self.loop.run_in_executor(self.executor, handler.handle_update, update, self)
+
+
+class _LoopQueue(object):
+    # Hands the updates put from other threads, like the webhook's, over to the loop
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+
+    def put(self, update):
+        self.dispatcher.loop.call_soon_threadsafe(self.dispatcher.put, update)
+
+
+class AsyncRuntime(object):
+    """
+    Runs the bot on an event loop, in a thread of its own.
+
+    Attributes:
+        loop (:class: `asyncio.AbstractEventLoop`): The loop.
+        pool (:class: `general.aio.AsyncConnectionPool`): The connections to Telegram.
+        bot (:class: `telegram.Bot`): The bot, whose requests go through the pool.
+        executor (:class: `concurrent.futures.ThreadPoolExecutor`): Runs the blocking handlers,
+            and the ORM calls of the coroutines.
+        job_queue (:class: `telegram.ext.JobQueue`): The job queue.
+        dispatcher (:class: `general.aio.AsyncDispatcher`): The dispatcher.
+
+    Args:
+        token (str): The bot's token.
+        base_url (Optional[str]): The Bot API's URL. Default is Telegram's.
+        workers (Optional[int]): The size of the executor. Default is 16.
+        pool_size (Optional[int]): The most requests to Telegram at once. Default is 20.
+        concurrency (Optional[int]): The most updates handled at once. Default is 500.
+    """
+    def __init__(self, token, base_url=None, workers=16, pool_size=20, concurrency=500):
+        self.loop = asyncio.new_event_loop()
+        self.pool = AsyncConnectionPool(pool_size, loop=self.loop)
+        self.request = AsyncRequest(self.pool)
+        self.bot = Bot(token, base_url=base_url, request=self.request)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.job_queue = JobQueue(self.bot)
+        self.dispatcher = AsyncDispatcher(self.bot, self.loop, self.executor, concurrency, self.job_queue)
+        self.httpd = None
+        self._thread = None
+
+    def start(self):
+        """
+        Starts the loop's thread and the job queue.
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='AsyncRuntime', daemon=True)
+            self._thread.start()
+            self.job_queue.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.pool.loop_thread = threading.get_ident()
+        self.loop.run_forever()
+
+    def stop(self):
+        self.job_queue.stop()
+        if self.httpd is not None:
+            self.httpd.shutdown()
+        # The blocking handlers still running need the loop, for their calls to Telegram
+        self.executor.shutdown(wait=True)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    async def call(self, method, read_timeout=None, **params):
+        """
+        Calls a Bot API method, from a coroutine.
+
+        Args:
+            method (str): Like 'sendMessage'.
+            read_timeout (Optional[float]): Seconds to wait for the response.
+            **params: The method's parameters.
+
+        Returns:
+            object: The call's result, as decoded from JSON.
+        """
+        return await self.request.post_async('%s/%s' % (self.bot.base_url, method), params, read_timeout)
+
+    def orm(self, func, *args, **kwargs):
+        """
+        Runs a blocking function, like a database query, on the executor, from a coroutine.
+
+        Returns:
+            :class: `asyncio.Future`
+        """
+        return self.loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def poll(self, timeout=10):
+        """
+        Polls for updates, and dispatches them, until cancelled.
+        """
+        offset = 0
+        while True:
+            try:
+                updates = await self.call('getUpdates', read_timeout=timeout + 5, offset=offset, timeout=timeout)
+            except TelegramError as e:
+                logger.error("Error while getting Updates: %s", e)
+                await asyncio.sleep(1)
+                continue
+            for data in updates:
+                self.dispatcher.put(Update.de_json(data, self.bot))
+                offset = data['update_id'] + 1
+
+    def start_polling(self, timeout=10):
+        """
+        Starts polling for updates.
+
+        Returns:
+            :class: `concurrent.futures.Future`: Of the polling.
+        """
+        self.start()
+        self.bot.setWebhook(webhook_url='')
+        return asyncio.run_coroutine_threadsafe(self.poll(timeout), self.loop)
+
+    def start_webhook(self, listen, port, path, url=None):
+        """
+        Starts receiving updates through a webhook, like
+        :func: `~general.conversation.start_webhook`, and hands them over to the loop.
+        """
+        self.start()
+        self.httpd = ThreadedWebhookServer((listen, port), WebhookHandler, self.dispatcher.update_queue,
+                                           '/' + path.lstrip('/'), self.bot)
+        threading.Thread(target=self.httpd.serve_forever, name='AsyncRuntime-webhook', daemon=True).start()
+        if url:
+            self.bot.setWebhook(webhook_url='%s/%s' % (url.rstrip('/'), path.lstrip('/')))
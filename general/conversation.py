@@ -1,4 +1,5 @@
 import os
+import time
 
 import django
 
@@ -6,11 +7,19 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "class_rep_bot.settings")
 django.setup()
 
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from telegram import (ReplyKeyboardRemove, ParseMode)
-from telegram.ext import (Updater, CommandHandler)
+from telegram.ext import CommandHandler
+from general.webhook import WebhookUpdater
+from chats.state import SharedState, get_state_store
 from timetable.chats.private_chat import get_timetable_conversation_handler
-from chats.chat import get_chats_conversation_handler
+from chats.chat import get_chats_conversation_handler, get_broadcast_handler
+from chats.broadcast import get_broadcaster
+from chats.groups import get_group_registry
+from timetable.classes import get_class_directory
 from timetable.chats.group_chat import get_group_chat_handlers
+from timetable.chats.inline_chat import get_inline_query_handler
+from timetable.reminders import ReminderScheduler
 
 # logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.DEBUG)
 
@@ -22,26 +31,169 @@ TOKEN = settings.CLASSREP_BOT_TOKEN
 def general_help(bot, update):
     update.message.reply_text(
         "The following is my list of commands.\n\n"
-        "/timetable \n",
+        "/timetable \n"
+        "/lessons \n"
+        "/now \n"
+        "/next \n"
+        "/broadcast - For class reps and lecturers \n",
         reply_markup=ReplyKeyboardRemove(),
         parse_mode=ParseMode.MARKDOWN)
 
 
-def main():
-    updater = Updater(TOKEN)
-    dp = updater.dispatcher
+def add_handlers(dispatcher):
+    """
+    Adds all the bot's handlers to a dispatcher. The conversations' states and `user_data` are kept
+    in the `CONVERSATION_STORE`, so they outlive the process, and are shared with any other
+    processes of the bot.
 
+    Args:
+        dispatcher: Either a :class: `telegram.ext.Dispatcher`, or a
+            :class: `general.aio.AsyncDispatcher`.
+    """
     for handler in get_group_chat_handlers():
-        dp.add_handler(handler)
-
-    dp.add_handler(CommandHandler('help', general_help))
-    dp.add_handler(get_timetable_conversation_handler())
-    dp.add_handler(get_chats_conversation_handler())
-
-    updater.start_polling()
+        dispatcher.add_handler(handler)
+
+    dispatcher.add_handler(get_inline_query_handler())
+    dispatcher.add_handler(CommandHandler('help', general_help))
+    dispatcher.add_handler(get_broadcast_handler())
+    timetable_handler = get_timetable_conversation_handler()
+    chats_handler = get_chats_conversation_handler()
+    dispatcher.add_handler(timetable_handler)
+    dispatcher.add_handler(chats_handler)
+    SharedState(get_state_store(), dispatcher, {'timetable': timetable_handler, 'chats': chats_handler}).attach()
+
+
+def get_updater(token=TOKEN, **kwargs):
+    """
+    Builds the bot's updater, with all its handlers and the lesson reminders, without starting it.
+    Any broadcasts that were cut short are resumed.
+
+    Args:
+        token (Optional[str]): The bot's token. Default is the `CLASSREP_BOT_TOKEN` setting.
+        **kwargs: Passed on to :class: `general.webhook.WebhookUpdater`, like `base_url`.
+
+    Returns:
+        general.webhook.WebhookUpdater
+    """
+    updater = WebhookUpdater(token, **kwargs)
+    add_handlers(updater.dispatcher)
+    ReminderScheduler(updater.bot).start(updater.job_queue)
+    get_broadcaster().resume(updater.bot)
+    get_group_registry().start(updater.job_queue)
+    get_class_directory().start(updater.job_queue)
+    return updater
+
+
+def get_runtime(token=TOKEN, **kwargs):
+    """
+    Builds the bot's asyncio runtime, with all its handlers and the lesson reminders, without
+    starting it. Any broadcasts that were cut short are resumed. It is configured by the
+    `ASYNC_RUNTIME` setting.
+
+    Args:
+        token (Optional[str]): The bot's token. Default is the `CLASSREP_BOT_TOKEN` setting.
+        **kwargs: Passed on to :class: `general.aio.AsyncRuntime`, like `base_url`.
+
+    Returns:
+        general.aio.AsyncRuntime
+    """
+    # Imported here, since the runtime's coroutines need Python 3.5, and the threads don't
+    from general.aio import AsyncRuntime
+
+    options = getattr(settings, 'ASYNC_RUNTIME', {})
+    kwargs.setdefault('workers', options.get('EXECUTOR_WORKERS', 16))
+    kwargs.setdefault('pool_size', options.get('POOL_SIZE', 20))
+    kwargs.setdefault('concurrency', options.get('CONCURRENCY', 500))
+    runtime = AsyncRuntime(token, **kwargs)
+    add_handlers(runtime.dispatcher)
+    ReminderScheduler(runtime.bot).start(runtime.job_queue)
+    get_broadcaster().resume(runtime.bot)
+    get_group_registry().start(runtime.job_queue)
+    get_class_directory().start(runtime.job_queue)
+    return runtime
+
+
+def start_webhook(updater, listen, port, path, url):
+    """
+    Receives the updates through a webhook, on a small threaded HTTP server, instead of polling for them.
+    Telegram posts each update as it comes, so there is no `getUpdates` traffic while idle, nor
+    a round of polling before each message at peak.
+
+    TLS is expected to be terminated in front of the server, like by Heroku's router.
+
+    Args:
+        updater (:class: `general.webhook.WebhookUpdater`): The updater.
+        listen (str): The address to listen on, like '0.0.0.0'.
+        port (int): The port to listen on.
+        path (str): The secret path the updates are posted to.
+        url (str): The public base URL of the server, like 'https://classrep.herokuapp.com'.
+
+    Returns:
+        Queue: The updater's update queue.
+    """
+    update_queue = updater.start_webhook(listen=listen, port=port, url_path=path)
+    # The updater only sets the webhook itself when it handles the TLS
+    updater.bot.setWebhook(webhook_url='%s/%s' % (url.rstrip('/'), path))
+    return update_queue
+
+
+def main(mode=None, port=None, runtime=None):
+    """
+    Runs the bot, until interrupted.
+
+    Args:
+        mode (Optional[str]): Either 'polling' or 'webhook'. Default is the `BOT_MODE` setting.
+        port (Optional[int]): The webhook's port. Default is the `WEBHOOK` setting's PORT.
+        runtime (Optional[str]): Either 'threads', for python-telegram-bot's own updater, or
+            'asyncio', for :class: `general.aio.AsyncRuntime`. Default is the `BOT_RUNTIME` setting.
+
+    Raises:
+        ImproperlyConfigured: If the mode is 'webhook', and either the bot's token or the
+            `WEBHOOK` setting's URL isn't set.
+    """
+    mode = mode or settings.BOT_MODE
+    runtime = runtime or getattr(settings, 'BOT_RUNTIME', 'threads')
+    if mode not in ('polling', 'webhook'):
+        raise ValueError("mode should be either 'polling' or 'webhook', not %r" % mode)
+    # Checked before anything starts, rather than once the webhook's server is listening
+    if mode == 'webhook' and not settings.CLASSREP_BOT_TOKEN:
+        raise ImproperlyConfigured("The webhook mode needs the TOKEN environment variable, the bot's token, "
+                                   "which the webhook's path defaults to.")
+    if mode == 'webhook' and not settings.WEBHOOK.get('URL'):
+        raise ImproperlyConfigured("The webhook mode needs the WEBHOOK_URL environment variable, the bot's "
+                                   "public base URL, like 'https://classrep.herokuapp.com'.")
+
+    if runtime == 'asyncio':
+        bot = get_runtime()
+        if mode == 'webhook':
+            bot.start_webhook(listen=settings.WEBHOOK['LISTEN'],
+                              port=port or settings.WEBHOOK['PORT'],
+                              path=settings.WEBHOOK['PATH'],
+                              url=settings.WEBHOOK['URL'])
+        else:
+            bot.start_polling()
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            bot.stop()
+        return
+    elif runtime != 'threads':
+        raise ValueError("runtime should be either 'threads' or 'asyncio', not %r" % runtime)
+
+    updater = get_updater()
+    if mode == 'webhook':
+        start_webhook(updater,
+                      listen=settings.WEBHOOK['LISTEN'],
+                      port=port or settings.WEBHOOK['PORT'],
+                      path=settings.WEBHOOK['PATH'],
+                      url=settings.WEBHOOK['URL'])
+    else:
+        # Drop any webhook, since Telegram won't serve getUpdates while one is set
+        updater.bot.setWebhook(webhook_url='')
+        updater.start_polling()
     updater.idle()
 
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,235 @@
+"""
+This module contains :class: `general.delivery.DeliveryQueue`, the outbound queue for the texts and
+mails, like verification codes, that the conversation handlers send.
+
+The handlers only enqueue a delivery and return, so that a slow or failing SMS or mail API never
+ties up the bot's dispatcher threads. The deliveries are made by the queue's own worker threads. A
+failed delivery is retried after an exponential backoff with jitter, without holding on to a worker
+in the meantime, and is dead-lettered after its last attempt.
+"""
+
+import heapq
+import itertools
+import logging
+import queue
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Delivery(object):
+    """
+    A single delivery.
+
+    Attributes:
+        name (str): What is being delivered, for the logs, like 'sms' or 'mail'.
+        func (callable): Makes the delivery. It should raise an exception if the delivery failed,
+            or return a :class: `concurrent.futures.Future` that fails if it did, like for mails
+            that are sent in batches.
+        args (tuple): The arguments of `func`.
+        attempts (int): The number of attempts made so far.
+        error (Exception): The error of the latest attempt, if it failed.
+    """
+    def __init__(self, name, func, *args):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.attempts = 0
+        self.error = None
+
+    def __str__(self):
+        return "%s%s" % (self.name, self.args)
+
+
+class DeliveryQueue(object):
+    """
+    A bounded queue of deliveries, with a pool of worker threads.
+
+    Attributes:
+        attempts (int): The most attempts made for each delivery.
+        backoff (float): The delay, in seconds, before the first retry. It doubles on every retry.
+        max_backoff (float): The longest delay, in seconds, before a retry.
+        dead_letters (:class: `collections.deque`): The latest deliveries that were given up on,
+            either after their last attempt, or because the queue was full.
+        delivered (int): The number of deliveries made so far.
+
+    Args:
+        workers (Optional[int]): The number of worker threads. Default is 4.
+        maxsize (Optional[int]): The most deliveries waiting in the queue. Default is 1000.
+        attempts (Optional[int]): As above. Default is 5.
+        backoff (Optional[float]): As above. Default is 1.
+        max_backoff (Optional[float]): As above. Default is 30.
+    """
+    def __init__(self, workers=4, maxsize=1000, attempts=5, backoff=1.0, max_backoff=30.0):
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.dead_letters = deque(maxlen=1000)
+        self.delivered = 0
+        self.workers = workers
+        self._queue = queue.Queue(maxsize)
+        self._retries = []
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts the worker threads, and the thread that requeues the retries, if not started yet.
+        """
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                self._threads.append(threading.Thread(
+                    target=self._work, name='DeliveryQueue-%s' % i, daemon=True))
+            self._threads.append(threading.Thread(target=self._requeue, name='DeliveryQueue-retries', daemon=True))
+            for thread in self._threads:
+                thread.start()
+
+    def put(self, name, func, *args):
+        """
+        Queues a delivery, without blocking.
+
+        Args:
+            name (str): What is being delivered, like 'sms'.
+            func (callable): Makes the delivery.
+            *args: The arguments of `func`.
+
+        Returns:
+            bool: True if the delivery was queued. False if the queue was full, in which case the
+                delivery is dead-lettered.
+        """
+        self.start()
+        delivery = Delivery(name, func, *args)
+        try:
+            self._queue.put_nowait(delivery)
+        except queue.Full:
+            delivery.error = queue.Full('The delivery queue is full')
+            self.dead_letter(delivery)
+            return False
+        return True
+
+    def get_delay(self, attempts):
+        """
+        Get the delay before the next attempt, with "full jitter", so that the retries of many
+        deliveries that failed together, like when the API is down, are spread out.
+
+        Args:
+            attempts (int): The number of attempts made so far.
+
+        Returns:
+            float: Seconds.
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempts - 1)))
+
+    def run(self, delivery):
+        """
+        Makes an attempt at a delivery, and schedules a retry or dead-letters it if it fails. If
+        the delivery returns a future, the worker doesn't wait for it.
+
+        Returns:
+            bool: True if the delivery was made, or is on its way. False otherwise.
+        """
+        delivery.attempts += 1
+        try:
+            result = delivery.func(*delivery.args)
+        except Exception as e:
+            self.failed(delivery, e)
+            return False
+        if isinstance(result, Future):
+            result.add_done_callback(lambda future: self.done(delivery, future))
+        else:
+            self.succeeded(delivery)
+        return True
+
+    def done(self, delivery, future):
+        error = future.exception()
+        if error is None:
+            self.succeeded(delivery)
+        else:
+            self.failed(delivery, error)
+
+    def succeeded(self, delivery):
+        with self._lock:
+            self.delivered += 1
+
+    def failed(self, delivery, error):
+        delivery.error = error
+        if delivery.attempts >= self.attempts:
+            self.dead_letter(delivery)
+        else:
+            logger.info("Delivery of %s failed, attempt %s: %s", delivery, delivery.attempts, error)
+            self.retry(delivery, self.get_delay(delivery.attempts))
+
+    def retry(self, delivery, delay):
+        with self._condition:
+            heapq.heappush(self._retries, (time.time() + delay, next(self._counter), delivery))
+            self._condition.notify()
+
+    def dead_letter(self, delivery):
+        logger.error("Gave up on the delivery of %s after %s attempts: %s",
+                     delivery, delivery.attempts, delivery.error)
+        self.dead_letters.append(delivery)
+
+    def _work(self):
+        while True:
+            delivery = self._queue.get()
+            try:
+                self.run(delivery)
+            except Exception:
+                logger.exception("Failed to run the delivery of %s", delivery)
+            finally:
+                self._queue.task_done()
+
+    def _requeue(self):
+        while True:
+            with self._condition:
+                while not self._retries or self._retries[0][0] > time.time():
+                    self._condition.wait(self._retries[0][0] - time.time() if self._retries else None)
+                due, count, delivery = heapq.heappop(self._retries)
+            try:
+                self._queue.put_nowait(delivery)
+            except queue.Full:
+                delivery.error = queue.Full('The delivery queue is full')
+                self.dead_letter(delivery)
+
+    def pending(self):
+        """
+        Returns:
+            int: The number of deliveries queued, or waiting for a retry.
+        """
+        with self._condition:
+            return self._queue.qsize() + len(self._retries)
+
+
+_delivery_queue = None
+_delivery_queue_lock = threading.Lock()
+
+
+def get_delivery_queue():
+    """
+    Get the process wide delivery queue, configured by the `DELIVERY_QUEUE` setting, creating it
+    the first time.
+
+    Returns:
+        general.delivery.DeliveryQueue
+    """
+    global _delivery_queue
+    with _delivery_queue_lock:
+        if _delivery_queue is None:
+            options = getattr(settings, 'DELIVERY_QUEUE', {})
+            _delivery_queue = DeliveryQueue(
+                workers=options.get('WORKERS', 4),
+                maxsize=options.get('MAXSIZE', 1000),
+                attempts=options.get('ATTEMPTS', 5),
+                backoff=options.get('BACKOFF', 1.0),
+                max_backoff=options.get('MAX_BACKOFF', 30.0),
+            )
+        return _delivery_queue
@@ -0,0 +1,279 @@
+"""
+This module contains the outgoing mail transport, of:
+    1. :class: `general.mail.SendGridBackend`
+    2. :class: `general.mail.LocalBackend`
+    3. :class: `general.mail.MailDispatcher`
+
+Like :mod: `general.sms`, the mails queued within a short window are grouped, here by their subject
+and content, and each group is sent in a single request to the SendGrid API, with a personalization
+per recipient. The content is a template, like "CLASS REP Verification Code: -code-", and each
+personalization carries its own substitutions, so each recipient still gets their own code.
+
+The backend is chosen by the `MAIL_BACKEND` setting, like:
+
+    MAIL_BACKEND = {
+        'BACKEND': 'general.mail.LocalBackend',
+        'OPTIONS': {'delay': 0.2},
+    }
+
+:class: `general.mail.LocalBackend` sends nothing, which is handy for measuring the throughput
+offline. :class: `general.mail.SendGridBackend` may also be pointed at a local HTTP stand-in of
+the API, through its `host` option.
+"""
+
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from urllib.error import HTTPError
+from django.conf import settings
+from django.utils.module_loading import import_string
+import sendgrid
+from sendgrid.helpers.mail import (Mail, Email, Content, Personalization, Substitution, TrackingSettings,
+                                   ClickTracking, OpenTracking)
+
+logger = logging.getLogger(__name__)
+
+
+class MailError(RuntimeError):
+    """
+    A request the mail API didn't accept.
+
+    Attributes:
+        status_code (int): The response's status code. None if there was no response.
+    """
+    def __init__(self, message, status_code=None):
+        RuntimeError.__init__(self, message)
+        self.status_code = status_code
+
+
+class SendGridBackend(object):
+    """
+    Sends the requests through a single, long lived SendGrid client.
+
+    Args:
+        apikey (Optional[str]): The SendGrid API key. Default is the `SENDGRID_API_KEY` setting.
+        host (Optional[str]): The API's base URL, like a local stand-in's. Default is SendGrid's.
+    """
+    def __init__(self, apikey=None, host=None):
+        options = {'apikey': apikey or settings.SENDGRID_API_KEY}
+        if host:
+            options['host'] = host
+        self.client = sendgrid.SendGridAPIClient(**options)
+
+    def send(self, data):
+        """
+        Args:
+            data (dict): The request body, as built by :class: `sendgrid.helpers.mail.Mail`.
+
+        Returns:
+            int: The response's status code.
+        """
+        try:
+            return self.client.client.mail.send.post(request_body=data).status_code
+        except HTTPError as e:
+            raise MailError("SendGrid responded with %s: %s" % (e.code, e.read()), e.code)
+
+
+class LocalBackend(object):
+    """
+    Keeps the requests, instead of sending them, after an optional delay standing in for the API's.
+
+    Attributes:
+        outbox (list): The request bodies.
+
+    Args:
+        delay (Optional[float]): Seconds each request takes. Default is 0.
+    """
+    def __init__(self, delay=0.0):
+        self.delay = delay
+        self.outbox = []
+        self._lock = threading.Lock()
+
+    def send(self, data):
+        time.sleep(self.delay)
+        with self._lock:
+            self.outbox.append(data)
+        return 202
+
+
+class MailDispatcher(object):
+    """
+    Queues mails, and sends them in batches from a single background thread.
+
+    Attributes:
+        backend: The backend, like :class: `general.mail.SendGridBackend`.
+        from_address (str): The sender's address.
+        window (float): Seconds to wait for more mails, after the first one of a batch is queued.
+        size (int): The most personalizations in a single request. SendGrid allows up to 1000.
+        requests (int): The number of requests made so far.
+
+    Args:
+        backend (Optional[object]): As above. Default is the one in the `MAIL_BACKEND` setting.
+        from_address (Optional[str]): As above. Default is "classrep@kots.io".
+        window (Optional[float]): As above. Default is 0.5.
+        size (Optional[int]): As above. Default is 500.
+        threaded (Optional[bool]): Whether to send from the background thread. If False, the mails
+            are only sent on :func: `~general.mail.MailDispatcher.flush`. Default is True.
+    """
+    def __init__(self, backend=None, from_address="classrep@kots.io", window=0.5, size=500, threaded=True):
+        self.backend = backend or get_mail_backend()
+        self.from_address = from_address
+        self.window = window
+        self.size = size
+        self.threaded = threaded
+        self.requests = 0
+        self._pending = []
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def send(self, to, subject, content, substitutions=None):
+        """
+        Queues a mail.
+
+        Args:
+            to (str): The recipient's address.
+            subject (str): The subject.
+            content (str): The plain text content, with the keys of `substitutions` as placeholders.
+            substitutions (Optional[dict]): The recipient's values of the placeholders, like
+                {'-code-': '123456'}.
+
+        Returns:
+            :class: `concurrent.futures.Future`: Resolves to the status code of the request the mail
+                was sent in. Fails if the request failed.
+        """
+        future = Future()
+        with self._condition:
+            self._pending.append((to, subject, content, substitutions or {}, future))
+            if self.threaded and self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='MailDispatcher', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return future
+
+    def flush(self):
+        """
+        Sends all the queued mails right away, in the calling thread.
+
+        Returns:
+            int: The number of mails sent.
+        """
+        with self._condition:
+            pending, self._pending = self._pending, []
+        self.dispatch(pending)
+        return len(pending)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                deadline = time.time() + self.window
+                while len(self._pending) < self.size and time.time() < deadline:
+                    self._condition.wait(deadline - time.time())
+                pending, self._pending = self._pending, []
+            try:
+                self.dispatch(pending)
+            except Exception:
+                logger.exception("Failed to dispatch %s mails", len(pending))
+
+    def dispatch(self, pending):
+        """
+        Sends the given mails, grouped by their subject and content.
+
+        Args:
+            pending (list): Tuples of the form (to, subject, content, substitutions, future).
+        """
+        groups = OrderedDict()
+        for to, subject, content, substitutions, future in pending:
+            groups.setdefault((subject, content), []).append((to, substitutions, future))
+
+        for (subject, content), mails in groups.items():
+            for i in range(0, len(mails), self.size):
+                self.send_batch(subject, content, mails[i:i + self.size])
+
+    def get_request(self, subject, content, mails):
+        """
+        Builds the body of a request, with a personalization per mail.
+
+        Returns:
+            dict
+        """
+        email = Mail()
+        email.set_from(Email(self.from_address))
+        email.set_subject(subject)
+        email.add_content(Content("text/plain", content))
+        for to, substitutions, future in mails:
+            personalization = Personalization()
+            personalization.add_to(Email(to))
+            for key, value in substitutions.items():
+                personalization.add_substitution(Substitution(key, value))
+            email.add_personalization(personalization)
+        tracking_settings = TrackingSettings()
+        tracking_settings.set_click_tracking(ClickTracking(True, True))
+        tracking_settings.set_open_tracking(OpenTracking(True))
+        email.set_tracking_settings(tracking_settings)
+        return email.get()
+
+    def send_batch(self, subject, content, mails):
+        """
+        Sends many mails in a single request, and resolves their futures.
+
+        SendGrid rejects the whole request if any of its addresses is invalid, so when a batch is
+        refused, with a 4xx other than a 429, its mails are sent again one at a time, for only the
+        bad ones to fail.
+
+        Args:
+            subject (str): The subject.
+            content (str): The content.
+            mails (list): Tuples of the form (to, substitutions, future).
+        """
+        try:
+            self.requests += 1
+            status_code = self.backend.send(self.get_request(subject, content, mails))
+            if status_code < 200 or status_code >= 300:
+                raise MailError("SendGrid responded with %s" % status_code, status_code)
+        except Exception as e:
+            status_code = getattr(e, 'status_code', None) or 0
+            if len(mails) > 1 and 400 <= status_code < 500 and status_code != 429:
+                logger.warning("A batch of %s mails was refused, sending them one at a time: %s", len(mails), e)
+                for mail in mails:
+                    self.send_batch(subject, content, [mail])
+                return
+            logger.warning("Failed to send a mail to %s recipients: %s", len(mails), e)
+            for to, substitutions, future in mails:
+                future.set_exception(e)
+            return
+        for to, substitutions, future in mails:
+            future.set_result(status_code)
+
+
+def get_mail_backend():
+    """
+    Get a new instance of the backend in the `MAIL_BACKEND` setting.
+
+    Returns:
+        object: Like :class: `general.mail.SendGridBackend`
+    """
+    config = getattr(settings, 'MAIL_BACKEND', {})
+    backend = import_string(config.get('BACKEND', 'general.mail.SendGridBackend'))
+    return backend(**config.get('OPTIONS', {}))
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_mail_dispatcher():
+    """
+    Get the process wide mail dispatcher, creating it the first time.
+
+    Returns:
+        general.mail.MailDispatcher
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = MailDispatcher()
+        return _dispatcher
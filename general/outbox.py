@@ -0,0 +1,372 @@
+"""
+This module contains :class: `general.outbox.SendQueue`, the outbound queue for the bot's calls to
+the Telegram API, like replies, edits and reminders.
+
+Telegram limits how fast a bot may send: about a message a second to a chat, 20 a minute to a
+group, and 30 a second overall. Going over gets the bot `429 Too Many Requests` responses, with a
+`retry_after`, so during class wide bursts the messages were being lost. The queue keeps a token
+bucket for each chat, and one for the whole bot, and only sends when both have a token. The
+interactive replies are queued in a lane ahead of the bulk sends, like reminders, so a student
+isn't kept waiting behind a broadcast. A send that still gets a `retry_after` is held back, with
+its chat, for as long as Telegram asks, and then tried again.
+
+The limits are set by the `SEND_QUEUE` setting.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from django.conf import settings
+from telegram import Chat
+from telegram.error import RetryAfter
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BULK = 1
+LANES = {INTERACTIVE: 'interactive', BULK: 'bulk'}
+
+
+class TokenBucket(object):
+    """
+    Allows `rate` sends a second, in bursts of up to `capacity`.
+
+    Args:
+        rate (float): The tokens added a second.
+        capacity (float): The most tokens held.
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """
+        Returns:
+            float: Seconds until there is a token. 0 if there is one now.
+        """
+        self.refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self.refill(now)
+        self.tokens -= 1
+
+    def full(self, now):
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+
+class Send(object):
+    """
+    A single queued call.
+
+    Attributes:
+        func (callable): The bot's method, like `bot.sendMessage`.
+        chat_id (int): The chat it's sent to.
+        priority (int): Either `INTERACTIVE` or `BULK`.
+        kwargs (dict): The method's other arguments.
+        future (:class: `concurrent.futures.Future`): Resolves to what the method returned.
+        queued (float): When it was queued.
+        count (int): Its place in the queue, kept when it's retried.
+        attempts (int): The number of attempts made so far.
+    """
+    def __init__(self, func, chat_id, priority, kwargs):
+        self.func = func
+        self.chat_id = chat_id
+        self.priority = priority
+        self.kwargs = kwargs
+        self.future = Future()
+        self.queued = time.monotonic()
+        self.count = None
+        self.attempts = 0
+
+
+class SendQueue(object):
+    """
+    Queues the calls to the Telegram API, and makes them within its rate limits.
+
+    The calls to a chat are made one at a time, in the order they were queued within each lane.
+
+    Attributes:
+        sent (int): The number of calls made so far.
+        failed (int): The number of calls that failed.
+        retried (int): The number of calls retried after a `retry_after`.
+        latencies (:class: `collections.deque`): Seconds the latest calls took, from being queued
+            until they were made.
+
+    Args:
+        rate (Optional[float]): The most calls a second, overall. Default is 30.
+        chat_rate (Optional[float]): The most calls a second to a private chat. Default is 1.
+        group_rate (Optional[float]): The most calls a second to a group. Default is 20 a minute.
+        burst (Optional[int]): The most calls to a chat at once, before its rate applies. Default
+            is 3.
+        workers (Optional[int]): The number of threads making the calls. Default is 8.
+        attempts (Optional[int]): The most attempts at a call that is told to retry. Default is 3.
+        threaded (Optional[bool]): Whether to send from background threads. If False, the calls are
+            only made on :func: `~general.outbox.SendQueue.flush`. Default is True.
+    """
+    def __init__(self, rate=30.0, chat_rate=1.0, group_rate=20 / 60, burst=3, workers=8, attempts=3,
+                 threaded=True):
+        self.rate = rate
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self.workers = workers
+        self.attempts = attempts
+        self.threaded = threaded
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.latencies = deque(maxlen=1000)
+        self._bucket = TokenBucket(rate, rate)
+        self._buckets = dict()
+        # The queued calls of each chat, as heaps of (priority, count, send)
+        self._chats = dict()
+        # The chats that may be sent to, as a heap of their first calls' (priority, count, chat_id).
+        # An entry is stale once its chat's first call changed, and is skipped.
+        self._ready = []
+        # The chats waiting on their buckets, or a retry_after, as a heap of (when, chat_id)
+        self._waiting = []
+        self._throttled = dict()
+        self._busy = set()
+        self._depth = dict((priority, 0) for priority in LANES)
+        self._counter = itertools.count()
+        self._condition = threading.Condition()
+        self._thread = None
+        self._executor = None
+
+    def send(self, func, chat_id, priority=INTERACTIVE, **kwargs):
+        """
+        Queues a call.
+
+        Args:
+            func (callable): The bot's method, like `bot.sendMessage`. It's called with `chat_id`,
+                and `kwargs`.
+            chat_id (int): The chat it's sent to.
+            priority (Optional[int]): Either `INTERACTIVE`, for replies to a student, or `BULK`.
+                Default is `INTERACTIVE`.
+            **kwargs: The method's other arguments, like `text`.
+
+        Returns:
+            :class: `concurrent.futures.Future`: Resolves to what the method returned, like the
+                sent :class: `telegram.Message`. Fails if the call did.
+        """
+        item = Send(func, chat_id, priority, kwargs)
+        with self._condition:
+            self._queue(item)
+            if self.threaded and self._thread is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+                self._thread = threading.Thread(target=self._run, name='SendQueue', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return item.future
+
+    def reply(self, bot, message, text, priority=INTERACTIVE, **kwargs):
+        """
+        Queues a reply to a message, like :func: `~telegram.Message.reply_text` would send it.
+
+        Returns:
+            :class: `concurrent.futures.Future`
+        """
+        if 'reply_to_message_id' not in kwargs and message.chat.type != Chat.PRIVATE:
+            kwargs['reply_to_message_id'] = message.message_id
+        return self.send(bot.sendMessage, message.chat_id, priority, text=text, **kwargs)
+
+    def _queue(self, item):
+        chat = self._chats.setdefault(item.chat_id, [])
+        if item.count is None:
+            item.count = next(self._counter)
+        entry = (item.priority, item.count, item)
+        heapq.heappush(chat, entry)
+        self._depth[item.priority] += 1
+        if chat[0] is entry and item.chat_id not in self._busy and item.chat_id not in self._throttled:
+            heapq.heappush(self._ready, (item.priority, item.count, item.chat_id))
+
+    def get_bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            rate = self.group_rate if str(chat_id).startswith('-') else self.chat_rate
+            bucket = self._buckets[chat_id] = TokenBucket(rate, self.burst)
+        return bucket
+
+    def _throttle(self, chat_id, until):
+        self._throttled[chat_id] = until
+        heapq.heappush(self._waiting, (until, chat_id))
+
+    def _release(self, chat_id):
+        # Puts a chat that's no longer busy or throttled back in line, if it has calls queued
+        chat = self._chats.get(chat_id)
+        if chat:
+            priority, count, item = chat[0]
+            heapq.heappush(self._ready, (priority, count, chat_id))
+        elif chat is not None:
+            del self._chats[chat_id]
+
+    def _next(self, now):
+        """
+        Takes the next call that may be made now, and the tokens for it.
+
+        Returns:
+            tuple: Of the form (send, delay), where `send` is None if there's none yet, and `delay`
+                is the seconds until there may be, or None if nothing is queued.
+        """
+        while self._waiting and self._waiting[0][0] <= now:
+            until, chat_id = heapq.heappop(self._waiting)
+            if self._throttled.get(chat_id) == until:
+                del self._throttled[chat_id]
+                self._release(chat_id)
+
+        while self._ready:
+            priority, count, chat_id = self._ready[0]
+            chat = self._chats.get(chat_id)
+            if not chat or chat[0][1] != count or chat_id in self._busy or chat_id in self._throttled:
+                heapq.heappop(self._ready)
+                continue
+            delay = self.get_bucket(chat_id).delay(now)
+            if delay:
+                heapq.heappop(self._ready)
+                self._throttle(chat_id, now + delay)
+                continue
+            delay = self._bucket.delay(now)
+            if delay:
+                return None, delay
+            heapq.heappop(self._ready)
+            self._bucket.take(now)
+            self._buckets[chat_id].take(now)
+            item = heapq.heappop(chat)[2]
+            self._depth[item.priority] -= 1
+            self._busy.add(chat_id)
+            return item, 0
+
+        if self._waiting:
+            return None, self._waiting[0][0] - now
+        if len(self._buckets) > 10000:
+            self._buckets = dict((chat_id, bucket) for chat_id, bucket in self._buckets.items()
+                                 if chat_id in self._chats or not bucket.full(now))
+        return None, None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                item, delay = self._next(time.monotonic())
+                if item is None:
+                    self._condition.wait(delay)
+                    continue
+            self._executor.submit(self.run, item)
+
+    def flush(self):
+        """
+        Makes all the calls that may be made right away, in the calling thread.
+
+        Returns:
+            int: The number of calls made.
+        """
+        made = 0
+        while True:
+            with self._condition:
+                item, delay = self._next(time.monotonic())
+            if item is None:
+                return made
+            self.run(item)
+            made += 1
+
+    def run(self, item):
+        """
+        Makes a call, and resolves its future, or queues it again if Telegram says to retry after
+        a while.
+        """
+        item.attempts += 1
+        try:
+            result = item.func(chat_id=item.chat_id, **item.kwargs)
+        except RetryAfter as e:
+            with self._condition:
+                self._busy.discard(item.chat_id)
+                if item.attempts < self.attempts:
+                    self.retried += 1
+                    logger.info("Telegram asked to retry the call to chat %s after %s seconds",
+                                item.chat_id, e.retry_after)
+                    self._queue(item)
+                    self._throttle(item.chat_id, time.monotonic() + e.retry_after)
+                    self._condition.notify()
+                    return
+                self.failed += 1
+                self._release(item.chat_id)
+                self._condition.notify()
+            item.future.set_exception(e)
+            return
+        except Exception as e:
+            with self._condition:
+                self.failed += 1
+                self._busy.discard(item.chat_id)
+                self._release(item.chat_id)
+                self._condition.notify()
+            item.future.set_exception(e)
+            return
+
+        with self._condition:
+            self.sent += 1
+            self.latencies.append(time.monotonic() - item.queued)
+            self._busy.discard(item.chat_id)
+            self._release(item.chat_id)
+            self._condition.notify()
+        item.future.set_result(result)
+
+    def depth(self):
+        """
+        Returns:
+            dict: The number of calls queued in each lane, like {'interactive': 0, 'bulk': 120}.
+        """
+        with self._condition:
+            return dict((LANES[priority], depth) for priority, depth in self._depth.items())
+
+    def stats(self):
+        """
+        Returns:
+            dict: The queue's depth, counts, and the median and 95th percentile latency, in
+                milliseconds, of the latest calls.
+        """
+        with self._condition:
+            latencies = sorted(self.latencies)
+        stats = {'depth': self.depth(), 'sent': self.sent, 'failed': self.failed, 'retried': self.retried,
+                 'latency_p50_ms': None, 'latency_p95_ms': None}
+        if latencies:
+            stats['latency_p50_ms'] = latencies[len(latencies) // 2] * 1000
+            stats['latency_p95_ms'] = latencies[int(len(latencies) * 0.95)] * 1000
+        return stats
+
+
+_send_queue = None
+_send_queue_lock = threading.Lock()
+
+
+def get_send_queue():
+    """
+    Get the process wide send queue, configured by the `SEND_QUEUE` setting, creating it the
+    first time.
+
+    Returns:
+        general.outbox.SendQueue
+    """
+    global _send_queue
+    with _send_queue_lock:
+        if _send_queue is None:
+            options = getattr(settings, 'SEND_QUEUE', {})
+            _send_queue = SendQueue(
+                rate=options.get('RATE', 30.0),
+                chat_rate=options.get('CHAT_RATE', 1.0),
+                group_rate=options.get('GROUP_RATE', 20 / 60),
+                burst=options.get('BURST', 3),
+                workers=options.get('WORKERS', 8),
+                attempts=options.get('ATTEMPTS', 3),
+            )
+        return _send_queue
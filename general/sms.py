@@ -0,0 +1,205 @@
+"""
+This module contains :class: `general.sms.SMSDispatcher`, which batches the outgoing texts, like
+verification codes and lesson reminders, into as few requests to the SMS gateway as it can.
+
+The gateway's `sendMessage` takes a comma separated list of recipients for a single message. So, the
+texts queued within a short window are grouped by their message and sender, and each group is sent
+in one request, or a few if it's larger than the batch size. The per-recipient results of each
+request are then matched back to the texts, so that each text still gets its own status.
+"""
+
+import logging
+import threading
+import time
+from collections import namedtuple, OrderedDict
+from concurrent.futures import Future
+from django.conf import settings
+from general.AfricasTalkingGateway import AfricasTalkingGateway, AfricasTalkingGatewayException, getConnectionPool
+
+logger = logging.getLogger(__name__)
+
+
+class SMSStatus(namedtuple('SMSStatus', ['number', 'status', 'message_id', 'cost'])):
+    """
+    The status of a single text, as reported by the gateway.
+
+    Attributes:
+        number (str): The recipient's mobile number.
+        status (str): Either "Success", or the reason the text was not sent.
+        message_id (str): The gateway's id for the text. None if it was not sent.
+        cost (str): What the text cost, like "KES 0.8000". None if it was not sent.
+    """
+    __slots__ = ()
+
+    @property
+    def success(self):
+        return self.status == 'Success'
+
+
+class SMSDispatcher(object):
+    """
+    Queues texts, and sends them in batches from a single background thread, which also keeps
+    the gateway, since it's not safe to share between threads.
+
+    Attributes:
+        gateway (:class: `general.AfricasTalkingGateway.AfricasTalkingGateway`): The SMS gateway.
+        sender (str): The default sender id.
+        window (float): Seconds to wait for more texts, after the first one of a batch is queued.
+        size (int): The most recipients sent to in a single request.
+        requests (int): The number of requests made to the gateway so far.
+
+    Args:
+        gateway (Optional[:class: `general.AfricasTalkingGateway.AfricasTalkingGateway`]): As above.
+            Default is a gateway with the `USERNAME` and `APIKEY` settings, over a connection pool
+            configured by the `AFRICASTALKING_HTTP` setting.
+        sender (Optional[str]): As above. Default is "KOTS".
+        window (Optional[float]): As above. Default is the `SMS_BATCH` setting's WINDOW, or 0.5.
+        size (Optional[int]): As above. Default is the `SMS_BATCH` setting's SIZE, or 100.
+        threaded (Optional[bool]): Whether to send from the background thread. If False, the texts
+            are only sent on :func: `~general.sms.SMSDispatcher.flush`. Default is True.
+    """
+    def __init__(self, gateway=None, sender="KOTS", window=None, size=None, threaded=True):
+        options = getattr(settings, 'SMS_BATCH', {})
+        self.gateway = gateway or AfricasTalkingGateway(settings.USERNAME, settings.APIKEY, pool_=get_pool())
+        self.sender = sender
+        self.window = options.get('WINDOW', 0.5) if window is None else window
+        self.size = size or options.get('SIZE', 100)
+        self.requests = 0
+        self.threaded = threaded
+        self._pending = []
+        self._condition = threading.Condition()
+        self._send_lock = threading.Lock()
+        self._thread = None
+
+    def send(self, mobile, message, sender=None):
+        """
+        Queues a text.
+
+        Args:
+            mobile (str): The recipient's mobile number, like +254701234567.
+            message (str): The text.
+            sender (Optional[str]): The sender id. Default is `sender`.
+
+        Returns:
+            :class: `concurrent.futures.Future`: Resolves to the text's
+                :class: `general.sms.SMSStatus`.
+        """
+        future = Future()
+        with self._condition:
+            self._pending.append((mobile, message, sender or self.sender, future))
+            if self.threaded and self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='SMSDispatcher', daemon=True)
+                self._thread.start()
+            self._condition.notify()
+        return future
+
+    def flush(self):
+        """
+        Sends all the queued texts right away, in the calling thread.
+
+        Returns:
+            int: The number of texts sent.
+        """
+        with self._condition:
+            pending, self._pending = self._pending, []
+        self.dispatch(pending)
+        return len(pending)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._pending:
+                    self._condition.wait()
+                deadline = time.time() + self.window
+                while len(self._pending) < self.size and time.time() < deadline:
+                    self._condition.wait(deadline - time.time())
+                pending, self._pending = self._pending, []
+            try:
+                self.dispatch(pending)
+            except Exception:
+                logger.exception("Failed to dispatch %s texts", len(pending))
+
+    def dispatch(self, pending):
+        """
+        Sends the given texts, grouped by their message and sender.
+
+        Args:
+            pending (list): Tuples of the form (mobile, message, sender, future).
+        """
+        groups = OrderedDict()
+        for mobile, message, sender, future in pending:
+            groups.setdefault((message, sender), []).append((mobile, future))
+
+        for (message, sender), texts in groups.items():
+            for i in range(0, len(texts), self.size):
+                self.send_batch(message, sender, texts[i:i + self.size])
+
+    def send_batch(self, message, sender, texts):
+        """
+        Sends a message to many recipients in a single request, and resolves each text's future
+        with its own status. A failed request fails all its texts.
+
+        Args:
+            message (str): The text.
+            sender (str): The sender id.
+            texts (list): Tuples of the form (mobile, future).
+        """
+        numbers = list(OrderedDict.fromkeys(mobile for mobile, future in texts))
+        try:
+            with self._send_lock:
+                self.requests += 1
+                results = self.gateway.sendMessage(to_=','.join(numbers), message_=message, from_=sender)
+        except (AfricasTalkingGatewayException, IOError) as e:
+            logger.warning("Failed to send a text to %s recipients: %s", len(numbers), e)
+            for mobile, future in texts:
+                future.set_result(SMSStatus(mobile, str(e), None, None))
+            return
+
+        statuses = dict()
+        for result in results:
+            statuses[self.key(result['number'])] = SMSStatus(
+                result['number'], result['status'], result.get('messageId'), result.get('cost'))
+        for mobile, future in texts:
+            future.set_result(statuses.get(
+                self.key(mobile), SMSStatus(mobile, 'No status reported', None, None)))
+
+    @staticmethod
+    def key(number):
+        """
+        The gateway reports numbers in the international format, like +254701234567, even if
+        they were given like 0701234567, so the results are matched on the last nine digits.
+        """
+        return ''.join(c for c in number if c.isdigit())[-9:]
+
+
+def get_pool():
+    """
+    Get the connection pool for the SMS gateway, as configured by the `AFRICASTALKING_HTTP` setting.
+
+    Returns:
+        urllib3.PoolManager
+    """
+    options = getattr(settings, 'AFRICASTALKING_HTTP', {})
+    return getConnectionPool(poolSize_=options.get('POOL_SIZE', 10),
+                             connectTimeout_=options.get('CONNECT_TIMEOUT', 5.0),
+                             readTimeout_=options.get('READ_TIMEOUT', 30.0),
+                             retries_=options.get('RETRIES', 3),
+                             backoffFactor_=options.get('BACKOFF_FACTOR', 0.5))
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_sms_dispatcher():
+    """
+    Get the process wide SMS dispatcher, creating it the first time.
+
+    Returns:
+        general.sms.SMSDispatcher
+    """
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None:
+            _dispatcher = SMSDispatcher()
+        return _dispatcher
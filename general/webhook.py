@@ -0,0 +1,37 @@
+"""
+This module contains :class: `general.webhook.WebhookUpdater`, an updater whose webhook is served
+by :class: `general.webhook.ThreadedWebhookServer`.
+
+The library's webhook server handles one request at a time, with a listen backlog of 5. Telegram
+posts updates over several connections at once, so during a burst the extra connections are
+dropped, and only retried a second or so later.
+"""
+
+from socketserver import ThreadingMixIn
+from telegram.ext import Updater
+from telegram.utils.webhookhandler import WebhookServer, WebhookHandler
+
+
+class ThreadedWebhookServer(ThreadingMixIn, WebhookServer):
+    """
+    A webhook server that handles each request in its own thread. The handlers only put the
+    updates in the dispatcher's queue, so the threads are short lived.
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class WebhookUpdater(Updater):
+    """
+    An updater whose webhook, without TLS, is served by :class: `general.webhook.ThreadedWebhookServer`.
+    """
+    def _start_webhook(self, listen, port, url_path, cert, key, bootstrap_retries, clean, webhook_url):
+        if cert is not None and key is not None:
+            return super(WebhookUpdater, self)._start_webhook(
+                listen, port, url_path, cert, key, bootstrap_retries, clean, webhook_url)
+
+        self.logger.debug('Updater thread started')
+        if not url_path.startswith('/'):
+            url_path = '/{0}'.format(url_path)
+        self.httpd = ThreadedWebhookServer((listen, port), WebhookHandler, self.update_queue, url_path, self.bot)
+        self.httpd.serve_forever(poll_interval=1)
@@ -1,4 +1,14 @@
+import argparse
+
 from general.conversation import main
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Runs the Class Rep bot.")
+    parser.add_argument('--mode', choices=['polling', 'webhook'],
+                        help="How to receive the updates. Default is the BOT_MODE setting.")
+    parser.add_argument('--port', type=int, help="The webhook's port. Default is the PORT environment variable.")
+    parser.add_argument('--runtime', choices=['threads', 'asyncio'],
+                        help="What runs the handlers. Default is the BOT_RUNTIME setting.")
+    # Ignores the likes of --log-file, from the Procfile
+    args, unknown = parser.parse_known_args()
+    main(mode=args.mode, port=args.port, runtime=args.runtime)
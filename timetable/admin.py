@@ -1,7 +1,12 @@
-from django.contrib import admin
+import io
+import os
+from django.contrib import admin, messages
 from django.db import models
 from django import forms
-from .models import (Unit, Course, StudentClass, Student, Lecturer, Venue, Period, Lesson)
+from django.shortcuts import render
+from .models import (Unit, Course, StudentClass, Student, Lecturer, Venue, Period, Lesson, invalidate_timetables)
+from .importer import TimetableImporter, TimetableImportError
+from .overlaps import TimetableOverlaps
 
 
 class UnitAdmin(admin.ModelAdmin):
@@ -12,19 +17,87 @@ class CourseAdmin(admin.ModelAdmin):
     list_display = ('name',)
 
 
+class TimetableImportForm(forms.Form):
+    file = forms.FileField(help_text="A CSV or JSON file with the fields: %s" % ', '.join(TimetableImporter.FIELDS))
+
+
+def import_timetable(modeladmin, request, queryset):
+    """Imports a timetable, from an uploaded CSV or JSON file, into the selected class."""
+    if queryset.count() != 1:
+        modeladmin.message_user(request, "Please select a single class.", level=messages.ERROR)
+        return None
+    student_class = queryset.get()
+
+    if 'apply' in request.POST:
+        form = TimetableImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            upload = form.cleaned_data['file']
+            importer = TimetableImporter(student_class)
+            file = io.TextIOWrapper(upload.file, encoding='utf-8', newline='')
+            if os.path.splitext(upload.name)[1].lower() == '.json':
+                rows = importer.read_json(file)
+            else:
+                rows = importer.read_csv(file)
+            try:
+                created = importer.run(rows)
+            except TimetableImportError as e:
+                for error in e.errors:
+                    modeladmin.message_user(request, error, level=messages.ERROR)
+            else:
+                modeladmin.message_user(
+                    request,
+                    "Imported the timetable of %s. Created %s lessons, %s units, %s venues and %s periods." % (
+                        student_class, created['lessons'], created['units'], created['venues'], created['periods']))
+            return None
+    else:
+        form = TimetableImportForm()
+
+    return render(request, 'admin/timetable/import_timetable.html', {
+        'title': "Import a timetable",
+        'form': form,
+        'student_class': student_class,
+        'opts': modeladmin.model._meta,
+        'action_checkbox_name': admin.ACTION_CHECKBOX_NAME,
+    })
+
+import_timetable.short_description = "Import a timetable"
+
+
+class StudentClassForm(forms.ModelForm):
+    class Meta:
+        model = StudentClass
+        fields = '__all__'
+
+    def clean_lessons(self):
+        """
+        Checks the class's lessons for overlaps with one another, including the lessons being added,
+        whose periods may well be new.
+        """
+        lessons = self.cleaned_data['lessons']
+        collisions = TimetableOverlaps().validate(
+            (lesson.period.day, lesson.period.start, lesson.period.stop, lesson)
+            for lesson in lessons.select_related('period', 'unit', 'venue') if lesson.period)
+        if collisions:
+            raise forms.ValidationError(["Lesson overlap! \n%s\n%s" % collision for collision in collisions])
+        return lessons
+
+
 class StudentClassAdmin(admin.ModelAdmin):
+    form = StudentClassForm
+
     def s_units(self):
         return ', '.join(str(unit) for unit in self.units.all())
 
     list_display = ('year', 'course', 'semester', s_units,)
     list_display_links = list_display
+    actions = [import_timetable]
 
 
 class StudentAdmin(admin.ModelAdmin):
     def units(self):
         return ', '.join(str(unit) for unit in self.student_class.units.all())
 
-    list_display = ('name', 'mobile', units, 'email', 'username', 'chat_id',)
+    list_display = ('name', 'mobile', units, 'email', 'username', 'chat_id', 'is_rep',)
     list_display_links = ('name', 'mobile', 'email')
 
 
@@ -51,8 +124,13 @@ class LecturerForm(forms.ModelForm):
     def save(self, *args, **kwargs):
         instance = super(LecturerForm, self).save(commit=False)
         instance.save()
+        units = set(self.fields['units'].initial.values_list('pk', flat=True))
+        units.update(unit.pk for unit in self.cleaned_data['units'])
         self.fields['units'].initial.update(lecturer=None)
         self.cleaned_data['units'].update(lecturer=instance)
+        # Queryset updates send no signals, so the affected timetables are invalidated here.
+        invalidate_timetables(StudentClass.objects.filter(
+            lessons__unit__in=units).values_list('pk', flat=True))
         return instance
 
 
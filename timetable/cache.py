@@ -0,0 +1,251 @@
+"""
+This module contains the cache of rendered timetables, of:
+    1. :class: `timetable.cache.LRUBackend`
+    2. :class: `timetable.cache.DjangoCacheBackend`
+    3. :class: `timetable.cache.TimetableCache`
+
+Every student in a :class: `timetable.models.StudentClass` gets the very same timetable strings, so
+these are rendered once per class and kept until the class's timetable changes. The signal callbacks
+in :mod: `timetable.models` take care of the invalidation within a process. The edits made in other
+processes, like the admin, or `import_timetable`, don't fire them in the bot's process, so the
+class's version token expires after the backend's `ttl`, and everything keyed on it is rebuilt.
+
+The backend is picked by the `TIMETABLE_CACHE` setting, like:
+
+    TIMETABLE_CACHE = {
+        'BACKEND': 'timetable.cache.LRUBackend',
+        'OPTIONS': {'maxsize': 1024, 'ttl': 60},
+    }
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+
+class LRUBackend(object):
+    """
+    An in-process, thread-safe, least recently used cache. This is the default backend.
+
+    Seeing it lives in the process's memory, edits made in another process (say, the admin,
+    served by the `web` dyno) will not reach it. Its entries expire after `ttl` seconds, so such
+    edits are picked up within that long.
+
+    Attributes:
+        maxsize (int): The maximum number of entries kept. The least recently used entries are
+            evicted first.
+        ttl (float): Seconds after which an entry expires. None means never.
+
+    Args:
+        maxsize (Optional[int]): As above. Default is 512.
+        ttl (Optional[float]): As above. Default is None.
+    """
+    def __init__(self, maxsize=512, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # The keys mapped to tuples of the form (value, expires)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                return default
+            value, expires = self._data[key]
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                return default
+            return value
+
+    def set(self, key, value):
+        expires = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DjangoCacheBackend(object):
+    """
+    A backend over Django's cache framework, so that the rendered timetables can be shared
+    between processes, given a shared cache like memcached or the database cache. It needs such a
+    cache configured in the `CACHES` setting: Django's default is a per-process LocMemCache.
+
+    Attributes:
+        cache (:class: `django.core.cache.backends.base.BaseCache`): The Django cache in use.
+        timeout (int): Seconds after which entries expire. `None` means never.
+
+    Args:
+        alias (Optional[str]): The alias of the cache in the `CACHES` setting. Default is 'default'.
+        timeout (Optional[int]): As above.
+    """
+    def __init__(self, alias='default', timeout=None):
+        self.cache = caches[alias]
+        self.timeout = timeout
+
+    def get(self, key, default=None):
+        return self.cache.get(key, default)
+
+    def set(self, key, value):
+        self.cache.set(key, value, self.timeout)
+
+    def delete(self, key):
+        self.cache.delete(key)
+
+    def clear(self):
+        self.cache.clear()
+
+
+class TimetableCache(object):
+    """
+    Holds the rendered timetable strings, keyed by (student_class, view, day).
+
+    Rather than hunting down every key of a class whenever its timetable changes, each class
+    has a version token that is part of its keys. Invalidating the class simply replaces the
+    token, and the old entries age out of the backend. The same token lets
+    :class: `timetable.sessions.ChatSession`, :class: `timetable.schedule.ScheduleIndex` and
+    :class: `timetable.inline.InlineTimetable` tell, cheaply, that its class's timetable has
+    changed. The token expires along with the backend's entries, which is how the edits made in
+    other processes are picked up.
+
+    Attributes:
+        backend (object): Any object with `get`, `set`, `delete` and `clear` methods,
+            like :class: `timetable.cache.LRUBackend`.
+        hits (int): The number of renders served from the cache.
+        misses (int): The number of renders that had to hit the database.
+
+    Args:
+        backend (object): As above.
+    """
+    key_prefix = 'timetable'
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def make_key(self, student_class, *parts):
+        """
+        Builds a cache key.
+
+        Args:
+            student_class (:class: `timetable.models.StudentClass` or int): The class, or its primary key.
+            *parts: The rest of the key, like the view, day and version.
+
+        Returns:
+            str: The key.
+        """
+        student_class = getattr(student_class, 'pk', student_class)
+        return ':'.join(str(part) for part in (self.key_prefix, student_class) + parts)
+
+    def version(self, student_class):
+        """
+        Get the current version token of the class's timetable, creating one if need be.
+
+        Args:
+            student_class (:class: `timetable.models.StudentClass` or int): The class, or its primary key.
+
+        Returns:
+            str: The version token.
+        """
+        key = self.make_key(student_class, 'version')
+        version = self.backend.get(key)
+        if version is None:
+            # Also the case when the token has been evicted. A fresh token keeps
+            # the entries made under the evicted one from ever being served.
+            version = uuid.uuid4().hex
+            self.backend.set(key, version)
+        return version
+
+    def get_or_render(self, student_class, view, render, day=None):
+        """
+        Get the rendered string of the given view, rendering and storing it on a miss.
+
+        Args:
+            student_class (:class: `timetable.models.StudentClass` or int): The class, or its primary key.
+            view (str): The name of the view, like 'week' or 'day'.
+            render (callable): Called with no arguments to render the string on a miss.
+            day (Optional[str]): The day, for views of a single day.
+
+        Returns:
+            str: The rendered string.
+        """
+        key = self.make_key(student_class, view, day, self.version(student_class))
+        value = self.backend.get(key)
+        if value is None:
+            with self._lock:
+                self.misses += 1
+            value = render()
+            self.backend.set(key, value)
+        else:
+            with self._lock:
+                self.hits += 1
+        return value
+
+    def invalidate(self, student_class):
+        """
+        Drop all the rendered strings of the given class, by replacing its version token.
+
+        Args:
+            student_class (:class: `timetable.models.StudentClass` or int): The class, or its primary key.
+        """
+        self.backend.set(self.make_key(student_class, 'version'), uuid.uuid4().hex)
+
+    def clear(self):
+        """Drops everything in the backend and resets the counters."""
+        self.backend.clear()
+        with self._lock:
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """
+        Returns:
+            dict: The hit and miss counters, and the hit ratio.
+        """
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': float(self.hits) / total if total else 0.0,
+        }
+
+
+_timetable_cache = None
+_timetable_cache_lock = threading.Lock()
+
+
+def get_timetable_cache():
+    """
+    Get the process's :class: `timetable.cache.TimetableCache`, built from the `TIMETABLE_CACHE` setting.
+
+    Returns:
+        timetable.cache.TimetableCache
+    """
+    global _timetable_cache
+    if _timetable_cache is None:
+        with _timetable_cache_lock:
+            if _timetable_cache is None:
+                config = getattr(settings, 'TIMETABLE_CACHE', {})
+                backend = import_string(config.get('BACKEND', 'timetable.cache.LRUBackend'))
+                _timetable_cache = TimetableCache(backend(**config.get('OPTIONS', {})))
+    return _timetable_cache
@@ -7,10 +7,13 @@ django.setup()
 
 
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Updater, CommandHandler, CallbackQueryHandler
-from telegram import ParseMode
+from telegram.ext import Updater, CommandHandler, CallbackQueryHandler, MessageHandler, Filters
+from telegram import ParseMode, Chat
+from telegram.error import TelegramError
 from timetable.utils import StudentChatting
 from timetable.models import Student
+from general.outbox import get_send_queue
+from chats.groups import get_group_registry
 
 
 # Enable logging
@@ -19,6 +22,26 @@ logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s
 logger = logging.getLogger(__name__)
 
 
+def sent(chat_id):
+    """
+    Get a done callback for a reply queued in the outbox, which nobody waits on, that logs why
+    the reply failed, if it did.
+
+    Args:
+        chat_id (int): The chat replied to.
+
+    Returns:
+        callable: Taking the reply's :class: `concurrent.futures.Future`.
+    """
+    def callback(future):
+        error = future.exception()
+        if isinstance(error, TelegramError):
+            logger.warning("Failed to reply in %s: %s", chat_id, error)
+        elif error is not None:
+            logger.error("Failed to reply in %s: %s", chat_id, error)
+    return callback
+
+
 def today():
     return datetime.datetime.today().strftime("%A")
 
@@ -46,63 +69,115 @@ def get_inline_markup(frame=None):
     return InlineKeyboardMarkup(keyboard)
 
 
+def get_chat(message, user_id):
+    """
+    Get the chat whose timetable is asked for. That is, the class of the group the message came
+    from, as found in the group registry, or else the class of the student asking.
+
+    Args:
+        message (:class: `telegram.Message`): The message, or the message of a callback query.
+        user_id (int): The id of the user asking.
+
+    Returns:
+        timetable.utils.StudentChatting: Or None, if neither the group's class nor the student is known.
+    """
+    if message.chat.type != Chat.PRIVATE:
+        student_class = get_group_registry().get(message.chat_id)
+        if student_class is not None:
+            return StudentChatting.for_class(student_class)
+    try:
+        return StudentChatting(chat_id=user_id)
+    except Exception:
+        return None
+
+
+def register_first(bot, message):
+    keyboard = [[InlineKeyboardButton(
+        text="Chat in Private",
+        url="http://t.me/ClassRepBot?start=register")]]
+    get_send_queue().reply(
+        bot,
+        message,
+        "Please register first. Let's chat in private",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode=ParseMode.MARKDOWN
+    ).add_done_callback(sent(message.chat_id))
+
+
 def lessons(bot, update):
     # TODO find a way to determine if it's a lecturer or student, currently assuming a student
-
-    if update.message.chat.type == 'private':
-        chat_id = update.message.chat_id
-    else:
-        chat_id = update.message.from_user.id
-    chat = StudentChatting(chat_id=chat_id)
-    if chat.student:
+    chat = get_chat(update.message, update.message.from_user.id)
+    if chat:
         message = chat.get_day_lessons_string(today())
         reply_markup = get_inline_markup(frame="Today")
-        update.message.reply_text(message,
-                                  reply_markup=reply_markup,
-                                  parse_mode=ParseMode.MARKDOWN)
-    elif update.message.chat.type == 'group' and update.message.chat_id == -176518514:
-        message = "Please register first. Let's chat in private"
-        keyboard = [[InlineKeyboardButton(
-            text="Chat in Private",
-            url="http://t.me/ClassRepBot?start=register")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        update.message.reply_text(
-            message,
-            reply_markup=reply_markup,
-            parse_mode=ParseMode.MARKDOWN
-        )
+        get_send_queue().reply(bot, update.message, message,
+                               reply_markup=reply_markup,
+                               parse_mode=ParseMode.MARKDOWN).add_done_callback(sent(update.message.chat_id))
+    elif update.message.chat.type != Chat.PRIVATE:
+        register_first(bot, update.message)
+
+
+def now(bot, update):
+    chat = get_chat(update.message, update.message.from_user.id)
+    if chat:
+        get_send_queue().reply(bot, update.message, chat.get_now_string(),
+                               parse_mode=ParseMode.MARKDOWN).add_done_callback(sent(update.message.chat_id))
+    else:
+        register_first(bot, update.message)
+
+
+def next_lesson(bot, update):
+    chat = get_chat(update.message, update.message.from_user.id)
+    if chat:
+        get_send_queue().reply(bot, update.message, chat.get_next_string(),
+                               parse_mode=ParseMode.MARKDOWN).add_done_callback(sent(update.message.chat_id))
+    else:
+        register_first(bot, update.message)
 
 
 def lessons_particular(bot, update):
-    chat_id = update.callback_query.from_user.id
-    chat = StudentChatting(chat_id=chat_id)
     query = update.callback_query
-    if chat.student:
+    chat = get_chat(query.message, query.from_user.id)
+    if chat:
         if query.data == 'Today':
-            bot.editMessageText(text=chat.get_day_lessons_string(today()),
-                                chat_id=query.message.chat_id,
-                                message_id=query.message.message_id,
-                                reply_markup=get_inline_markup(frame=query.data),
-                                parse_mode=ParseMode.MARKDOWN)
+            get_send_queue().send(bot.editMessageText, query.message.chat_id,
+                                  text=chat.get_day_lessons_string(today()),
+                                  message_id=query.message.message_id,
+                                  reply_markup=get_inline_markup(frame=query.data),
+                                  parse_mode=ParseMode.MARKDOWN).add_done_callback(sent(query.message.chat_id))
         elif query.data == 'This Week':
-            bot.editMessageText(text=chat.get_week_lessons_string(),
-                                chat_id=query.message.chat_id,
-                                message_id=query.message.message_id,
-                                reply_markup=get_inline_markup(frame=query.data),
-                                parse_mode=ParseMode.MARKDOWN)
-    elif update.message.chat.type == 'group' and update.message.chat_id == -176518514:
-        message = "Please register first. Let's chat in private"
-        keyboard = [[InlineKeyboardButton(
-            text="Chat in Private",
-            url="http://t.me/ClassRepBot?start=register")]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
-        update.message.reply_text(
-            message,
-            reply_markup=reply_markup,
-            parse_mode=ParseMode.MARKDOWN
-        )
+            get_send_queue().send(bot.editMessageText, query.message.chat_id,
+                                  text=chat.get_week_lessons_string(),
+                                  message_id=query.message.message_id,
+                                  reply_markup=get_inline_markup(frame=query.data),
+                                  parse_mode=ParseMode.MARKDOWN).add_done_callback(sent(query.message.chat_id))
+    elif query.message.chat.type != Chat.PRIVATE:
+        register_first(bot, query.message)
+
+
+def group_status(bot, update):
+    """
+    Keeps the group registry up to date as the bot is added to groups, removed from them, or they
+    are upgraded to supergroups.
+    """
+    message = update.message
+    registry = get_group_registry()
+    if message.migrate_to_chat_id:
+        registry.migrate(message.chat_id, message.migrate_to_chat_id)
+    elif message.group_chat_created or message.supergroup_chat_created or (
+            message.new_chat_member and message.new_chat_member.id == bot.id):
+        group = registry.register(message.chat_id, message.chat.title, message.from_user.id)
+        if group.student_class_id is None:
+            get_send_queue().send(bot.sendMessage, message.chat_id,
+                                  text="Hi! I don't know which class this group is for yet. "
+                                       "Please have your class rep add me.").add_done_callback(sent(message.chat_id))
+    elif message.left_chat_member and message.left_chat_member.id == bot.id:
+        registry.unregister(message.chat_id)
 
 
 def get_group_chat_handlers():
     return [CommandHandler('lessons', lessons),
-            CallbackQueryHandler(lessons_particular)]
+            CommandHandler('now', now),
+            CommandHandler('next', next_lesson),
+            CallbackQueryHandler(lessons_particular),
+            MessageHandler(Filters.status_update, group_status)]
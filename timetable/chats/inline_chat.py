@@ -0,0 +1,10 @@
+from telegram.ext import InlineQueryHandler
+from timetable.inline import get_inline_timetable
+
+
+def inline_query(bot, update):
+    get_inline_timetable().answer(bot, update)
+
+
+def get_inline_query_handler():
+    return InlineQueryHandler(inline_query)
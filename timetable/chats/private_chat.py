@@ -6,7 +6,7 @@ django.setup()
 from telegram import (ReplyKeyboardMarkup, ReplyKeyboardRemove, ParseMode)
 from telegram.ext import (Updater, CommandHandler, MessageHandler, Filters, RegexHandler, ConversationHandler)
 import logging
-from timetable.utils import StudentChatting
+from timetable.sessions import ChatSession
 
 
 # Enable logging
@@ -53,7 +53,7 @@ def edit_units(bot, update, user_data):
 
 
 def add_unit(bot, update, user_data):
-    chat = StudentChatting(chat_id=update.message.chat_id)
+    chat = ChatSession.get_chat(user_data, update.message.chat_id)
     # Named constants used in the add_unit function
     code, name = range(20, 22)
 
@@ -90,7 +90,7 @@ def add_unit(bot, update, user_data):
                                   " /cancel to end the conversation." % msg,
                                   parse_mode=ParseMode.MARKDOWN)
 
-        user_data.clear()
+        ChatSession.clear(user_data)
         user_data['edit_unit'] = INIT
         user_data['unit'] = INIT
         return EDIT_UNITS
@@ -99,26 +99,31 @@ def add_unit(bot, update, user_data):
 
 
 def edit_unit(bot, update, user_data):
-    chat = StudentChatting(chat_id=update.message.chat_id)
+    chat = ChatSession.get_chat(user_data, update.message.chat_id)
     # Used to keep track of state in this function
     code_name, code_name_selected, unit_code, unit_name = range(30, 34)
 
     if user_data['unit'] == INIT:
 
-        markup = chat.get_markup(chat.get_units(with_code=False))
+        markup = chat.get_markup(chat.get_units_keyboard())
         if markup is None:
             update.message.reply_text("You have no units.",
                                       reply_markup=ReplyKeyboardRemove())
             return EDIT_UNITS  # Possibly return DONE
 
-        update.message.reply_text("Please select the unit to edit. /cancel to stop this conversation.",
+        update.message.reply_text("Please select the unit to edit, or send part of its code or name. "
+                                  "/cancel to stop this conversation.",
                                   reply_markup=markup)
         user_data['edit_unit'] = code_name
         user_data['unit'] = None
 
     elif user_data['edit_unit'] == code_name:
-        if chat.verify_unit_name(update.message.text):
-            user_data['unit_selected'] = update.message.text
+        units = chat.find_units(update.message.text)
+        if len(units) == 1:
+            user_data['unit_selected'] = units[0]
+        elif units:
+            update.message.reply_text("Which of these units?", reply_markup=chat.get_markup(units))
+            return EDIT_UNIT
         else:
             update.message.reply_text("The unit `%s` doesn't exist. Please correct and resend." % update.message.text)
             return EDIT_UNIT
@@ -159,7 +164,7 @@ def edit_unit(bot, update, user_data):
                 update.message.reply_text("Success! Would you like to /add, /edit or /remove another unit?"
                                           "/cancel to stop.",
                                           reply_keyboard=ReplyKeyboardRemove())
-                user_data.clear()
+                ChatSession.clear(user_data)
                 user_data['edit_unit'] = INIT
                 user_data['unit'] = INIT
                 return EDIT_UNITS
@@ -182,7 +187,7 @@ def edit_unit(bot, update, user_data):
             update.message.reply_text("Success! Would you like to /add, /edit or /remove another unit?"
                                       "/cancel to stop.",
                                       reply_markup=ReplyKeyboardRemove())
-            user_data.clear()
+            ChatSession.clear(user_data)
             user_data['unit'] = INIT
             user_data['edit_unit'] = INIT
             return EDIT_UNITS
@@ -195,26 +200,31 @@ def edit_unit(bot, update, user_data):
 
 
 def remove_unit(bot, update, user_data):
-    chat = StudentChatting(chat_id=update.message.chat_id)
+    chat = ChatSession.get_chat(user_data, update.message.chat_id)
     # Internal states
-    selection = range(40, 41)
+    selection = 40
 
     if user_data['unit'] == INIT:
-        units = chat.get_units(with_code=False)
+        units = chat.get_units_keyboard()
         if units is None:
             update.message.reply_text("You are unauthorised to remove units.",
                                       reply_markup=ReplyKeyboardRemove())
             return EDIT_UNITS  # Possibly return DONE
 
         markup = chat.get_markup(units)
-        update.message.reply_text("Please select the unit to remove. /cancel to stop this conversation.",
+        update.message.reply_text("Please select the unit to remove, or send part of its code or name. "
+                                  "/cancel to stop this conversation.",
                                   reply_markup=markup)
         user_data['remove_unit'] = selection
         user_data['unit'] = None
 
     elif user_data['remove_unit'] == selection:
-        if chat.verify_unit_name(update.message.text):
-            user_data['unit_selected'] = update.message.text
+        units = chat.find_units(update.message.text)
+        if len(units) == 1:
+            user_data['unit_selected'] = units[0]
+        elif units:
+            update.message.reply_text("Which of these units?", reply_markup=chat.get_markup(units))
+            return REMOVE_UNIT
         else:
             update.message.reply_text("The unit `%s` doesn't exist. Please correct and resend." % update.message.text,
                                       parse_mode=ParseMode.MARKDOWN)
@@ -224,7 +234,7 @@ def remove_unit(bot, update, user_data):
             update.message.reply_text("Success! Would you like to /add, /edit or /remove another unit?"
                                       " /cancel to stop.",
                                       reply_markup=ReplyKeyboardRemove())
-            user_data.clear()
+            ChatSession.clear(user_data)
             user_data['edit_unit'] = INIT
             user_data['unit'] = INIT
             return EDIT_UNITS
@@ -239,27 +249,31 @@ def edit_lessons(bot, update, user_data):
 
 
 def add_lesson(bot, update, user_data):
-    chat = StudentChatting(chat_id=update.message.chat_id)
+    chat = ChatSession.get_chat(user_data, update.message.chat_id)
     # Named constants used in the add_unit function
     unit, period_start, period_stop, period_day, l_type, venue, done = range(50, 57)
 
     if user_data['lesson'] == INIT:
-        markup = chat.get_markup(chat.get_units(with_code=False))
+        markup = chat.get_markup(chat.get_units_keyboard())
         if markup is None:
             update.message.reply_text(
                 "You have no units.",
                 reply_markup=ReplyKeyboardRemove())
             return EDIT_LESSONS
 
-        update.message.reply_text("Which unit?",
+        update.message.reply_text("Which unit? You may also send part of its code or name.",
                                   reply_markup=markup,
                                   parse_mode=ParseMode.MARKDOWN)
         user_data['add_lesson'] = period_start
         user_data['lesson'] = None
 
     elif user_data['add_lesson'] == period_start:
-        if chat.verify_unit_name(update.message.text):
-            user_data['unit_selected'] = update.message.text
+        units = chat.find_units(update.message.text)
+        if len(units) == 1:
+            user_data['unit_selected'] = units[0]
+        elif units:
+            update.message.reply_text("Which of these units?", reply_markup=chat.get_markup(units))
+            return ADD_LESSON
         else:
             update.message.reply_text(
                 "The unit `%s` doesn't exist. "
@@ -362,7 +376,7 @@ def add_lesson(bot, update, user_data):
                 "/add, /edit or /remove another lesson? /help",
                 reply_markup=ReplyKeyboardRemove()
             )
-            user_data.clear()
+            ChatSession.clear(user_data)
             user_data['lesson'] = INIT
             return EDIT_LESSONS
         else:
@@ -376,7 +390,7 @@ def add_lesson(bot, update, user_data):
 def edit_lesson(bot, update, user_data):
     # Internal states
     lesson_name, lesson_name_selected, period_start, period_stop, period_day, lesson_venue = range(70, 76)
-    chat = StudentChatting(chat_id=update.message.chat_id)
+    chat = ChatSession.get_chat(user_data, update.message.chat_id)
     if user_data['lesson'] == INIT:
         markup = chat.get_markup(chat.get_lessons_keyboard())
         if markup is None:
@@ -456,7 +470,7 @@ def edit_lesson(bot, update, user_data):
                 "/add, /edit or /remove another lesson? /help",
                 reply_markup=ReplyKeyboardRemove()
             )
-            user_data.clear()
+            ChatSession.clear(user_data)
             user_data['edit_lesson'] = INIT
             user_data['lesson'] = INIT
             return EDIT_LESSONS
@@ -503,6 +517,7 @@ def edit_lesson(bot, update, user_data):
             user_data['period'].append(update.message.text)
             result = chat.valid_period(
                 user_data['period'],
+                lesson=user_data['lesson_selected']
             )
         else:
             update.message.reply_text(
@@ -522,7 +537,7 @@ def edit_lesson(bot, update, user_data):
                     "/add, /edit or /remove another lesson? /help",
                     reply_markup=ReplyKeyboardRemove()
                 )
-                user_data.clear()
+                ChatSession.clear(user_data)
                 user_data['edit_lesson'] = INIT
                 user_data['lesson'] = INIT
                 return EDIT_LESSONS
@@ -543,13 +558,11 @@ def edit_lesson(bot, update, user_data):
 
     return EDIT_LESSON
 
-# TODO check editing periods into overlapping periods
-
 
 def remove_lesson(bot, update, user_data):
-    chat = StudentChatting(chat_id=update.message.chat_id)
+    chat = ChatSession.get_chat(user_data, update.message.chat_id)
     # Internal states
-    selection = range(60, 61)
+    selection = 60
 
     if user_data['lesson'] == INIT:
         lessons = chat.get_lessons()
@@ -587,7 +600,7 @@ def remove_lesson(bot, update, user_data):
                 "\n/help",
                 reply_markup=ReplyKeyboardRemove()
             )
-            user_data.clear()
+            ChatSession.clear(user_data)
             user_data['edit_unit'] = INIT
             user_data['unit'] = INIT
             return EDIT_LESSONS
@@ -596,7 +609,7 @@ def remove_lesson(bot, update, user_data):
 
 
 def view_units(bot, update, user_data):
-    chat = StudentChatting(chat_id=update.message.chat_id)
+    chat = ChatSession.get_chat(user_data, update.message.chat_id)
     units = chat.get_units(with_code=True)
     if units is None:
         update.message.reply_text("You have no units.",
@@ -617,7 +630,7 @@ def view_units(bot, update, user_data):
 
 
 def view_lessons(bot, update, user_data):
-    chat = StudentChatting(chat_id=update.message.chat_id)
+    chat = ChatSession.get_chat(user_data, update.message.chat_id)
     lessons = chat.get_lessons()
     if lessons is None:
         update.message.reply_text("You have no lessons.",
@@ -632,7 +645,7 @@ def view_lessons(bot, update, user_data):
                               chat.get_lessons_string(),
                               reply_markup=ReplyKeyboardRemove(),
                               parse_mode=ParseMode.MARKDOWN)
-    user_data.clear()
+    ChatSession.clear(user_data)
     user_data['lesson'] = INIT
     return EDIT_LESSONS
 
@@ -0,0 +1,121 @@
+"""
+This module contains :class: `timetable.classes.ClassDirectory`, an in-memory directory of the
+classes, by the labels students pick them by when registering, like
+"BSc. Mechatronics Engineering Fourth Year".
+
+The labels are each class's `str()`, which needs its course. Rather than rendering every class,
+and querying its course, each time the keyboard is shown or a choice is checked, the directory is
+loaded in a single query, the first time it's used, and dropped by the signals of the classes and
+courses whenever one is saved or deleted.
+
+The classes are made in the admin, in another process, whose signals don't reach the bot's. So a
+label that isn't found is looked for again in a fresh load, and the directory is reloaded every so
+often, on the bot's job queue, for the class keyboard to show the new classes.
+"""
+
+import threading
+from collections import OrderedDict
+from django.db.models.signals import post_save, post_delete
+from telegram.ext import Job
+from timetable.models import StudentClass, Course
+
+
+class ClassDirectory(object):
+    """
+    The classes, by their labels.
+
+    Attributes:
+        classes (:class: `collections.OrderedDict`): The classes' labels mapped to their primary
+            keys, in the order the classes were made. None if not loaded yet.
+    """
+    def __init__(self):
+        self.classes = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def load(self):
+        """
+        Loads the classes, with their courses, in a single query.
+
+        Returns:
+            :class: `collections.OrderedDict`: As in `classes`.
+        """
+        generation = self._generation
+        classes = OrderedDict((str(student_class), student_class.pk) for student_class in
+                              StudentClass.objects.select_related('course').order_by('pk'))
+        with self._lock:
+            # Unless a class changed while they were being loaded
+            if self._generation == generation:
+                self.classes = classes
+        return classes
+
+    def get_classes(self):
+        classes = self.classes
+        if classes is None:
+            classes = self.load()
+        return classes
+
+    def labels(self):
+        """
+        Returns:
+            list: The classes' labels, for the class keyboard.
+        """
+        return list(self.get_classes())
+
+    def __contains__(self, label):
+        return self.get(label) is not None
+
+    def get(self, label):
+        """
+        Get the class with the given label, reloading the directory if it isn't there, in case the
+        class was made by another process.
+
+        Returns:
+            int: The class's primary key. None if no class has the label.
+        """
+        student_class = self.get_classes().get(label)
+        if student_class is None:
+            student_class = self.load().get(label)
+        return student_class
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self.classes = None
+
+    def start(self, job_queue, interval=300):
+        """
+        Reloads the directory every so often on the given job queue, to pick up the classes and
+        courses edited by other processes, like in the admin.
+
+        Args:
+            job_queue (:class: `telegram.ext.JobQueue`): Like the updater's job queue.
+            interval (Optional[int]): Seconds between reloads. Default is 300.
+
+        Returns:
+            telegram.ext.Job
+        """
+        job = Job(lambda bot, job: self.load(), interval)
+        job_queue.put(job, next_t=0)
+        return job
+
+
+_class_directory = ClassDirectory()
+
+
+def get_class_directory():
+    """
+    Get the process's :class: `timetable.classes.ClassDirectory`.
+
+    Returns:
+        timetable.classes.ClassDirectory
+    """
+    return _class_directory
+
+
+def class_changed_callback(sender, **kwargs):
+    _class_directory.invalidate()
+
+for class_model in (StudentClass, Course):
+    post_save.connect(class_changed_callback, sender=class_model)
+    post_delete.connect(class_changed_callback, sender=class_model)
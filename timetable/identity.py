@@ -0,0 +1,173 @@
+"""
+This module contains :class: `timetable.identity.IdentityCache`, which tells who is behind a
+Telegram chat: a student, a lecturer, or someone new.
+
+A chat's identity is resolved in a single query, on the `chat_id` indexes of both the students and
+the lecturers, and then kept in a bounded, per-process cache, so that most messages don't need a
+query at all to tell who sent them. The signal callbacks below drop a student's, or lecturer's,
+identity whenever they are saved or deleted. Those saved or deleted in other processes, like the
+admin, don't fire them here, so the identities also expire after a while, and are resolved again.
+
+The cache's size, and how long the identities are kept, are set by the `IDENTITY_CACHE` setting.
+"""
+
+import threading
+from collections import namedtuple
+from django.conf import settings
+from django.db import connection
+from django.db.models.signals import post_save, post_delete
+from timetable.cache import LRUBackend
+from timetable.models import Student, Lecturer
+
+STUDENT = 'student'
+LECTURER = 'lecturer'
+
+Identity = namedtuple('Identity', ['role', 'pk', 'student_class'])
+Identity.__doc__ = """
+The identity of a chat.
+
+Attributes:
+    role (str): Either `STUDENT` or `LECTURER`. None if the chat is new.
+    pk (int): The primary key of the :class: `timetable.models.Student`, or the
+        :class: `timetable.models.Lecturer`.
+    student_class (int): The primary key of a student's class.
+"""
+
+NEW = Identity(None, None, None)
+
+
+class IdentityCache(object):
+    """
+    The identities of the chats, by their chat ids.
+
+    Attributes:
+        backend (:class: `timetable.cache.LRUBackend`): The chat ids, as strings, mapped to their
+            :class: `timetable.identity.Identity`.
+        hits (int): The number of identities served from the cache.
+        misses (int): The number of identities that had to be queried.
+
+    Args:
+        maxsize (Optional[int]): The most identities kept. Default is 10000.
+        ttl (Optional[float]): Seconds an identity is kept. Default is 60.
+    """
+    def __init__(self, maxsize=10000, ttl=60):
+        self.backend = LRUBackend(maxsize, ttl)
+        self.hits = 0
+        self.misses = 0
+        # The chat id last cached for each (role, pk), to drop it even after the chat id changes
+        self._keys = dict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def load(chat_id):
+        """
+        Resolves the identity of a chat, in a single query.
+
+        Args:
+            chat_id (int or str): The chat's id.
+
+        Returns:
+            timetable.identity.Identity
+        """
+        query = (
+            "SELECT 1, id, student_class_id FROM {student} WHERE chat_id = %s "
+            "UNION ALL "
+            "SELECT 2, id, NULL FROM {lecturer} WHERE chat_id = %s"
+        ).format(student=Student._meta.db_table, lecturer=Lecturer._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(query, [int(chat_id), int(chat_id)])
+            rows = sorted(cursor.fetchall())
+        if not rows:
+            return NEW
+        role, pk, student_class = rows[0]
+        return Identity(STUDENT if role == 1 else LECTURER, pk, student_class)
+
+    def get(self, chat_id):
+        """
+        Get the identity of a chat, resolving it on a miss.
+
+        Args:
+            chat_id (int or str): The chat's id.
+
+        Returns:
+            timetable.identity.Identity
+        """
+        key = str(chat_id)
+        identity = self.backend.get(key)
+        if identity is not None:
+            with self._lock:
+                self.hits += 1
+            return identity
+        generation = self._generation
+        identity = self.load(chat_id)
+        with self._lock:
+            self.misses += 1
+            # Unless a student, or lecturer, changed while it was being resolved
+            if self._generation == generation:
+                if len(self._keys) > 2 * self.backend.maxsize:
+                    self._keys.clear()
+                if identity.role is not None:
+                    self._keys[(identity.role, identity.pk)] = key
+                self.backend.set(key, identity)
+        return identity
+
+    def invalidate(self, chat_id=None, role=None, pk=None):
+        """
+        Drops the identity of a chat, and that of a student, or lecturer, whatever their chat id was.
+
+        Args:
+            chat_id (Optional[int or str]): The chat's id.
+            role (Optional[str]): Either `STUDENT` or `LECTURER`.
+            pk (Optional[int]): The student's, or lecturer's, primary key.
+        """
+        with self._lock:
+            self._generation += 1
+            key = self._keys.pop((role, pk), None)
+            if key is not None:
+                self.backend.delete(key)
+            if chat_id:
+                self.backend.delete(str(chat_id))
+
+    def clear(self):
+        """Drops all the identities and resets the counters."""
+        self.backend.clear()
+        with self._lock:
+            self._keys.clear()
+            self.hits = 0
+            self.misses = 0
+
+
+_identity_cache = None
+_identity_cache_lock = threading.Lock()
+
+
+def get_identity_cache():
+    """
+    Get the process wide identity cache, configured by the `IDENTITY_CACHE` setting, creating it
+    the first time.
+
+    Returns:
+        timetable.identity.IdentityCache
+    """
+    global _identity_cache
+    with _identity_cache_lock:
+        if _identity_cache is None:
+            options = getattr(settings, 'IDENTITY_CACHE', {})
+            _identity_cache = IdentityCache(maxsize=options.get('MAXSIZE', 10000), ttl=options.get('TTL', 60))
+        return _identity_cache
+
+
+def student_changed_callback(sender, **kwargs):
+    instance = kwargs['instance']
+    get_identity_cache().invalidate(instance.chat_id, STUDENT, instance.pk)
+
+
+def lecturer_changed_callback(sender, **kwargs):
+    instance = kwargs['instance']
+    get_identity_cache().invalidate(instance.chat_id, LECTURER, instance.pk)
+
+post_save.connect(student_changed_callback, sender=Student)
+post_delete.connect(student_changed_callback, sender=Student)
+post_save.connect(lecturer_changed_callback, sender=Lecturer)
+post_delete.connect(lecturer_changed_callback, sender=Lecturer)
@@ -0,0 +1,323 @@
+"""
+This module contains :class: `timetable.importer.TimetableImporter`, which imports a whole
+timetable for a :class: `timetable.models.StudentClass` from a CSV or JSON file, in a handful of
+queries, rather than a conversation with the bot per lesson.
+
+Each row, or JSON object, describes a single lesson, like:
+
+    unit,unit_name,day,start,stop,venue,type
+    EMT 2445,Research Methodology for Engineers,Monday,07:00 AM,10:00 AM,ELB 114,Theory
+
+`unit_name` is only needed for units that do not exist yet, and `type` defaults to `Theory`.
+Times may be given as `07:00 AM` or `07:00`.
+
+The importer is used by the `import_timetable` management command and the "Import a timetable"
+admin action.
+"""
+
+import csv
+import itertools
+import json
+import datetime as dt
+from django.db import transaction
+from timetable.models import Unit, Venue, Period, Lesson, StudentClass, invalidate_timetables
+from timetable.index import TimetableIndex
+from timetable.overlaps import TimetableOverlaps
+from timetable.units import get_unit_index
+
+
+class TimetableImportError(Exception):
+    """
+    Raised when a timetable cannot be imported. Nothing is written to the database in that case.
+
+    Attributes:
+        errors (list): Messages, one per problem found, prefixed with the row number.
+    """
+    def __init__(self, errors):
+        super(TimetableImportError, self).__init__('\n'.join(errors))
+        self.errors = errors
+
+
+class TimetableImporter(object):
+    """
+    Imports lessons into a class's timetable.
+
+    Units, venues and periods are resolved in bulk, the new periods are checked for overlaps in
+    memory, through :class: `timetable.overlaps.TimetableOverlaps`, and everything is written with
+    `bulk_create` inside a single transaction.
+
+    Attributes:
+        student_class (:class: `timetable.models.StudentClass`): The class whose timetable is imported.
+        created (dict): The number of units, venues, periods and lessons created by the latest `run`.
+
+    Args:
+        student_class (:class: `timetable.models.StudentClass`): As above.
+    """
+    FIELDS = ['unit', 'unit_name', 'day', 'start', 'stop', 'venue', 'type']
+    TIME_FORMATS = ['%I:%M %p', '%H:%M']
+    TYPE = dict((name, l_type) for l_type, name in Lesson.TYPE)
+
+    def __init__(self, student_class):
+        self.student_class = student_class
+        self.created = dict()
+
+    @staticmethod
+    def read_csv(file):
+        """
+        Reads rows from a CSV file with a header row. The file is read as it is iterated.
+
+        Args:
+            file (file): A file opened in text mode.
+
+        Returns:
+            iterator: Of dicts, one per lesson.
+        """
+        return csv.DictReader(file)
+
+    @staticmethod
+    def read_json(file):
+        """
+        Reads rows from either a JSON list of objects, or a file with one JSON object per line.
+
+        Args:
+            file (file): A file opened in text mode.
+
+        Returns:
+            iterator: Of dicts, one per lesson.
+        """
+        first = file.read(1)
+        while first.isspace():
+            first = file.read(1)
+        if first == '[':
+            for row in json.loads(first + file.read()):
+                yield row
+        else:
+            lines = iter(file)
+            yield json.loads(first + next(lines, ''))
+            for line in lines:
+                if line.strip():
+                    yield json.loads(line)
+
+    @classmethod
+    def parse_time(cls, value):
+        for time_format in cls.TIME_FORMATS:
+            try:
+                return dt.datetime.strptime(value.strip(), time_format).time()
+            except ValueError:
+                pass
+        raise ValueError("'%s' is not a time like 07:00 AM" % value)
+
+    def parse(self, rows):
+        """
+        Parses and checks the rows, one by one. The rows that can't be read, like malformed JSON,
+        are reported as errors too.
+
+        Args:
+            rows (iterable): Of dicts, as read by `read_csv` or `read_json`.
+
+        Returns:
+            tuple: Of the form (lessons, errors). `lessons` is a list of dicts with the parsed
+                values, and `errors` a list of messages.
+        """
+        lessons = []
+        errors = []
+        rows = iter(rows)
+        for number in itertools.count(1):
+            try:
+                row = next(rows)
+            except StopIteration:
+                break
+            except (ValueError, csv.Error) as e:
+                # Like malformed JSON, or a file that isn't UTF-8, after which the rest can't be read
+                errors.append('Row %s: %s' % (number, e))
+                break
+            try:
+                if not isinstance(row, dict):
+                    raise ValueError("%r is not an object, with the fields as its keys" % (row,))
+                row = dict((key, str(value).strip()) for key, value in row.items() if value is not None)
+                for field in ['unit', 'day', 'start', 'stop', 'venue']:
+                    if not row.get(field):
+                        raise ValueError("'%s' is missing" % field)
+                if row['day'].title() not in TimetableIndex.DAY:
+                    raise ValueError("'%s' is not a day of the week" % row['day'])
+                lesson = {
+                    'number': number,
+                    'unit': row['unit'].upper(),
+                    'unit_name': row.get('unit_name', '').title(),
+                    'day': TimetableIndex.DAY[row['day'].title()],
+                    'start': self.parse_time(row['start']),
+                    'stop': self.parse_time(row['stop']),
+                    'venue': row['venue'].upper(),
+                    'type': self.TYPE.get(row.get('type', '').title() or 'Theory'),
+                }
+                if lesson['type'] is None:
+                    raise ValueError("'%s' is neither Theory nor Practical" % row['type'])
+                if lesson['stop'] <= lesson['start']:
+                    raise ValueError('Stop time cannot be earlier than or equal to start time.')
+            except ValueError as e:
+                errors.append('Row %s: %s' % (number, e))
+            else:
+                lessons.append(lesson)
+        return lessons, errors
+
+    def run(self, rows):
+        """
+        Imports the rows into the class's timetable.
+
+        Args:
+            rows (iterable): Of dicts, as read by `read_csv` or `read_json`.
+
+        Returns:
+            dict: The number of units, venues, periods and lessons created.
+
+        Raises:
+            TimetableImportError: If any of the rows is invalid, or collides with another lesson of
+                the class. Nothing is imported in that case.
+        """
+        lessons, errors = self.parse(rows)
+        if errors:
+            raise TimetableImportError(errors)
+
+        with transaction.atomic():
+            units = self.resolve_units(lessons, errors)
+            # The class's lessons that are identical to a row are reused by it, like when the same
+            # file is imported again, so they aren't checked against the rows
+            index = TimetableIndex.load(self.student_class)
+            rows = set((lesson['unit'], lesson['venue'], lesson['day'], lesson['start'], lesson['stop'],
+                        lesson['type']) for lesson in lessons)
+            reused = [pk for pk, lesson in index.lessons.items() if lesson.period and (
+                lesson.unit.code, getattr(lesson.venue, 'name', None), lesson.period.day,
+                lesson.period.start, lesson.period.stop, lesson.type) in rows]
+            collisions = TimetableOverlaps.from_index(index, exclude=reused).validate(
+                (lesson['day'], lesson['start'], lesson['stop'], lesson) for lesson in lessons)
+            for lesson, collision in collisions:
+                # Either of the two may be an existing lesson, rather than a row
+                if not isinstance(lesson, dict):
+                    lesson, collision = collision, lesson
+                if isinstance(collision, dict):
+                    collision = 'Row %s' % collision['number']
+                errors.append('Row %s: Lesson overlap! %s' % (lesson['number'], collision))
+            if errors:
+                raise TimetableImportError(errors)
+
+            venues = self.resolve_venues(lessons)
+            periods = self.resolve_periods(lessons)
+            created_lessons = self.create_lessons(lessons, units, venues, periods)
+
+        invalidate_timetables([self.student_class.pk])
+        # bulk_create sends no signals, so the unit searches are invalidated here too. The new
+        # units are in the index of all the units, besides the class's
+        get_unit_index().invalidate(None if self.created['units'] else self.student_class.pk)
+        self.created['lessons'] = created_lessons
+        return self.created
+
+    def resolve_units(self, lessons, errors):
+        """
+        Fetches the units of the lessons in a single query, creating the missing ones that
+        have a name, and adds them to the class.
+
+        Returns:
+            dict: Unit codes mapped to :class: `timetable.models.Unit` objects.
+        """
+        codes = set(lesson['unit'] for lesson in lessons)
+        units = dict((unit.code, unit) for unit in Unit.objects.filter(code__in=codes))
+
+        new_units = dict()
+        for lesson in lessons:
+            if lesson['unit'] in units or lesson['unit'] in new_units:
+                continue
+            if lesson['unit_name']:
+                new_units[lesson['unit']] = Unit(code=lesson['unit'], name=lesson['unit_name'])
+            else:
+                errors.append("Row %s: The unit '%s' doesn't exist, and has no unit_name"
+                              % (lesson['number'], lesson['unit']))
+        if errors:
+            return units
+
+        # bulk_create only sets the primary keys on PostgreSQL, so the new units are fetched again
+        Unit.objects.bulk_create(new_units.values())
+        self.created['units'] = len(new_units)
+        if new_units:
+            units.update((unit.code, unit) for unit in Unit.objects.filter(code__in=new_units))
+
+        through = StudentClass.units.through
+        existing = set(through.objects.filter(
+            studentclass=self.student_class).values_list('unit_id', flat=True))
+        through.objects.bulk_create([
+            through(studentclass_id=self.student_class.pk, unit_id=unit.pk)
+            for unit in units.values() if unit.pk not in existing])
+        return units
+
+    def resolve_venues(self, lessons):
+        """
+        Fetches the venues of the lessons in a single query, creating the missing ones.
+
+        Returns:
+            dict: Venue names mapped to :class: `timetable.models.Venue` objects.
+        """
+        names = set(lesson['venue'] for lesson in lessons)
+        venues = dict((venue.name, venue) for venue in Venue.objects.filter(name__in=names))
+        missing = names - set(venues)
+        Venue.objects.bulk_create([Venue(name=name) for name in missing])
+        self.created['venues'] = len(missing)
+        if missing:
+            venues.update((venue.name, venue) for venue in Venue.objects.filter(name__in=missing))
+        return venues
+
+    def resolve_periods(self, lessons):
+        """
+        Fetches the periods of the lessons, creating the missing ones. Periods are shared by
+        lessons at the very same time, even across classes.
+
+        Returns:
+            dict: Tuples of the form (start, stop, day) mapped to :class: `timetable.models.Period` objects.
+        """
+        days = set(lesson['day'] for lesson in lessons)
+
+        def fetch():
+            return dict(((period.start, period.stop, period.day), period)
+                        for period in Period.objects.filter(day__in=days))
+
+        periods = fetch()
+        missing = set((lesson['start'], lesson['stop'], lesson['day']) for lesson in lessons) - set(periods)
+        Period.objects.bulk_create([Period(start=start, stop=stop, day=day) for start, stop, day in missing])
+        self.created['periods'] = len(missing)
+        if missing:
+            periods = fetch()
+        return periods
+
+    def create_lessons(self, lessons, units, venues, periods):
+        """
+        Creates the lessons, reusing identical lessons, like `add_lesson` does, and adds them to the class.
+
+        Returns:
+            int: The number of lessons created.
+        """
+        def key(lesson):
+            return lesson.unit_id, lesson.venue_id, lesson.period_id, lesson.type
+
+        def fetch():
+            return dict((key(lesson), lesson.pk) for lesson in Lesson.objects.filter(
+                period__in=[period.pk for period in periods.values()]))
+
+        new_lessons = dict()
+        for lesson in lessons:
+            new_lesson = Lesson(unit=units[lesson['unit']],
+                                venue=venues[lesson['venue']],
+                                period=periods[(lesson['start'], lesson['stop'], lesson['day'])],
+                                type=lesson['type'])
+            new_lessons[key(new_lesson)] = new_lesson
+
+        existing = fetch()
+        missing = [lesson for lesson_key, lesson in new_lessons.items() if lesson_key not in existing]
+        Lesson.objects.bulk_create(missing)
+        if missing:
+            existing = fetch()
+
+        through = StudentClass.lessons.through
+        linked = set(through.objects.filter(
+            studentclass=self.student_class).values_list('lesson_id', flat=True))
+        through.objects.bulk_create([
+            through(studentclass_id=self.student_class.pk, lesson_id=existing[lesson_key])
+            for lesson_key in new_lessons if existing[lesson_key] not in linked])
+        return len(missing)
@@ -0,0 +1,117 @@
+"""
+This module contains :class: `timetable.index.TimetableIndex`, an index over a class's
+timetable, as loaded by :class: `timetable.loaders.TimetableLoader`.
+"""
+
+from collections import OrderedDict
+from timetable.loaders import TimetableLoader
+from timetable.models import Period
+
+
+class TimetableIndex(object):
+    """
+    Indexes a class's timetable by the labels of the lessons keyboard, by primary key and by day.
+    It is built once per load, so that validating a keyboard label, or fetching the lesson behind
+    it, takes a dict lookup rather than another trip to the database.
+
+    Attributes:
+        rows (list): The lessons in their tuple representations, in the order they were loaded.
+            See :func: `~timetable.loaders.TimetableLoader.as_tuple`.
+        labels (:class: `collections.OrderedDict`): The keyboard label of each lesson, mapped to
+            the lesson's primary key.
+        lessons (dict): Primary keys mapped to the :class: `timetable.models.Lesson` objects, with
+            their period, unit, lecturer and venue already loaded.
+        tuples (dict): Primary keys mapped to the lessons' tuple representations.
+        days (dict): The days of the week, as in `Period.DAY`, mapped to the primary keys of the
+            day's lessons, ordered by their start times.
+
+    Args:
+        lessons (list): The :class: `timetable.models.Lesson` objects.
+        rows (list): The lessons' tuple representations, in the same order as `lessons`.
+    """
+    # Day names, as in `Period.DAY`, mapped to their integer representation
+    DAY = dict((name, day) for day, name in Period.DAY)
+
+    def __init__(self, lessons, rows):
+        self.rows = rows
+        self.labels = OrderedDict()
+        self.lessons = dict()
+        self.tuples = dict()
+        self.days = dict()
+
+        for lesson, row in zip(lessons, rows):
+            self.labels[self.label(row)] = lesson.pk
+            self.lessons[lesson.pk] = lesson
+            self.tuples[lesson.pk] = row
+            if lesson.period:
+                self.days.setdefault(lesson.period.day, []).append(lesson.pk)
+
+        for pks in self.days.values():
+            pks.sort(key=lambda pk: self.lessons[pk].period.start)
+
+    @classmethod
+    def load(cls, student_class):
+        """
+        Loads and indexes the timetable of the given class.
+
+        Args:
+            student_class (:class: `timetable.models.StudentClass` or int): The class, or its primary key.
+
+        Returns:
+            timetable.index.TimetableIndex
+        """
+        loader = TimetableLoader(student_class)
+        rows = loader.load()
+        return cls(loader.lessons, rows)
+
+    @staticmethod
+    def label(row):
+        """
+        Get the label of a lesson on the lessons keyboard.
+
+        Args:
+            row (tuple): The lesson's tuple representation
+
+        Returns:
+            str: The period and unit, on separate lines.
+        """
+        return "\n".join([row[0], row[1]])
+
+    def keyboard(self):
+        """
+        Returns:
+            list: The labels of the lessons, for the lessons keyboard.
+        """
+        return list(self.labels)
+
+    def __contains__(self, label):
+        return label in self.labels
+
+    def get(self, label):
+        """
+        Get the lesson behind the given keyboard label.
+
+        Args:
+            label (str): The lesson's keyboard label
+
+        Returns:
+            timetable.models.Lesson: Or None, if no lesson has the label.
+        """
+        pk = self.labels.get(label)
+        if pk is None:
+            return None
+        return self.lessons[pk]
+
+    def day_lessons(self, day):
+        """
+        Get the lessons of the given day, ordered by their start times.
+
+        Args:
+            day (str or int): The day's name, like 'Monday', or its integer representation
+                as in `Period.DAY`.
+
+        Returns:
+            list: The lessons' tuple representations.
+        """
+        day = self.DAY.get(day, day)
+        return [self.tuples[pk] for pk in self.days.get(day, [])]
@@ -0,0 +1,234 @@
+"""
+This module contains :class: `timetable.inline.InlineTimetable`, which answers the bot's inline
+queries, like "@ClassRepBot today" or "@ClassRepBot EMT 2445", from any chat.
+
+Every student in a class gets the same answers, so the results of a class, one for each day, one
+for the week and one for each of its units, are built once, from a single query, and kept until
+the class's timetable changes. They are keyed by the class's version token in
+:mod: `timetable.cache`, so the signal callbacks in :mod: `timetable.models` drop them along with
+the rendered timetables, and so does the token's expiry, for the edits made in other processes.
+The identity of each user, in :mod: `timetable.identity`, and the units, in
+:mod: `timetable.units`, are kept in memory as well, so an inline query is answered without a
+trip to the database, unless it's for a unit the class doesn't take.
+
+The answers are cached by Telegram, for each user, for `cache_time` seconds, as set by the
+`INLINE_QUERIES` setting.
+"""
+
+import calendar
+import datetime
+import threading
+from collections import OrderedDict
+from django.conf import settings
+from django.utils import timezone
+from telegram import InlineQueryResultArticle, InputTextMessageContent, ParseMode
+from timetable.cache import LRUBackend, get_timetable_cache
+from timetable.loaders import TimetableLoader
+from timetable.identity import get_identity_cache, STUDENT
+from timetable.models import Lesson
+from timetable.units import get_unit_index
+from timetable.utils import StudentChatting
+
+
+class InlineResults(object):
+    """
+    The prebuilt inline query results of a class.
+
+    Attributes:
+        days (:class: `collections.OrderedDict`): The days' names, like 'Monday', mapped to the
+            results with their lessons.
+        week (:class: `telegram.InlineQueryResultArticle`): The result with the week's lessons.
+        units (dict): The primary keys of the class's units mapped to the results with their lessons.
+
+    Args:
+        chat (:class: `timetable.utils.StudentChatting`): A chat about the class's timetable.
+    """
+    def __init__(self, chat):
+        index = chat.get_index()
+        self.days = OrderedDict()
+        texts = dict()
+        for day in calendar.day_name:
+            rows = index.day_lessons(day)
+            texts[day] = self.render(day.upper(), rows)
+            self.days[day] = InlineTimetable.article(
+                'day:%s' % day, day, "%s lessons" % len(rows) if rows else "No lessons", texts[day])
+        self.week = InlineTimetable.article('week', "This Week", "The whole week's lessons",
+                                            "\n\n".join(texts[day] for day in calendar.day_name[:5]))
+
+        lessons = dict()
+        for pk, lesson in index.lessons.items():
+            lessons.setdefault(lesson.unit_id, []).append((lesson, index.tuples[pk]))
+        self.units = dict((unit, InlineTimetable.unit_article(unit, lessons[unit])) for unit in lessons)
+
+    @staticmethod
+    def render(title, rows):
+        """
+        Args:
+            title (str): Like 'MONDAY'.
+            rows (list): The lessons' tuple representations.
+
+        Returns:
+            str: The lessons, under the title.
+        """
+        if not rows:
+            return "*%s*\n\nNo lessons." % title
+        return "*%s*\n" % title + "".join("\n%s\n" % StudentChatting.render_lesson(row) for row in rows)
+
+
+class InlineTimetable(object):
+    """
+    Answers the inline queries.
+
+    Attributes:
+        cache_time (int): Seconds Telegram may cache an answer, for each user.
+        results (:class: `timetable.cache.LRUBackend`): The classes' :class: `timetable.inline.InlineResults`.
+        limit (int): The most units in an answer.
+
+    Args:
+        cache_time (Optional[int]): As above. Default is 300.
+        maxsize (Optional[int]): The most classes kept in memory. Default is 10000.
+        limit (Optional[int]): As above. Default is 10.
+    """
+    def __init__(self, cache_time=300, maxsize=10000, limit=10):
+        self.cache_time = cache_time
+        self.limit = limit
+        self.results = LRUBackend(maxsize)
+
+    @staticmethod
+    def article(id, title, description, text):
+        return InlineQueryResultArticle(
+            id=id, title=title, description=description,
+            input_message_content=InputTextMessageContent(text, parse_mode=ParseMode.MARKDOWN))
+
+    @staticmethod
+    def unit_article(unit, lessons):
+        """
+        Args:
+            unit (int): The unit's primary key.
+            lessons (list): Tuples of the unit's :class: `timetable.models.Lesson` objects, with
+                their periods loaded, and their tuple representations.
+
+        Returns:
+            telegram.InlineQueryResultArticle
+        """
+        lessons = sorted(lessons, key=lambda lesson: (lesson[0].period.day, lesson[0].period.start)
+                         if lesson[0].period else (8, datetime.time()))
+        title = lessons[0][1][1]
+        rows = [row for lesson, row in lessons]
+        return InlineTimetable.article('unit:%s' % unit, title, "%s lessons a week" % len(rows),
+                                       InlineResults.render(title.upper(), rows))
+
+    def get_class(self, user_id):
+        """
+        Get the class of a user.
+
+        Returns:
+            int: The class's primary key. None if the user isn't a student.
+        """
+        identity = get_identity_cache().get(user_id)
+        if identity.role == STUDENT:
+            return identity.student_class
+
+    def get_results(self, student_class):
+        """
+        Get the prebuilt results of a class, building them if its timetable changed.
+
+        Args:
+            student_class (int): The class's primary key.
+
+        Returns:
+            timetable.inline.InlineResults
+        """
+        key = (student_class, get_timetable_cache().version(student_class))
+        results = self.results.get(key)
+        if results is None:
+            results = InlineResults(StudentChatting.for_class(student_class))
+            self.results.set(key, results)
+        return results
+
+    def get_unit(self, unit):
+        """
+        Builds the result of a unit that isn't the caller's class's, in a single query.
+
+        Returns:
+            telegram.InlineQueryResultArticle: None if the unit has no lessons.
+        """
+        lessons = [(lesson, TimetableLoader.as_tuple(lesson)) for lesson in
+                   Lesson.objects.filter(unit=unit).select_related('period', 'unit__lecturer', 'venue')]
+        if lessons:
+            return self.unit_article(unit, lessons)
+
+    def search(self, student_class, text, when=None):
+        """
+        Finds the results for an inline query.
+
+        Args:
+            student_class (int): The primary key of the caller's class, or None.
+            text (str): The query. Either empty, a day, like 'monday', 'today' or 'tomorrow',
+                'week', or a unit's code or name.
+            when (Optional[:class: `datetime.datetime`]): Now, for 'today' and 'tomorrow'.
+
+        Returns:
+            list: The :class: `telegram.InlineQueryResultArticle` objects.
+        """
+        text = text.strip().lower()
+        results = self.get_results(student_class) if student_class else None
+        if results:
+            today = timezone.localtime(when or timezone.now())
+            days = {'today': today.strftime('%A'),
+                    'tomorrow': (today + datetime.timedelta(days=1)).strftime('%A')}
+            if not text:
+                return [results.days[days['today']], results.days[days['tomorrow']], results.week]
+            if text in days:
+                return [results.days[days[text]]]
+            if 'week'.startswith(text) and len(text) > 1:
+                return [results.week]
+            found = [results.days[day] for day in results.days if len(text) > 2 and day.lower().startswith(text)]
+            if found:
+                return found
+
+        found = []
+        for unit, code, name in get_unit_index().search(text, self.limit):
+            if results and unit in results.units:
+                found.append(results.units[unit])
+            else:
+                article = self.get_unit(unit)
+                if article:
+                    found.append(article)
+        return found
+
+    def answer(self, bot, update):
+        """
+        Answers an inline query with the caller's lessons, or a unit's. Unregistered users are
+        offered to register, in a private chat with the bot.
+        """
+        query = update.inline_query
+        student_class = self.get_class(query.from_user.id)
+        kwargs = dict()
+        if student_class is None:
+            kwargs.update(switch_pm_text="Register to see your timetable", switch_pm_parameter='register')
+        bot.answerInlineQuery(query.id, self.search(student_class, query.query or ''),
+                              cache_time=self.cache_time, is_personal=True, **kwargs)
+
+
+_inline_timetable = None
+_inline_timetable_lock = threading.Lock()
+
+
+def get_inline_timetable():
+    """
+    Get the process wide inline timetable, configured by the `INLINE_QUERIES` setting, creating it
+    the first time.
+
+    Returns:
+        timetable.inline.InlineTimetable
+    """
+    global _inline_timetable
+    with _inline_timetable_lock:
+        if _inline_timetable is None:
+            options = getattr(settings, 'INLINE_QUERIES', {})
+            _inline_timetable = InlineTimetable(cache_time=options.get('CACHE_TIME', 300),
+                                                maxsize=options.get('MAXSIZE', 10000),
+                                                limit=options.get('LIMIT', 10))
+        return _inline_timetable
+
@@ -0,0 +1,91 @@
+"""
+This module contains loaders that fetch a class's timetable from the database in as few
+queries as possible, of:
+    1. :class: `timetable.loaders.TimetableLoader`
+"""
+
+from django.db import connection
+from timetable.models import Lesson
+
+
+class TimetableLoader(object):
+    """
+    Loads the full timetable of a :class: `timetable.models.StudentClass` in a single joined
+    query. That is, the lessons together with their period, unit, the unit's lecturer and venue.
+
+    Walking `student_class.lessons.all()` and calling `str()` on each of the related objects
+    costs four or five queries per lesson. This loader costs one, however many lessons the class has.
+
+    Attributes:
+        student_class (:class: `timetable.models.StudentClass` or int): The class, or its primary
+            key, whose timetable is to be loaded.
+        lessons (list): The :class: `timetable.models.Lesson` objects fetched by the latest `load`,
+            in the same order as the returned tuples.
+        count_queries (bool): Whether `load` counts its queries.
+        query_count (int): The number of queries issued by the latest `load`, to pin the loader at
+            a constant number of queries. None unless `count_queries` is set.
+
+    Args:
+        student_class (:class: `timetable.models.StudentClass` or int): As above.
+        count_queries (Optional[bool]): As above. The queries are counted through the connection's
+            debug cursor, which logs every query, so it's off by default. Default is False.
+    """
+    def __init__(self, student_class, count_queries=False):
+        self.student_class = student_class
+        self.lessons = []
+        self.count_queries = count_queries
+        self.query_count = None
+
+    def get_queryset(self):
+        """
+        Builds the single query behind the loader.
+
+        Returns:
+            (QuerySet): The class's lessons, joined to their period, unit, lecturer and venue.
+        """
+        return Lesson.objects.filter(
+            studentclass=self.student_class
+        ).select_related('period', 'unit__lecturer', 'venue')
+
+    @staticmethod
+    def as_tuple(lesson):
+        """
+        Represents a lesson in the tuple shape used all over
+        :class: `timetable.utils.StudentChatting`.
+
+        Args:
+            lesson (:class: `timetable.models.Lesson`): A lesson whose relations are already loaded.
+
+        Returns:
+            (tuple): Of the form (period, unit, venue, type, lecturer), all as strings.
+        """
+        return (str(lesson.period),
+                str(lesson.unit),
+                str(lesson.venue),
+                lesson.get_type_display(),
+                str(lesson.lecturer) or "")
+
+    def load(self):
+        """
+        Fetches the class's lessons from the database.
+
+        Returns:
+            lessons (list): A list of the class's lessons, in their respective tuple representations.
+                See :func: `~timetable.loaders.TimetableLoader.as_tuple`.
+        """
+        if not self.count_queries:
+            self.lessons = list(self.get_queryset())
+            return [self.as_tuple(lesson) for lesson in self.lessons]
+
+        # Like django.test.utils.CaptureQueriesContext, without django.test
+        connection.ensure_connection()
+        force_debug_cursor = connection.force_debug_cursor
+        connection.force_debug_cursor = True
+        start = len(connection.queries_log)
+        try:
+            self.lessons = list(self.get_queryset())
+            lessons = [self.as_tuple(lesson) for lesson in self.lessons]
+        finally:
+            connection.force_debug_cursor = force_debug_cursor
+        self.query_count = len(connection.queries_log) - start
+        return lessons
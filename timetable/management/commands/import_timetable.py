@@ -0,0 +1,40 @@
+import os
+from django.core.management.base import BaseCommand, CommandError
+from timetable.models import StudentClass
+from timetable.importer import TimetableImporter, TimetableImportError
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports a class's timetable from a CSV or JSON file, with the fields: %s"
+        % ', '.join(TimetableImporter.FIELDS)
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='The CSV or JSON file to import')
+        parser.add_argument('--class', dest='student_class', type=int, required=True,
+                            help='The primary key of the class whose timetable is imported')
+        parser.add_argument('--format', choices=['csv', 'json'],
+                            help="The file's format. Guessed from its extension by default")
+
+    def handle(self, *args, **options):
+        try:
+            student_class = StudentClass.objects.get(pk=options['student_class'])
+        except StudentClass.DoesNotExist:
+            raise CommandError("No class with the primary key %s exists" % options['student_class'])
+
+        file_format = options['format'] or os.path.splitext(options['path'])[1].lstrip('.').lower()
+        if file_format not in ('csv', 'json'):
+            raise CommandError("Cannot tell the format of %s. Please pass --format" % options['path'])
+
+        importer = TimetableImporter(student_class)
+        with open(options['path'], newline='') as file:
+            rows = importer.read_csv(file) if file_format == 'csv' else importer.read_json(file)
+            try:
+                created = importer.run(rows)
+            except TimetableImportError as e:
+                raise CommandError("Nothing was imported.\n%s" % e)
+
+        self.stdout.write(self.style.SUCCESS(
+            "Imported the timetable of %s. Created %s lessons, %s units, %s venues and %s periods." % (
+                student_class, created['lessons'], created['units'], created['venues'], created['periods'])))
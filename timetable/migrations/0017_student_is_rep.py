@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 16:06
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timetable', '0016_auto_20170329_2220'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='student',
+            name='is_rep',
+            field=models.BooleanField(default=False, verbose_name='Class rep'),
+        ),
+    ]
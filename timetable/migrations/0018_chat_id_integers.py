@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 16:17
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def clear_invalid_chat_ids(apps, schema_editor):
+    # Blank, or otherwise non-numeric, chat ids can't be cast to integers. A single UPDATE for each
+    # table, rather than a pass over every row, keeps this cheap on big tables.
+    for model_name in ('Student', 'Lecturer'):
+        model = apps.get_model('timetable', model_name)
+        model.objects.exclude(chat_id=None).exclude(chat_id__regex=r'^-?[0-9]+$').update(chat_id=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('timetable', '0017_student_is_rep'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_invalid_chat_ids, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='lecturer',
+            name='chat_id',
+            field=models.BigIntegerField(blank=True, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='student',
+            name='chat_id',
+            field=models.BigIntegerField(blank=True, null=True, unique=True),
+        ),
+        migrations.AlterIndexTogether(
+            name='period',
+            index_together=set([('day', 'start')]),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.4 on 2026-10-18 16:17
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+INDEX = 'timetable_studentclass_lessons_lesson_class'
+
+
+def get_table(apps):
+    through = apps.get_model('timetable', 'StudentClass')._meta.get_field('lessons').remote_field.through
+    return (through._meta.db_table, through._meta.get_field('lesson').column,
+            through._meta.get_field('studentclass').column)
+
+
+def create_index(apps, schema_editor):
+    # The unique (studentclass_id, lesson_id) index already serves a class's lessons. This one serves
+    # the classes of a lesson, looked up on every timetable edit. On PostgreSQL it's built without
+    # locking the table against writes, hence the migration isn't atomic.
+    table, lesson, student_class = get_table(apps)
+    concurrently = 'CONCURRENTLY ' if schema_editor.connection.vendor == 'postgresql' else ''
+    schema_editor.execute('CREATE INDEX %s%s ON %s (%s, %s)' % (
+        concurrently, schema_editor.quote_name(INDEX), schema_editor.quote_name(table),
+        schema_editor.quote_name(lesson), schema_editor.quote_name(student_class)))
+
+
+def drop_index(apps, schema_editor):
+    schema_editor.execute('DROP INDEX %s' % schema_editor.quote_name(INDEX))
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('timetable', '0018_chat_id_integers'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index, atomic=False),
+    ]
@@ -14,7 +14,7 @@ This module contains the definitions of the database models and the associated u
 from django.db import models
 from django.core.exceptions import ValidationError
 from django.utils.translation import ugettext_lazy as _
-from django.db.models.signals import post_delete
+from django.db.models.signals import post_delete, post_save, pre_delete, m2m_changed
 from django.dispatch import receiver
 
 
@@ -68,10 +68,8 @@ class Lecturer(models.Model):
         email (Optional [:class:`models.EmailField`]): The Lecturer's email. It is a (:class: `model.EmailField`) so that
             django's :func:`~django.core.validators.EmailValidator` is used to validate it's input.
         username (Optional [:class:`models.CharField`]): This field represents the lecturer's telegram username
-        chat_id (Optional [:class:`models.CharField`]): This field represents the lecturer's telegram chat id.
-            Well, I'm storing it as a string, but Telegram gives it as an int. Can't seem to remember
-            the logic behind that decision when I made it. Another reason I should have done these
-            docs earlier.
+        chat_id (Optional [:class:`models.BigIntegerField`]): This field represents the lecturer's telegram chat id.
+            Telegram gives it as an int, which may not fit in 32 bits.
 
     The optional attributes are, well optional because, at the moment, it is possible to add a lecturer
     via the web interface, before the lecturer actually registers with the bot. In that case, only the
@@ -81,7 +79,7 @@ class Lecturer(models.Model):
     mobile = models.CharField(max_length=15, blank=True, null=True, unique=True)
     email = models.EmailField(max_length=50, blank=True, null=True, unique=True)
     username = models.CharField(max_length=50, blank=True, null=True)
-    chat_id = models.CharField(max_length=50, blank=True, null=True, unique=True)
+    chat_id = models.BigIntegerField(blank=True, null=True, unique=True)
 
     def __str__(self):
         """
@@ -174,7 +172,11 @@ class Period(models.Model):
         """
         Checks that:
             1. The period does not stop (end) before it starts :-)
-            2. The period does not overlap other already existing periods.
+            2. The period does not overlap the other lessons of the classes whose lessons it is
+               the period of, since overlaps only matter within a class. See :mod: `timetable.overlaps`.
+
+        A new period is not any lesson's period yet. It is checked once it is taken by a lesson of
+        a class, by :func: `~timetable.models.Lesson.clean`, or by the class's form in the admin.
 
         Returns:
             None
@@ -184,39 +186,40 @@ class Period(models.Model):
         """
         if self.stop <= self.start:
             raise ValidationError(_('Stop time cannot be earlier than or equal to start time.'))
-        try:
-            # Set the current lesson to the first period in the database
-            current_lesson = self.lesson_set.all()[0]
 
-            # Use the current_lesson to get the current period
-            current_period = Lesson.objects.get(pk=current_lesson.pk).period
+        # Leave out the lessons of this very period, as saved before the edit
+        lessons = list(self.lesson_set.values_list('pk', flat=True)) if self.pk is not None else []
+        self.check_overlaps(StudentClass.objects.filter(lessons__in=lessons).distinct(), exclude=lessons)
 
-            # Use the current_period in the query to get all the other periods.
-            # Periods that are on the same day.
-            existing = Period.objects.filter(day=self.day).exclude(
-                start=current_period.start,
-                stop=current_period.stop,
-                day=current_period.day
-            )
+    def check_overlaps(self, student_classes, exclude=None):
+        """
+        Checks that the period does not overlap the lessons of the given classes.
 
-        except IndexError:
-            # If there's not a single lesson, just get all the day's existing period.
-            existing = Period.objects.filter(day=self.day)
+        Args:
+            student_classes (iterable): Of :class: `timetable.models.StudentClass` objects.
+            exclude (Optional[iterable]): Primary keys of lessons to leave out, like the ones
+                taking this very period.
 
-        for exists in existing:
-            # Get the later of the existing start, and entered start times of the two periods.
-            later_start = max(exists.start, self.start)
+        Returns:
+            None
 
-            # Get the earlier of the existing stop, and the entered stop times of the two periods.
-            earlier_stop = min(exists.stop, self.stop)
+        Raises:
+            `ValidationError`: If the period overlaps a lesson of any of the classes.
+        """
+        from timetable.overlaps import TimetableOverlaps
 
-            # If the earlier stop time is later than the later start time, then there's a lesson overlap.
-            if earlier_stop > later_start:
-                raise ValidationError(_("Lesson overlap! \n%s" % (exists.lesson_set.get(period__start=exists.start))))
+        for student_class in student_classes:
+            collision = TimetableOverlaps.load(student_class, exclude=exclude).check(self.day, self.start, self.stop)
+            if collision:
+                raise ValidationError(_("Lesson overlap! \n%s" % collision))
 
     class Meta:
-        """Enforces a periods uniqueness by checking all the three class's attributes"""
+        """
+        Enforces a periods uniqueness by checking all the three class's attributes, and indexes
+        the periods by day and start, the order the lessons of a day are looked up and sorted in.
+        """
         unique_together = ["start", "stop", "day"]
+        index_together = [["day", "start"]]
 
 
 class Lesson(models.Model):
@@ -246,6 +249,20 @@ class Lesson(models.Model):
         """Uses the objects period, unit and venue for it's string representation"""
         return "%s, %s, %s" % (self.period, self.unit, self.venue)
 
+    def clean(self):
+        """
+        Checks that the lesson's period, which may well be a new one, does not overlap the other
+        lessons of the classes the lesson is in.
+
+        Returns:
+            None
+
+        Raises:
+            `ValidationError`: If the period overlaps another lesson of any of the classes.
+        """
+        if self.pk is not None and self.period is not None:
+            self.period.check_overlaps(StudentClass.objects.filter(lessons=self.pk), exclude=[self.pk])
+
     @property
     def lecturer(self):
         """
@@ -289,8 +306,9 @@ def lesson_post_delete_callback(sender, **kwargs):
 
     """
     try:
-        # Since a period is unique to a lesson, delete the period whenever the lesson is deleted.
-        if kwargs['instance'].period:
+        # Delete the lesson's period whenever the lesson is deleted, unless the period is shared by
+        # another class's lesson at the very same time.
+        if kwargs['instance'].period and not kwargs['instance'].period.lesson_set.exists():
             kwargs['instance'].period.delete()
         # Since venues are not unique to lessons, if the venue belonged to this particular lesson only,
         # delete it.
@@ -366,7 +384,9 @@ class Student(models.Model):
         student_class (:class:`timetable.models.StudentClass`): The class to which the student
             belongs
         username (Optional [:class:`models.CharField`]): The student's Telegram username
-        chat_id (Optional [:class:`models.CharField`]): The student's Telegram chat_id
+        chat_id (Optional [:class:`models.BigIntegerField`]): The student's Telegram chat_id
+        is_rep (:class:`models.BooleanField`): Whether the student is a class rep, who may
+            broadcast to the whole class. See :mod: `chats.broadcast`.
 
     I am confused as to why I have some of the fields nullable
     """
@@ -377,7 +397,8 @@ class Student(models.Model):
     student_class = models.ForeignKey(to=StudentClass)
 
     username = models.CharField(max_length=50, blank=True, null=True)
-    chat_id = models.CharField(max_length=50, blank=True, null=True, unique=True)
+    chat_id = models.BigIntegerField(blank=True, null=True, unique=True)
+    is_rep = models.BooleanField(default=False, verbose_name="Class rep")
 
     def __str__(self):
         """Sets the object's string representation to either the name of the username"""
@@ -400,3 +421,85 @@ class Student(models.Model):
             self.email = None
         if not self.chat_id:
             self.chat_id = None
+
+
+def invalidate_timetables(student_classes):
+    """
+    Drops the rendered timetables of the given classes from :mod: `timetable.cache`, and their
+    weekly schedules from :mod: `timetable.schedule`.
+
+    Args:
+        student_classes (iterable): Primary keys of :class: `timetable.models.StudentClass` objects.
+
+    Returns:
+        None
+    """
+    from timetable.cache import get_timetable_cache
+    from timetable.schedule import get_schedule_index
+    timetable_cache = get_timetable_cache()
+    schedule_index = get_schedule_index()
+    for student_class in set(student_classes):
+        timetable_cache.invalidate(student_class)
+        schedule_index.invalidate(student_class)
+
+
+# Lookups from a :class: `timetable.models.StudentClass` to each model that makes up its timetable
+TIMETABLE_LOOKUPS = {
+    Lesson: ['lessons'],
+    Period: ['lessons__period'],
+    Venue: ['lessons__venue'],
+    Unit: ['units', 'lessons__unit'],
+    Lecturer: ['lessons__unit__lecturer'],
+}
+
+
+def timetable_changed_callback(sender, **kwargs):
+    """
+    Invalidates the rendered timetables of the classes affected by a saved or deleted object.
+
+    Connected to `post_save` and `pre_delete`. It is `pre_delete` rather than `post_delete`, since
+    the classes can no longer be looked up once the object, and its relations, are gone.
+
+    Args:
+        sender (object): One of the models in `TIMETABLE_LOOKUPS`.
+        **kwargs (dict): The signal's key word arguments. Of particular note is the
+            'instance' key word argument, the saved or deleted object.
+
+    Returns:
+        None
+    """
+    query = models.Q()
+    for lookup in TIMETABLE_LOOKUPS[sender]:
+        query |= models.Q(**{lookup: kwargs['instance']})
+    invalidate_timetables(StudentClass.objects.filter(query).values_list('pk', flat=True))
+
+
+def timetable_m2m_changed_callback(sender, **kwargs):
+    """
+    Invalidates the rendered timetables of the classes whose units or lessons are added,
+    removed or cleared.
+
+    Args:
+        sender (object): The through model of either `StudentClass.units` or `StudentClass.lessons`.
+        **kwargs (dict): The signal's key word arguments.
+
+    Returns:
+        None
+    """
+    action = kwargs['action']
+    instance = kwargs['instance']
+    if not kwargs['reverse']:
+        # instance is the StudentClass itself
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            invalidate_timetables([instance.pk])
+    elif action in ('post_add', 'post_remove'):
+        # instance is a Unit or Lesson, pk_set the classes it was added to, or removed from
+        invalidate_timetables(kwargs['pk_set'])
+    elif action == 'pre_clear':
+        timetable_changed_callback(type(instance), instance=instance)
+
+for timetable_model in TIMETABLE_LOOKUPS:
+    post_save.connect(timetable_changed_callback, sender=timetable_model)
+    pre_delete.connect(timetable_changed_callback, sender=timetable_model)
+m2m_changed.connect(timetable_m2m_changed_callback, sender=StudentClass.units.through)
+m2m_changed.connect(timetable_m2m_changed_callback, sender=StudentClass.lessons.through)
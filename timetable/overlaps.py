@@ -0,0 +1,188 @@
+"""
+This module contains the structures behind the checks for overlapping lessons, of:
+    1. :class: `timetable.overlaps.IntervalSet`
+    2. :class: `timetable.overlaps.TimetableOverlaps`
+
+Overlaps only matter within a single :class: `timetable.models.StudentClass`, on a single day.
+Two classes can very well have lessons at the same time.
+"""
+
+from bisect import bisect_left, bisect_right
+from timetable.index import TimetableIndex
+
+
+class IntervalSet(object):
+    """
+    The periods of a single day, as half-open [start, stop) intervals sorted by their start times.
+
+    Alongside the start times, it keeps the running maximum of the stop times (the `reach`). The
+    first interval whose reach goes past a given start is the earliest interval still running by
+    then, so a collision is found with two binary searches, even if the stored intervals happen to
+    overlap one another.
+
+    Attributes:
+        intervals (list): Tuples of the form (start, stop, value), sorted. The value is whatever
+            should be reported on a collision, like the lesson.
+
+    Args:
+        intervals (Optional[iterable]): Tuples of the form (start, stop, value).
+    """
+    def __init__(self, intervals=()):
+        self.intervals = list(intervals)
+        self._index()
+
+    def _index(self):
+        # Sorting on the times alone, since the values need not be comparable
+        self.intervals.sort(key=lambda interval: interval[:2])
+        self.starts = [interval[0] for interval in self.intervals]
+        self.reach = []
+        for interval in self.intervals:
+            self.reach.append(max(self.reach[-1], interval[1]) if self.reach else interval[1])
+
+    def overlap(self, start, stop):
+        """
+        Find an interval that collides with [start, stop). Touching intervals, like one stopping
+        at 10:00 AM and another starting at 10:00 AM, do not collide.
+
+        Args:
+            start (:class: `datetime.time`): The start of the interval to check.
+            stop (:class: `datetime.time`): The stop of the interval to check.
+
+        Returns:
+            tuple: The colliding (start, stop, value) interval, or None if there is none.
+        """
+        # Intervals starting before `stop`
+        end = bisect_left(self.starts, stop)
+        # The first interval stopping after `start`
+        first = bisect_right(self.reach, start)
+        if first < end:
+            return self.intervals[first]
+        return None
+
+    def add(self, start, stop, value=None):
+        """
+        Adds an interval. Does not check it for collisions.
+
+        Args:
+            start (:class: `datetime.time`): The interval's start.
+            stop (:class: `datetime.time`): The interval's stop.
+            value (Optional[object]): Whatever should be reported on a collision.
+        """
+        self.intervals.append((start, stop, value))
+        self._index()
+
+    def __len__(self):
+        return len(self.intervals)
+
+
+class TimetableOverlaps(object):
+    """
+    Object representing the periods of a class's timetable, as an :class: `timetable.overlaps.IntervalSet`
+    per day, for answering whether a period collides with any of the class's lessons.
+
+    Attributes:
+        days (dict): The days, as in `Period.DAY`, mapped to their interval sets. The values are
+            the :class: `timetable.models.Lesson` objects.
+    """
+    def __init__(self):
+        self.days = dict()
+
+    @classmethod
+    def from_index(cls, index, exclude=None):
+        """
+        Builds the interval sets from a class's index, without querying the database.
+
+        Args:
+            index (:class: `timetable.index.TimetableIndex`): The class's index.
+            exclude (Optional[iterable]): Primary keys of lessons to leave out, like the one whose
+                period is being edited.
+
+        Returns:
+            timetable.overlaps.TimetableOverlaps
+        """
+        overlaps = cls()
+        intervals = dict()
+        exclude = set(exclude or ())
+        for day, pks in index.days.items():
+            for pk in pks:
+                if pk in exclude:
+                    continue
+                lesson = index.lessons[pk]
+                intervals.setdefault(day, []).append((lesson.period.start, lesson.period.stop, lesson))
+        for day, day_intervals in intervals.items():
+            overlaps.days[day] = IntervalSet(day_intervals)
+        return overlaps
+
+    @classmethod
+    def load(cls, student_class, exclude=None):
+        """
+        Loads the class's timetable, in a single query, and builds the interval sets.
+
+        Args:
+            student_class (:class: `timetable.models.StudentClass` or int): The class, or its primary key.
+            exclude (Optional[iterable]): As in :func: `~timetable.overlaps.TimetableOverlaps.from_index`.
+
+        Returns:
+            timetable.overlaps.TimetableOverlaps
+        """
+        return cls.from_index(TimetableIndex.load(student_class), exclude=exclude)
+
+    def check(self, day, start, stop):
+        """
+        Check whether the given period collides with any of the class's lessons.
+
+        Args:
+            day (int): The day, as in `Period.DAY`.
+            start (:class: `datetime.time`): The period's start.
+            stop (:class: `datetime.time`): The period's stop.
+
+        Returns:
+            object: The value of the colliding interval, like the lesson. None if there is no collision.
+        """
+        intervals = self.days.get(day)
+        if intervals is None:
+            return None
+        collision = intervals.overlap(start, stop)
+        return collision[2] if collision else None
+
+    def add(self, day, start, stop, value=None):
+        """
+        Adds a period to the class's timetable, without checking it.
+
+        Args:
+            day (int): The day, as in `Period.DAY`.
+            start (:class: `datetime.time`): The period's start.
+            stop (:class: `datetime.time`): The period's stop.
+            value (Optional[object]): Whatever should be reported on a collision.
+        """
+        self.days.setdefault(day, IntervalSet()).add(start, stop, value)
+
+    def validate(self, periods):
+        """
+        Validates many new periods at once, like a whole timetable being imported, against the
+        class's lessons and against one another. It is a single sweep over each day, sorted by
+        start time, keeping track of the period that runs the longest so far.
+
+        Args:
+            periods (iterable): Tuples of the form (day, start, stop, value).
+
+        Returns:
+            list: Tuples of the form (value, colliding value), one for every collision that involves
+                a new period. Empty if all the periods are valid.
+        """
+        days = dict()
+        for day, intervals in self.days.items():
+            days[day] = [(start, stop, False, value) for start, stop, value in intervals.intervals]
+        for day, start, stop, value in periods:
+            days.setdefault(day, []).append((start, stop, True, value))
+
+        collisions = []
+        for day in sorted(days):
+            longest = None
+            for start, stop, is_new, value in sorted(days[day], key=lambda interval: interval[:2]):
+                if longest is not None and start < longest[1]:
+                    if is_new or longest[2]:
+                        collisions.append((value, longest[3]))
+                if longest is None or stop > longest[1]:
+                    longest = (start, stop, is_new, value)
+        return collisions
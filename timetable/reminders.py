@@ -0,0 +1,278 @@
+"""
+This module contains the lesson reminders service, of:
+    1. :class: `timetable.reminders.ReminderQueue`
+    2. :class: `timetable.reminders.ReminderScheduler`
+
+Every so often, the scheduler looks ahead at the lessons starting within the next hour or so, and
+queues a reminder for each, due a few minutes before the lesson. Each reminder is then fanned out
+to every student of the lesson's classes over Telegram, through the bulk lane of the send queue,
+falling back to an SMS for the students that cannot be reached there. The texts of a reminder all
+carry the same message, so the SMS dispatcher sends them in a request or two, rather than one per
+student.
+
+Only the lessons within the window being filled are ever queried, so the cost of each look ahead
+grows with the lessons in that window, not with the whole timetable.
+"""
+
+import datetime as dt
+import heapq
+import logging
+import threading
+from collections import namedtuple
+from django.conf import settings
+from django.utils import timezone
+from telegram import ParseMode
+from telegram.error import TelegramError
+from telegram.ext import Job
+from general.sms import get_sms_dispatcher
+from general.outbox import get_send_queue, BULK
+from timetable.models import Lesson, Student, StudentClass
+
+logger = logging.getLogger(__name__)
+
+# A reminder, due at `due`, of `lesson`, to be sent to the (chat_id, mobile) pairs in `recipients`
+Reminder = namedtuple('Reminder', ['due', 'lesson', 'text', 'recipients'])
+
+
+class ReminderQueue(object):
+    """
+    A queue of reminders, bucketed by the minute (by default) in which they fall due. Popping the
+    due reminders only looks at the buckets that are due, through a heap of the bucket numbers.
+
+    Attributes:
+        bucket (int): The width of each bucket, in seconds.
+        buckets (dict): Bucket numbers mapped to lists of the reminders that fall due within them.
+
+    Args:
+        bucket (Optional[int]): As above. Default is 60.
+    """
+    def __init__(self, bucket=60):
+        self.bucket = bucket
+        self.buckets = dict()
+        self._heap = []
+        self._lock = threading.Lock()
+
+    def _number(self, when):
+        return int(when.timestamp() // self.bucket)
+
+    def push(self, reminder):
+        """
+        Queues a reminder.
+
+        Args:
+            reminder (:class: `timetable.reminders.Reminder`): The reminder.
+        """
+        number = self._number(reminder.due)
+        with self._lock:
+            if number not in self.buckets:
+                self.buckets[number] = []
+                heapq.heappush(self._heap, number)
+            self.buckets[number].append(reminder)
+
+    def pop_due(self, now):
+        """
+        Removes and returns the reminders that are due by `now`.
+
+        Args:
+            now (:class: `datetime.datetime`): An aware datetime.
+
+        Returns:
+            list: Of :class: `timetable.reminders.Reminder`
+        """
+        number = self._number(now)
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0] <= number:
+                due.extend(self.buckets.pop(heapq.heappop(self._heap)))
+        return due
+
+    def __len__(self):
+        return sum(len(reminders) for reminders in self.buckets.values())
+
+
+class ReminderScheduler(object):
+    """
+    Schedules and sends the lesson reminders. It is meant to run within the bot's worker,
+    through :func: `~timetable.reminders.ReminderScheduler.start`.
+
+    Attributes:
+        bot (:class: `telegram.Bot`): The bot through which the reminders are sent.
+        lead (:class: `datetime.timedelta`): How long before a lesson its reminder is sent.
+        horizon (:class: `datetime.timedelta`): How far ahead the queue is filled at a time.
+        queue (:class: `timetable.reminders.ReminderQueue`): The queued reminders.
+        filled_until (:class: `datetime.datetime`): The time up to which the reminders of
+            lessons have been queued.
+
+    Args:
+        bot (:class: `telegram.Bot`): As above.
+        lead (Optional[int]): The lead, in minutes. Default is the `REMINDER_LEAD` setting, or 15.
+        horizon (Optional[int]): The horizon, in minutes. Default is the `REMINDER_HORIZON`
+            setting, or 60.
+        sms (Optional[:class: `general.sms.SMSDispatcher`]): The SMS dispatcher for the fallback.
+            Default is the process wide dispatcher.
+        outbox (Optional[:class: `general.outbox.SendQueue`]): The queue the reminders are sent
+            through. Default is the process wide queue.
+    """
+    sender = "KOTS"
+
+    def __init__(self, bot, lead=None, horizon=None, sms=None, outbox=None):
+        self.bot = bot
+        self.lead = dt.timedelta(minutes=lead or getattr(settings, 'REMINDER_LEAD', 15))
+        self.horizon = dt.timedelta(minutes=horizon or getattr(settings, 'REMINDER_HORIZON', 60))
+        self.queue = ReminderQueue()
+        self.filled_until = None
+        self.sms = sms or get_sms_dispatcher()
+        self.outbox = outbox or get_send_queue()
+
+    @staticmethod
+    def period_day(date):
+        """
+        Returns:
+            int: The day of the given date, as in `Period.DAY`, where Sunday is 1.
+        """
+        return (date.weekday() + 1) % 7 + 1
+
+    @staticmethod
+    def get_text(lesson):
+        return "*REMINDER*\n%s (%s) starts at %s\n%s" % (
+            lesson.unit, lesson.get_type_display(), lesson.period.start.strftime('%I:%M %p'), lesson.venue)
+
+    def fill(self, now):
+        """
+        Queues the reminders of the lessons starting from where the last fill stopped, up to
+        `lead` + `horizon` from now. Does nothing while more than half the horizon is still queued.
+
+        Args:
+            now (:class: `datetime.datetime`): An aware datetime.
+
+        Returns:
+            int: The number of reminders queued.
+        """
+        until = now + self.lead + self.horizon
+        if self.filled_until is not None and self.filled_until - now - self.lead > self.horizon / 2:
+            return 0
+        start = max(self.filled_until or now + self.lead, now + self.lead)
+
+        # Periods are in local time
+        current = timezone.localtime(start).replace(tzinfo=None)
+        end = timezone.localtime(until).replace(tzinfo=None)
+        lessons = []
+        while current < end:
+            # The window may run past midnight, into the next day
+            day_end = min(end, dt.datetime.combine(current.date() + dt.timedelta(days=1), dt.time()))
+            query = Lesson.objects.filter(
+                period__day=self.period_day(current.date()),
+                period__start__gte=current.time(),
+            ).select_related('period', 'unit', 'venue')
+            if day_end == end:
+                query = query.filter(period__start__lt=end.time())
+            lessons.extend((current.date(), lesson) for lesson in query)
+            current = day_end
+        self.filled_until = until
+
+        recipients = self.get_recipients([lesson.pk for date, lesson in lessons])
+        for date, lesson in lessons:
+            if not recipients.get(lesson.pk):
+                continue
+            starts = timezone.make_aware(dt.datetime.combine(date, lesson.period.start))
+            self.queue.push(Reminder(starts - self.lead, lesson, self.get_text(lesson), recipients[lesson.pk]))
+        return len(lessons)
+
+    @staticmethod
+    def get_recipients(lessons):
+        """
+        Looks up the students of the given lessons' classes, in two queries.
+
+        Args:
+            lessons (list): Primary keys of :class: `timetable.models.Lesson` objects.
+
+        Returns:
+            dict: Lesson primary keys mapped to lists of (chat_id, mobile) tuples.
+        """
+        if not lessons:
+            return dict()
+        classes = dict()
+        for lesson, student_class in StudentClass.lessons.through.objects.filter(
+                lesson_id__in=lessons).values_list('lesson_id', 'studentclass_id'):
+            classes.setdefault(student_class, []).append(lesson)
+
+        recipients = dict()
+        for student_class, chat_id, mobile in Student.objects.filter(
+                student_class_id__in=classes).values_list('student_class_id', 'chat_id', 'mobile'):
+            if not chat_id and not mobile:
+                continue
+            for lesson in classes[student_class]:
+                recipients.setdefault(lesson, []).append((chat_id, mobile))
+        return recipients
+
+    def tick(self, bot=None, job=None):
+        """
+        Fills the queue, if need be, and fans out the reminders that are due. This is the
+        callback of the job queue's job.
+
+        Args:
+            bot (Optional[:class: `telegram.Bot`]): Passed by the job queue.
+            job (Optional[:class: `telegram.ext.Job`]): Passed by the job queue.
+
+        Returns:
+            int: The number of reminders that were due.
+        """
+        now = timezone.now()
+        try:
+            self.fill(now)
+        except Exception:
+            logger.exception("Failed to fill the reminders queue")
+        due = self.queue.pop_due(now)
+        for reminder in due:
+            for chat_id, mobile in reminder.recipients:
+                self.deliver(reminder.text, chat_id, mobile)
+        return len(due)
+
+    def deliver(self, text, chat_id, mobile):
+        """
+        Queues a reminder to a single student over Telegram, to be sent by SMS if that fails.
+
+        Returns:
+            bool: True if the reminder was queued. False otherwise.
+        """
+        if chat_id:
+            future = self.outbox.send(self.bot.sendMessage, chat_id, BULK, text=text, parse_mode=ParseMode.MARKDOWN)
+            future.add_done_callback(lambda future: self.delivered(future, text, chat_id, mobile))
+            return True
+        if mobile:
+            return self.send_sms(mobile, text.replace('*', ''))
+        return False
+
+    def delivered(self, future, text, chat_id, mobile):
+        error = future.exception()
+        if isinstance(error, TelegramError):
+            logger.warning("Failed to remind %s over Telegram: %s", chat_id, error)
+            if mobile:
+                self.send_sms(mobile, text.replace('*', ''))
+        elif error is not None:
+            logger.error("Failed to remind %s over Telegram: %s", chat_id, error)
+
+    def send_sms(self, mobile, message):
+        self.sms.send(mobile, message, sender=self.sender).add_done_callback(self.sms_sent)
+        return True
+
+    @staticmethod
+    def sms_sent(future):
+        status = future.result()
+        if not status.success:
+            logger.warning("Failed to remind %s by SMS: %s", status.number, status.status)
+
+    def start(self, job_queue, interval=60):
+        """
+        Runs the scheduler on the given job queue.
+
+        Args:
+            job_queue (:class: `telegram.ext.JobQueue`): Like the updater's job queue.
+            interval (Optional[int]): Seconds between ticks. Default is 60.
+
+        Returns:
+            telegram.ext.Job
+        """
+        job = Job(self.tick, interval)
+        job_queue.put(job, next_t=0)
+        return job
@@ -0,0 +1,193 @@
+"""
+This module contains the weekly schedules of the classes, of:
+    1. :class: `timetable.schedule.WeeklySchedule`
+    2. :class: `timetable.schedule.ScheduleIndex`
+
+A class's lessons are kept sorted by the minute of the week they start at, so that the lesson going
+on now, the next one, and the rest of today's, are each found by a binary search, rather than by
+loading and filtering the timetable on every question.
+
+The schedules are built the first time they are needed, and a class's schedule is dropped by the
+signal callbacks in :mod: `timetable.models` whenever its timetable changes, to be rebuilt, on its
+own, the next time it's asked for. Each schedule is also kept with the version token of its class's
+timetable, in :mod: `timetable.cache`, and rebuilt once the token changes, so that the edits made
+in other processes, which don't fire the signals here, are picked up when the token expires.
+"""
+
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from django.utils import timezone
+from timetable.cache import get_timetable_cache
+from timetable.loaders import TimetableLoader
+
+MINUTES_IN_DAY = 24 * 60
+
+
+class WeeklySchedule(object):
+    """
+    A class's lessons, sorted by when in the week they start.
+
+    Attributes:
+        starts (:class: `array.array`): The minute of the week each lesson starts at, counting from
+            Sunday midnight, in order.
+        stops (:class: `array.array`): The minute of the week each lesson stops at.
+        rows (list): The lessons' tuple representations, in the same order.
+            See :func: `~timetable.loaders.TimetableLoader.as_tuple`.
+
+    Args:
+        lessons (list): The :class: `timetable.models.Lesson` objects, with their periods loaded.
+        rows (list): The lessons' tuple representations, in the same order as `lessons`.
+    """
+    def __init__(self, lessons, rows):
+        entries = sorted((self.minute(lesson.period.day, lesson.period.start),
+                          self.minute(lesson.period.day, lesson.period.stop), row)
+                         for lesson, row in zip(lessons, rows) if lesson.period)
+        self.starts = array('i', [entry[0] for entry in entries])
+        self.stops = array('i', [entry[1] for entry in entries])
+        self.rows = [entry[2] for entry in entries]
+
+    @classmethod
+    def load(cls, student_class):
+        """
+        Loads the schedule of the given class, in a single query.
+
+        Args:
+            student_class (:class: `timetable.models.StudentClass` or int): The class, or its primary key.
+
+        Returns:
+            timetable.schedule.WeeklySchedule
+        """
+        loader = TimetableLoader(student_class)
+        rows = loader.load()
+        return cls(loader.lessons, rows)
+
+    @staticmethod
+    def minute(day, time):
+        """
+        Args:
+            day (int): The day, as in `Period.DAY`, where Sunday is 1.
+            time (:class: `datetime.time`): The time of the day.
+
+        Returns:
+            int: The minute of the week.
+        """
+        return (day - 1) * MINUTES_IN_DAY + time.hour * 60 + time.minute
+
+    @classmethod
+    def now(cls, when=None):
+        """
+        Args:
+            when (Optional[:class: `datetime.datetime`]): Default is now.
+
+        Returns:
+            int: The minute of the week, in the local time of the timetable.
+        """
+        when = timezone.localtime(when or timezone.now())
+        return cls.minute(when.isoweekday() % 7 + 1, when.time())
+
+    def __len__(self):
+        return len(self.rows)
+
+    def current(self, when=None):
+        """
+        Get the lesson going on at the given time.
+
+        Returns:
+            tuple: The lesson's tuple representation. None if there's no lesson going on.
+        """
+        minute = self.now(when)
+        i = bisect_right(self.starts, minute) - 1
+        if i >= 0 and self.stops[i] > minute:
+            return self.rows[i]
+        return None
+
+    def next(self, when=None):
+        """
+        Get the first lesson to start after the given time, even if it's next week.
+
+        Returns:
+            tuple: The lesson's tuple representation. None if there are no lessons.
+        """
+        if not self.rows:
+            return None
+        i = bisect_right(self.starts, self.now(when))
+        return self.rows[i % len(self.rows)]
+
+    def remaining_today(self, when=None):
+        """
+        Get the lessons yet to start today.
+
+        Returns:
+            list: The lessons' tuple representations, in order.
+        """
+        minute = self.now(when)
+        end_of_day = (minute // MINUTES_IN_DAY + 1) * MINUTES_IN_DAY
+        return self.rows[bisect_right(self.starts, minute):bisect_left(self.starts, end_of_day)]
+
+
+class ScheduleIndex(object):
+    """
+    The weekly schedules of the classes, by the classes' primary keys.
+
+    Attributes:
+        schedules (dict): The primary keys of the classes mapped to tuples of the form
+            (version, schedule), of their timetables' version tokens and their
+            :class: `timetable.schedule.WeeklySchedule` objects.
+    """
+    def __init__(self):
+        self.schedules = dict()
+        self._generations = dict()
+        self._lock = threading.Lock()
+
+    def get(self, student_class):
+        """
+        Get the schedule of a class, building it if need be.
+
+        Args:
+            student_class (:class: `timetable.models.StudentClass` or int): The class, or its primary key.
+
+        Returns:
+            timetable.schedule.WeeklySchedule
+        """
+        student_class = getattr(student_class, 'pk', student_class)
+        version = get_timetable_cache().version(student_class)
+        version_schedule = self.schedules.get(student_class)
+        if version_schedule is not None and version_schedule[0] == version:
+            return version_schedule[1]
+        generation = self._generations.get(student_class, 0)
+        schedule = WeeklySchedule.load(student_class)
+        with self._lock:
+            # Unless the timetable changed while it was being loaded
+            if self._generations.get(student_class, 0) == generation:
+                self.schedules[student_class] = (version, schedule)
+        return schedule
+
+    def invalidate(self, student_class):
+        """
+        Drops the schedule of a class, so that it's rebuilt the next time it's needed.
+
+        Args:
+            student_class (:class: `timetable.models.StudentClass` or int): The class, or its primary key.
+        """
+        student_class = getattr(student_class, 'pk', student_class)
+        with self._lock:
+            self._generations[student_class] = self._generations.get(student_class, 0) + 1
+            self.schedules.pop(student_class, None)
+
+    def clear(self):
+        with self._lock:
+            self.schedules.clear()
+
+
+_schedule_index = ScheduleIndex()
+
+
+def get_schedule_index():
+    """
+    Get the process's :class: `timetable.schedule.ScheduleIndex`.
+
+    Returns:
+        timetable.schedule.ScheduleIndex
+    """
+    return _schedule_index
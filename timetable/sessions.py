@@ -0,0 +1,108 @@
+"""
+This module contains :class: `timetable.sessions.ChatSession`, which keeps a chat's
+:class: `timetable.utils.StudentChatting` across the steps of a conversation.
+"""
+
+import time
+from timetable.cache import get_timetable_cache
+from timetable.utils import StudentChatting
+
+
+class ChatSession(object):
+    """
+    Object representing a chat's session. It lives in the conversation's `user_data`, so that the
+    steps of a conversation share a single :class: `timetable.utils.StudentChatting`, rather than
+    looking up the student, and refilling the student's lessons, on every message.
+
+    The session is stamped with the version token of the class's timetable, from
+    :mod: `timetable.cache`. Whenever the timetable changes, the token is replaced, and the
+    session's lessons are dropped the next time it is used. Comparing the tokens costs no query.
+
+    Attributes:
+        chat_id: The chat's Telegram chat_id.
+        chat (:class: `timetable.utils.StudentChatting`): The student chatting.
+        created (float): When the session was created, as a timestamp.
+        version (str): The version token of the class's timetable, when the session last used it.
+
+    Args:
+        chat_id: As above.
+
+    Raises:
+        Exception: If no Student object with the supplied `chat_id` exists
+    """
+    # The key under which the session is kept in user_data
+    key = 'session'
+    # Seconds after which the session is discarded, and the student looked up afresh
+    ttl = 5 * 60
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.chat = StudentChatting(chat_id=chat_id)
+        self.created = time.time()
+        self.version = self.current_version()
+
+    def current_version(self):
+        """
+        Returns:
+            str: The current version token of the student's class's timetable.
+        """
+        return get_timetable_cache().version(self.chat.student.student_class_id)
+
+    def expired(self):
+        """
+        Returns:
+            bool: True if the session is older than `ttl`. False otherwise.
+        """
+        return time.time() - self.created > self.ttl
+
+    def refresh(self):
+        """
+        Drops the lessons held by the session if the class's timetable has changed since
+        the session last used them.
+
+        Returns:
+            bool: True if the lessons were dropped. False otherwise.
+        """
+        version = self.current_version()
+        if version == self.version:
+            return False
+        self.chat.index = None
+        self.version = version
+        return True
+
+    @classmethod
+    def get_chat(cls, user_data, chat_id):
+        """
+        Get the :class: `timetable.utils.StudentChatting` of the given chat, from the session
+        in `user_data`. A new session is started if there is none, or it has expired.
+
+        Args:
+            user_data (dict): The conversation's user_data
+            chat_id: The chat's Telegram chat_id
+
+        Returns:
+            timetable.utils.StudentChatting
+        """
+        session = user_data.get(cls.key)
+        if session is None or session.chat_id != chat_id or session.expired():
+            session = cls(chat_id=chat_id)
+            user_data[cls.key] = session
+        else:
+            session.refresh()
+        return session.chat
+
+    @classmethod
+    def clear(cls, user_data):
+        """
+        Clears the conversation's user_data, like at the end of a conversation, but keeps the session.
+
+        Args:
+            user_data (dict): The conversation's user_data
+
+        Returns:
+            None
+        """
+        session = user_data.get(cls.key)
+        user_data.clear()
+        if session is not None:
+            user_data[cls.key] = session
@@ -0,0 +1,49 @@
+from django.test import SimpleTestCase
+from timetable.cache import LRUBackend, TimetableCache
+
+
+class TimetableCacheTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.timetable_cache = TimetableCache(LRUBackend(maxsize=8))
+
+    def test_lru_eviction(self):
+        backend = LRUBackend(maxsize=2)
+        backend.set('a', 1)
+        backend.set('b', 2)
+        backend.get('a')
+        backend.set('c', 3)
+        self.assertEqual(backend.get('a'), 1)
+        self.assertIsNone(backend.get('b'))
+        self.assertEqual(len(backend), 2)
+
+    def test_ttl(self):
+        backend = LRUBackend(maxsize=2, ttl=0)
+        backend.set('a', 1)
+        self.assertIsNone(backend.get('a'))
+        self.assertEqual(len(backend), 0)
+
+        # An expired version token is replaced, so the class's timetable is rendered again
+        timetable_cache = TimetableCache(LRUBackend(maxsize=8, ttl=0))
+        version = timetable_cache.version(1)
+        self.assertNotEqual(timetable_cache.version(1), version)
+
+    def test_get_or_render(self):
+        renders = []
+
+        def render():
+            renders.append(1)
+            return 'rendered %s' % len(renders)
+
+        self.assertEqual(self.timetable_cache.get_or_render(1, 'week', render), 'rendered 1')
+        self.assertEqual(self.timetable_cache.get_or_render(1, 'week', render), 'rendered 1')
+        self.assertEqual(self.timetable_cache.get_or_render(2, 'week', render), 'rendered 2')
+        self.assertEqual(self.timetable_cache.get_or_render(1, 'day', render, day='Monday'), 'rendered 3')
+        self.assertEqual(self.timetable_cache.stats(), {'hits': 1, 'misses': 3, 'hit_ratio': 0.25})
+
+    def test_invalidate(self):
+        self.timetable_cache.get_or_render(1, 'week', lambda: 'old')
+        self.timetable_cache.get_or_render(2, 'week', lambda: 'other')
+        self.timetable_cache.invalidate(1)
+        self.assertEqual(self.timetable_cache.get_or_render(1, 'week', lambda: 'new'), 'new')
+        self.assertEqual(self.timetable_cache.get_or_render(2, 'week', lambda: 'new'), 'other')
@@ -0,0 +1,145 @@
+import io
+import os
+import tempfile
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from timetable.importer import TimetableImporter, TimetableImportError
+from timetable.models import Unit, Lesson, Course, Venue, StudentClass
+from timetable.units import get_unit_index
+
+
+class TimetableImporterTestCase(TestCase):
+    csv = (
+        "unit,unit_name,day,start,stop,venue,type\n"
+        "EMT 2445,,Monday,07:00 AM,10:00 AM,ELB 114,Theory\n"
+        "EMT 2444,Microcontroller Programming,Monday,10:00,13:00,elb 114,Practical\n"
+        "EMT 2445,,Tuesday,07:00 AM,09:00 AM,NCLB 1,\n"
+    )
+
+    def setUp(self):
+        Unit.objects.create(code='EMT 2445', name='Research Methodology for Engineers')
+        Venue.objects.create(name='ELB 114')
+        self.student_class = StudentClass.objects.create(
+            year=StudentClass.YEAR[3][0],
+            semester=StudentClass.SEMESTER[1][0],
+            course=Course.objects.create(name='BSc. Mechatronics Engineering'),
+        )
+        self.importer = TimetableImporter(self.student_class)
+
+    def test_import_csv(self):
+        created = self.importer.run(self.importer.read_csv(io.StringIO(self.csv)))
+        self.assertEqual(created, {'units': 1, 'venues': 1, 'periods': 3, 'lessons': 3})
+        self.assertEqual(self.student_class.lessons.count(), 3)
+        self.assertEqual(self.student_class.units.count(), 2)
+        self.assertEqual(self.student_class.lessons.filter(type=2).get().unit.code, 'EMT 2444')
+
+    def test_unit_index(self):
+        unit_index = get_unit_index()
+
+        def codes(**kwargs):
+            return [code for pk, code, name in unit_index.search('Microcontroller', **kwargs)]
+
+        self.assertEqual(codes(student_class=self.student_class), [])
+        self.assertEqual(codes(), [])
+        self.importer.run(self.importer.read_csv(io.StringIO(self.csv)))
+        # The index of the class's units, and that of all the units, have the new unit
+        self.assertEqual(codes(student_class=self.student_class), ['EMT 2444'])
+        self.assertEqual(codes(), ['EMT 2444'])
+
+    def test_import_again(self):
+        self.importer.run(self.importer.read_csv(io.StringIO(self.csv)))
+        # The same lessons are reused, rather than overlapping themselves
+        created = self.importer.run(self.importer.read_csv(io.StringIO(self.csv)))
+        self.assertEqual(created, {'units': 0, 'venues': 0, 'periods': 0, 'lessons': 0})
+        self.assertEqual(self.student_class.lessons.count(), 3)
+
+        # A different lesson at the same time still overlaps
+        with self.assertRaises(TimetableImportError) as context:
+            self.importer.run([{'unit': 'EMT 2444', 'day': 'Monday', 'start': '07:00 AM', 'stop': '10:00 AM',
+                                'venue': 'ELB 114'}])
+        self.assertEqual(len(context.exception.errors), 1)
+
+    def test_import_json(self):
+        json = (
+            '{"unit": "EMT 2445", "day": "Monday", "start": "07:00 AM", "stop": "10:00 AM", "venue": "ELB 114"}\n'
+            '{"unit": "EMT 2445", "day": "Tuesday", "start": "07:00 AM", "stop": "10:00 AM", "venue": "ELB 114"}\n'
+        )
+        self.assertEqual(self.importer.run(self.importer.read_json(io.StringIO(json)))['lessons'], 2)
+        self.assertEqual(self.importer.run(self.importer.read_json(io.StringIO('[]')))['lessons'], 0)
+
+    def test_import_query_count(self):
+        # The number of queries does not grow with the number of lessons
+        rows = [{'unit': 'EMT 2445', 'day': 'Wednesday', 'start': '%02d:00' % hour,
+                 'stop': '%02d:00' % (hour + 1), 'venue': 'ELB 114'} for hour in range(7, 19)]
+        with self.assertNumQueries(15):
+            self.assertEqual(self.importer.run(rows)['lessons'], 12)
+
+    def test_import_errors(self):
+        rows = [
+            {'unit': 'EMT 2445', 'day': 'Monday', 'start': '07:00 AM', 'stop': '10:00 AM', 'venue': 'ELB 114'},
+            {'unit': 'EMT 2445', 'day': 'Monday', 'start': '09:00 AM', 'stop': '11:00 AM', 'venue': 'ELB 114'},
+            {'unit': 'XYZ 1234', 'day': 'Tuesday', 'start': '09:00 AM', 'stop': '11:00 AM', 'venue': 'ELB 114'},
+        ]
+        with self.assertRaises(TimetableImportError) as context:
+            self.importer.run(rows)
+        self.assertEqual(len(context.exception.errors), 2)
+        self.assertEqual(Lesson.objects.count(), 0)
+
+        with self.assertRaises(TimetableImportError) as context:
+            self.importer.run([{'unit': 'EMT 2445', 'day': 'Someday', 'start': '7', 'stop': '', 'venue': ''}])
+        self.assertEqual(context.exception.errors, ["Row 1: 'stop' is missing"])
+
+    def test_malformed_json(self):
+        json = (
+            '{"unit": "EMT 2445", "day": "Monday", "start": "07:00 AM", "stop": "10:00 AM", "venue": "ELB 114"}\n'
+            '{"unit": "EMT 2445", "day": "Tuesday",\n'
+        )
+        with self.assertRaises(TimetableImportError) as context:
+            self.importer.run(self.importer.read_json(io.StringIO(json)))
+        self.assertEqual(len(context.exception.errors), 1)
+        self.assertTrue(context.exception.errors[0].startswith('Row 2: '))
+
+        with self.assertRaises(TimetableImportError) as context:
+            self.importer.run(self.importer.read_json(io.StringIO('[{"unit": }]')))
+        self.assertTrue(context.exception.errors[0].startswith('Row 1: '))
+        self.assertEqual(Lesson.objects.count(), 0)
+
+    def test_not_an_object(self):
+        json = '[{"unit": "EMT 2445", "day": "Monday", "start": "07:00", "stop": "10:00", "venue": "ELB 114"}, 42]'
+        with self.assertRaises(TimetableImportError) as context:
+            self.importer.run(self.importer.read_json(io.StringIO(json)))
+        self.assertEqual(context.exception.errors, ['Row 2: 42 is not an object, with the fields as its keys'])
+
+    def test_not_utf8(self):
+        data = self.csv.replace('ELB 114', 'ELB\xa0114').encode('latin-1')
+        for read in (self.importer.read_csv, self.importer.read_json):
+            with self.assertRaises(TimetableImportError) as context:
+                self.importer.run(read(io.TextIOWrapper(io.BytesIO(data), encoding='utf-8', newline='')))
+            self.assertEqual(len(context.exception.errors), 1)
+        self.assertEqual(Lesson.objects.count(), 0)
+
+    def test_import_timetable_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as file:
+            file.write(self.csv)
+        try:
+            call_command('import_timetable', file.name, '--class', str(self.student_class.pk), stdout=io.StringIO())
+        finally:
+            os.remove(file.name)
+        self.assertEqual(self.student_class.lessons.count(), 3)
+
+    @override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+    def test_import_timetable_admin_action(self):
+        User.objects.create_superuser('admin', 'admin@kots.io', 'password')
+        self.client.login(username='admin', password='password')
+        url = '/admin/timetable/studentclass/'
+        data = {'action': 'import_timetable', '_selected_action': [self.student_class.pk]}
+
+        response = self.client.post(url, data)
+        self.assertContains(response, 'enctype="multipart/form-data"')
+
+        data.update(apply='1', file=SimpleUploadedFile('timetable.csv', self.csv.encode()))
+        response = self.client.post(url, data)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.student_class.lessons.count(), 3)
@@ -0,0 +1,93 @@
+from django.test import TestCase
+from django.utils import timezone
+from datetime import datetime, time
+from telegram import Update, InlineQuery, User
+from timetable.inline import InlineTimetable, get_inline_timetable
+from timetable.units import get_unit_index
+from timetable.identity import get_identity_cache
+from timetable.models import Student, Unit, Lesson, Course, Venue, Period, StudentClass
+
+
+class FakeBot(object):
+
+    def __init__(self):
+        self.answers = []
+
+    def answerInlineQuery(self, inline_query_id, results, **kwargs):
+        self.answers.append((inline_query_id, results, kwargs))
+
+
+class InlineTimetableTestCase(TestCase):
+
+    def setUp(self):
+        get_unit_index().invalidate()
+        get_identity_cache().clear()
+        self.student_class = StudentClass.objects.create(
+            year=StudentClass.YEAR[3][0],
+            semester=StudentClass.SEMESTER[1][0],
+            course=Course.objects.create(name='BSc. Mechatronics Engineering'),
+        )
+        Student.objects.create(name='Student Somebody', student_class=self.student_class, chat_id='123456789')
+        self.venue = Venue.objects.create(name='ELB 114')
+        for code, name, day in [('EMT 2445', 'Hydraulics', 2), ('EMT 2444', 'Control Engineering', 3)]:
+            self.add_lesson(code, name, day, self.student_class)
+        self.inline = InlineTimetable(cache_time=60)
+        # 2017-04-03 is a Monday
+        self.monday = timezone.make_aware(datetime(2017, 4, 3, 6))
+
+    def add_lesson(self, code, name, day, student_class=None):
+        lesson = Lesson.objects.create(
+            unit=Unit.objects.create(code=code, name=name),
+            venue=self.venue,
+            period=Period.objects.create(start=time(8), stop=time(10), day=day),
+        )
+        if student_class:
+            student_class.lessons.add(lesson)
+        return lesson
+
+    def search(self, text):
+        return [result.title for result in self.inline.search(self.student_class.pk, text, when=self.monday)]
+
+    def test_search(self):
+        self.assertEqual(self.search(''), ['Monday', 'Tuesday', 'This Week'])
+        self.assertEqual(self.search('tomorrow'), ['Tuesday'])
+        self.assertEqual(self.search('tues'), ['Tuesday'])
+        self.assertEqual(self.search('week'), ['This Week'])
+        self.assertEqual(self.search('emt2445'), ['Hydraulics'])
+        self.assertEqual(self.search('EMT 244'), ['Control Engineering', 'Hydraulics'])
+        self.assertEqual(self.search('hydraulic'), ['Hydraulics'])
+        self.assertEqual(self.search('hydrualics'), ['Hydraulics'])
+
+        # Warmed up, answering takes no queries
+        self.inline.get_class(123456789)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.search('control'), ['Control Engineering'])
+            self.assertEqual(self.inline.get_class(123456789), self.student_class.pk)
+
+        # A unit the class doesn't take is found too
+        self.add_lesson('SMA 2100', 'Calculus', 4)
+        self.assertEqual(self.search('calculus'), ['Calculus'])
+
+    def test_rebuilt_when_lessons_change(self):
+        self.assertIn("No lessons.", self.inline.search(self.student_class.pk, 'wednesday')[0]
+                      .input_message_content.message_text)
+        self.add_lesson('EMT 2443', 'Machine Design', 4, self.student_class)
+        text = self.inline.search(self.student_class.pk, 'wednesday')[0].input_message_content.message_text
+        self.assertIn("Machine Design (Theory)", text)
+
+    def test_answer(self):
+        bot = FakeBot()
+        inline = get_inline_timetable()
+        inline.answer(bot, Update(1, inline_query=InlineQuery('1', User(123456789, 'Student'), 'week', '')))
+        inline.answer(bot, Update(2, inline_query=InlineQuery('2', User(987654321, 'Stranger'), 'week', '')))
+
+        query_id, results, kwargs = bot.answers[0]
+        self.assertEqual([result.title for result in results], ['This Week'])
+        self.assertEqual(kwargs, {'cache_time': 300, 'is_personal': True})
+        query_id, results, kwargs = bot.answers[1]
+        self.assertEqual(results, [])
+        self.assertEqual(kwargs['switch_pm_parameter'], 'register')
+
+        # Registering is picked up
+        Student.objects.create(name='Stranger', student_class=self.student_class, chat_id='987654321')
+        self.assertEqual(inline.get_class(987654321), self.student_class.pk)
@@ -0,0 +1,96 @@
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.test import SimpleTestCase, TestCase, override_settings
+from datetime import time
+from timetable.overlaps import IntervalSet, TimetableOverlaps
+from timetable.models import Unit, Lesson, Course, Venue, Period, StudentClass
+
+
+class OverlapsTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.intervals = IntervalSet([
+            (time(7), time(10), 'morning'),
+            (time(14), time(16), 'afternoon'),
+            (time(11), time(13), 'noon'),
+        ])
+
+    def test_overlap(self):
+        self.assertEqual(self.intervals.overlap(time(9), time(11))[2], 'morning')
+        self.assertEqual(self.intervals.overlap(time(12), time(15))[2], 'noon')
+        self.assertEqual(self.intervals.overlap(time(15), time(19))[2], 'afternoon')
+        self.assertEqual(self.intervals.overlap(time(6), time(19))[2], 'morning')
+        # Touching is not overlapping
+        self.assertIsNone(self.intervals.overlap(time(10), time(11)))
+        self.assertIsNone(self.intervals.overlap(time(16), time(17)))
+
+    def test_overlap_with_overlapping_intervals(self):
+        # The stored intervals need not be disjoint
+        self.intervals.add(time(7), time(18), 'all day')
+        self.assertEqual(self.intervals.overlap(time(17), time(19))[2], 'all day')
+        self.assertEqual(self.intervals.overlap(time(8), time(9))[2], 'morning')
+
+    def test_validate(self):
+        overlaps = TimetableOverlaps()
+        overlaps.add(2, time(7), time(10), 'existing')
+        collisions = overlaps.validate([
+            (2, time(9), time(11), 'clashes with existing'),
+            (2, time(12), time(14), 'fine'),
+            (2, time(13), time(15), 'clashes with fine'),
+            (3, time(9), time(11), 'another day'),
+        ])
+        self.assertEqual(collisions, [
+            ('clashes with existing', 'existing'),
+            ('clashes with fine', 'fine'),
+        ])
+        self.assertEqual(overlaps.validate([(2, time(10), time(12), 'fine')]), [])
+
+
+@override_settings(STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage')
+class PeriodValidationTestCase(TestCase):
+
+    def setUp(self):
+        self.student_class = StudentClass.objects.create(
+            year=StudentClass.YEAR[3][0],
+            semester=StudentClass.SEMESTER[1][0],
+            course=Course.objects.create(name='BSc. Mechatronics Engineering'),
+        )
+        self.unit = Unit.objects.create(code='EMT 2445', name='Research Methodology for Engineers')
+        self.venue = Venue.objects.create(name='ELB 114')
+        self.lesson = Lesson.objects.create(unit=self.unit, venue=self.venue,
+                                            period=Period.objects.create(start=time(7), stop=time(10), day=2))
+        self.student_class.lessons.add(self.lesson)
+
+    def test_new_period(self):
+        # A new period, taken by a lesson of the class
+        period = Period(start=time(9), stop=time(11), day=2)
+        period.full_clean()
+        period.save()
+        lesson = Lesson.objects.create(unit=self.unit, venue=self.venue, period=Period.objects.create(
+            start=time(11), stop=time(13), day=2))
+        self.student_class.lessons.add(lesson)
+        lesson.period = period
+        with self.assertRaisesMessage(ValidationError, 'Lesson overlap!'):
+            lesson.full_clean()
+        lesson.period = Period.objects.create(start=time(10), stop=time(11), day=2)
+        lesson.full_clean()
+
+    def test_new_period_admin(self):
+        User.objects.create_superuser('admin', 'admin@kots.io', 'password')
+        self.client.login(username='admin', password='password')
+        lesson = Lesson.objects.create(unit=self.unit, venue=self.venue, period=Period.objects.create(
+            start=time(9), stop=time(11), day=2))
+        url = '/admin/timetable/studentclass/%s/change/' % self.student_class.pk
+        data = {'year': self.student_class.year, 'semester': self.student_class.semester,
+                'course': self.student_class.course_id, 'units': [self.unit.pk]}
+
+        # The overlapping lesson isn't added to the class
+        response = self.client.post(url, dict(data, lessons=[self.lesson.pk, lesson.pk]))
+        self.assertContains(response, 'Lesson overlap!')
+        self.assertEqual(list(self.student_class.lessons.all()), [self.lesson])
+
+        lesson.period = Period.objects.create(start=time(10), stop=time(11), day=2)
+        lesson.save()
+        response = self.client.post(url, dict(data, lessons=[self.lesson.pk, lesson.pk]))
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.student_class.lessons.count(), 2)
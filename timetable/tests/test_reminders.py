@@ -0,0 +1,83 @@
+from django.test import TestCase
+from django.utils import timezone
+from datetime import datetime, time
+from telegram.error import TelegramError
+from general.sms import SMSDispatcher
+from general.outbox import SendQueue
+from timetable.reminders import ReminderScheduler
+from timetable.models import Student, Unit, Lesson, Course, Venue, Period, StudentClass
+
+
+class FakeBot(object):
+    def __init__(self):
+        self.sent = []
+
+    def sendMessage(self, chat_id, text, **kwargs):
+        if chat_id == 999:
+            raise TelegramError('Forbidden: bot was blocked by the user')
+        self.sent.append((chat_id, text))
+
+
+class FakeGateway(object):
+    def __init__(self):
+        self.sent = []
+
+    def sendMessage(self, to_, message_, **kwargs):
+        self.sent.append((to_, message_))
+        return [{'number': number, 'status': 'Success', 'messageId': 'ATXid_%s' % i, 'cost': 'KES 0.8000'}
+                for i, number in enumerate(to_.split(','))]
+
+
+class ReminderSchedulerTestCase(TestCase):
+
+    def setUp(self):
+        student_class = StudentClass.objects.create(
+            year=StudentClass.YEAR[3][0],
+            semester=StudentClass.SEMESTER[1][0],
+            course=Course.objects.create(name='BSc. Mechatronics Engineering'),
+        )
+        Student.objects.create(name='Telegram Student', student_class=student_class, chat_id=123456789)
+        Student.objects.create(name='Blocked Student', student_class=student_class, chat_id=999,
+                               mobile='+254701234567')
+        Student.objects.create(name='SMS Student', student_class=student_class, mobile='+254701234568')
+        Student.objects.create(name='Unreachable Student', student_class=student_class)
+        student_class.lessons.add(Lesson.objects.create(
+            unit=Unit.objects.create(code='EMT 2445', name='Research Methodology for Engineers'),
+            venue=Venue.objects.create(name='ELB 114'),
+            period=Period.objects.create(start=time(7), stop=time(10), day=Period.DAY[1][0]),  # Monday
+        ))
+
+        self.bot = FakeBot()
+        self.gateway = FakeGateway()
+        self.sms = SMSDispatcher(gateway=self.gateway, threaded=False)
+        self.outbox = SendQueue(threaded=False)
+        self.scheduler = ReminderScheduler(self.bot, lead=15, horizon=60, sms=self.sms, outbox=self.outbox)
+
+    def test_reminders(self):
+        # 2017-04-03 is a Monday
+        monday = timezone.make_aware(datetime(2017, 4, 3, 6, 0))
+        self.assertEqual(self.scheduler.fill(monday), 1)
+        self.assertEqual(len(self.scheduler.queue), 1)
+
+        # More than half the horizon is still queued
+        with self.assertNumQueries(0):
+            self.assertEqual(self.scheduler.fill(monday.replace(minute=20)), 0)
+
+        self.assertEqual(self.scheduler.queue.pop_due(monday.replace(minute=44)), [])
+        reminder, = self.scheduler.queue.pop_due(monday.replace(minute=45))
+        self.assertEqual(len(reminder.recipients), 3)
+
+        # The texts wait for the flush, which sends them in a single request
+        for chat_id, mobile in reminder.recipients:
+            self.scheduler.deliver(reminder.text, chat_id, mobile)
+        self.assertEqual(self.bot.sent, [])
+        self.outbox.flush()
+        self.assertEqual(self.bot.sent, [(123456789, reminder.text)])
+        self.assertEqual(self.sms.flush(), 2)
+        (mobiles, message), = self.gateway.sent
+        self.assertEqual(sorted(mobiles.split(',')), ['+254701234567', '+254701234568'])
+
+    def test_no_reminders_on_other_days(self):
+        tuesday = timezone.make_aware(datetime(2017, 4, 4, 6, 0))
+        self.assertEqual(self.scheduler.fill(tuesday), 0)
+        self.assertEqual(len(self.scheduler.queue), 0)
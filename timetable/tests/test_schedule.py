@@ -0,0 +1,74 @@
+from django.test import TestCase
+from django.utils import timezone
+from datetime import datetime, time
+from timetable.cache import get_timetable_cache
+from timetable.schedule import get_schedule_index
+from timetable.utils import StudentChatting
+from timetable.models import Student, Unit, Lesson, Course, Venue, Period, StudentClass
+
+
+class WeeklyScheduleTestCase(TestCase):
+
+    def setUp(self):
+        get_schedule_index().clear()
+        self.student_class = StudentClass.objects.create(
+            year=StudentClass.YEAR[3][0],
+            semester=StudentClass.SEMESTER[1][0],
+            course=Course.objects.create(name='BSc. Mechatronics Engineering'),
+        )
+        Student.objects.create(name='Student Somebody', student_class=self.student_class, chat_id='123456789')
+        self.venue = Venue.objects.create(name='ELB 114')
+        for code, day, start, stop in [('EMT 2445', 4, 8, 10), ('EMT 2444', 2, 14, 16), ('EMT 2443', 2, 7, 10)]:
+            self.add_lesson(code, day, start, stop)
+
+    def add_lesson(self, code, day, start, stop):
+        self.student_class.lessons.add(Lesson.objects.create(
+            unit=Unit.objects.create(code=code, name='Unit %s' % code[-1]),
+            venue=self.venue,
+            period=Period.objects.create(start=time(start), stop=time(stop), day=day),
+        ))
+
+    @staticmethod
+    def at(day, hour, minute=0):
+        # 2017-04-02 is a Sunday
+        return timezone.make_aware(datetime(2017, 4, 1 + day, hour, minute))
+
+    def test_now_and_next(self):
+        schedule = get_schedule_index().get(self.student_class)
+        self.assertEqual([row[1] for row in schedule.rows], ['Unit 3', 'Unit 4', 'Unit 5'])
+
+        monday = 2
+        self.assertEqual(schedule.current(self.at(monday, 6, 59)), None)
+        self.assertEqual(schedule.current(self.at(monday, 7))[1], 'Unit 3')
+        self.assertEqual(schedule.current(self.at(monday, 10)), None)
+        self.assertEqual(schedule.next(self.at(monday, 7))[1], 'Unit 4')
+        self.assertEqual([row[1] for row in schedule.remaining_today(self.at(monday, 6))],
+                         ['Unit 3', 'Unit 4'])
+        self.assertEqual(schedule.remaining_today(self.at(monday, 15)), [])
+
+        # After the week's last lesson, the next is next week's first
+        self.assertEqual(schedule.next(self.at(6, 12))[1], 'Unit 3')
+
+    def test_rebuilt_when_lessons_change(self):
+        index = get_schedule_index()
+        self.assertEqual(len(index.get(self.student_class.pk)), 3)
+        with self.assertNumQueries(0):
+            index.get(self.student_class.pk)
+
+        self.add_lesson('EMT 2442', 3, 9, 11)
+        self.assertEqual(len(index.get(self.student_class.pk)), 4)
+
+        # A change made in another process fires no signals here, and is picked up once the
+        # class's version token expires
+        Period.objects.filter(day=3).update(day=5)
+        self.assertEqual(index.get(self.student_class.pk).rows[-1][0].split()[0], 'Wednesday')
+        timetable_cache = get_timetable_cache()
+        timetable_cache.backend.delete(timetable_cache.make_key(self.student_class.pk, 'version'))
+        self.assertEqual(index.get(self.student_class.pk).rows[-1][0].split()[0], 'Thursday')
+
+    def test_strings(self):
+        chat = StudentChatting(chat_id='123456789')
+        self.assertEqual(chat.get_now_string(self.at(2, 8)),
+                         "*NOW*\n\nMonday 07:00 AM - 10:00 AM\nUnit 3 (Theory)\nELB 114\n\n"
+                         "*LATER TODAY*\n\nMonday 02:00 PM - 04:00 PM\nUnit 4 (Theory)\nELB 114\n")
+        self.assertTrue(chat.get_next_string(self.at(2, 8)).startswith("*NEXT*\n\nMonday 02:00 PM"))
@@ -1,6 +1,10 @@
 from django.test import TestCase
 from datetime import datetime
 from timetable.utils import StudentChatting
+from timetable.loaders import TimetableLoader
+from timetable.cache import get_timetable_cache
+from timetable.units import get_unit_index
+from timetable.sessions import ChatSession
 from timetable.models import Student, Unit, Lesson, Course, Lecturer, Venue, Period, StudentClass
 
 
@@ -17,6 +21,8 @@ class StudentChatTestCase(TestCase):
     ]
 
     def setUp(self):
+        get_timetable_cache().clear()
+        get_unit_index().invalidate()
 
         lecturer = Lecturer.objects.create(
             name='Dr. Somebody Someone',
@@ -89,12 +95,150 @@ class StudentChatTestCase(TestCase):
 
         self.assertEqual(self.student_chat.get_units(with_code=True), self.units)
 
+    def test_find_units(self):
+        self.assertEqual(self.student_chat.find_units('Power Electronics'), ['Power Electronics'])
+        self.assertEqual(self.student_chat.find_units('emt2442'), ['Introduction to Hydraulics and Pneumatics'])
+        self.assertEqual(self.student_chat.find_units('2442'), ['Introduction to Hydraulics and Pneumatics'])
+        self.assertEqual(self.student_chat.find_units('hydr'), ['Introduction to Hydraulics and Pneumatics'])
+        self.assertEqual(self.student_chat.find_units('design of'), ['Design of Mechatronic Systems II',
+                                                                     'Design of Machines and Machine Elements'])
+        self.assertEqual(self.student_chat.find_units('pwer electronix'), ['Power Electronics'])
+        self.assertEqual(self.student_chat.find_units('zzz'), [])
+
+        # Searching takes no queries, and edits are picked up
+        with self.assertNumQueries(0):
+            self.student_chat.find_units('micro')
+            self.assertTrue(self.student_chat.verify_unit_name('Power Electronics'))
+        self.student_chat.edit_unit(name='Power Electronics', new_name='Power Systems')
+        self.assertEqual(self.student_chat.find_units('power'), ['Power Systems'])
+        self.assertEqual(self.student_chat.get_unit_code('Power Systems'), 'EMT 2438')
+
+        # So are the edits made in another process, once the index expires
+        Unit.objects.filter(code='EMT 2438').update(name='Power Electronics')
+        self.assertEqual(self.student_chat.find_units('power'), ['Power Systems'])
+        student_class = self.student_chat.student.student_class_id
+        get_unit_index().indexes[student_class] = (0, get_unit_index().get(student_class))
+        self.assertEqual(self.student_chat.find_units('power'), ['Power Electronics'])
+
     def test_get_lessons(self):
         lesson = Lesson.objects.get(pk=1)
         lesson_list = [(str(lesson.period), str(lesson.unit), str(lesson.venue), lesson.get_type_display(), str(lesson.lecturer)) or ""]
 
         self.assertEqual(self.student_chat.get_lessons(), lesson_list)
 
+    def test_timetable_loader_query_count(self):
+        student_class = self.student_chat.student.student_class
+        loader = TimetableLoader(student_class, count_queries=True)
+        lessons = self.student_chat.get_lessons()
+        with self.assertNumQueries(1):
+            self.assertEqual(loader.load(), lessons)
+        self.assertEqual(loader.query_count, 1)
+
+        # More lessons should not cost more queries
+        for hour, code in enumerate(['EMT 2444', 'EMT 2443', 'EMT 2442'], start=11):
+            period = Period.objects.create(
+                start=datetime.strptime('%s:00:00' % hour, '%H:%M:%S').time(),
+                stop=datetime.strptime('%s:00:00' % (hour + 1), '%H:%M:%S').time(),
+                day=Period.DAY[1][0]
+            )
+            student_class.lessons.add(Lesson.objects.create(
+                unit=Unit.objects.get(code=code),
+                venue=Venue.objects.get(name='ELB 114'),
+                type=1,
+                period=period
+            ))
+
+        with self.assertNumQueries(1):
+            self.assertEqual(len(loader.load()), 4)
+        self.assertEqual(loader.query_count, 1)
+        self.assertIsNone(TimetableLoader(student_class).query_count)
+        with self.assertNumQueries(1):
+            self.student_chat.get_lessons()
+
+    def test_lessons_string_cache(self):
+        timetable_cache = get_timetable_cache()
+        lessons_string = self.student_chat.get_lessons_string()
+        self.assertEqual(timetable_cache.stats()['misses'], 1)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.student_chat.get_lessons_string(), lessons_string)
+        self.assertEqual(timetable_cache.stats()['hits'], 1)
+
+        # Editing the timetable invalidates the class's rendered strings
+        self.student_chat.edit_lesson(lesson=self.student_chat.get_lessons_keyboard()[0], venue='ELB 115')
+        self.assertIn('ELB 115', self.student_chat.get_lessons_string())
+        self.assertIn('ELB 115', self.student_chat.get_day_lessons_string('Monday'))
+
+        self.student_chat.edit_unit(name='Research Methodology for Engineers', new_name='Research Methods')
+        self.assertIn('Research Methods', self.student_chat.get_lessons_string())
+
+        self.student_chat.remove_lesson(self.student_chat.get_lessons_keyboard()[0])
+        self.assertNotIn('Research Methods', self.student_chat.get_lessons_string())
+
+    def test_chat_session(self):
+        user_data = {}
+        chat = ChatSession.get_chat(user_data, 123456789)
+        label = chat.get_lessons_keyboard()[0]
+
+        # Later steps of the conversation reuse the student and the lessons
+        with self.assertNumQueries(0):
+            self.assertIs(ChatSession.get_chat(user_data, 123456789), chat)
+            self.assertEqual(chat.get_index().labels[label], 1)
+
+        ChatSession.clear(user_data)
+        self.assertIs(ChatSession.get_chat(user_data, 123456789), chat)
+
+        # A change in the class's timetable drops the lessons held by the session
+        chat.edit_lesson(lesson=label, venue='ELB 115')
+        self.assertIs(ChatSession.get_chat(user_data, 123456789), chat)
+        self.assertIsNone(chat.index)
+
+        # As does expiry, the session itself
+        user_data[ChatSession.key].created -= ChatSession.ttl + 1
+        self.assertIsNot(ChatSession.get_chat(user_data, 123456789), chat)
+
+    def test_lesson_index(self):
+        label = self.student_chat.get_lessons_keyboard()[0]
+        lesson = Lesson.objects.select_related('period', 'venue').get(pk=1)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.student_chat.valid_lesson(label), True)
+            self.assertEqual(self.student_chat.valid_lesson('Monday 07:00 AM - 10:00 AM'), False)
+            self.assertEqual(self.student_chat.get_lesson(label), lesson)
+            self.assertEqual(self.student_chat.get_lesson_period(label), lesson.period)
+            self.assertEqual(self.student_chat.get_lesson_venue(label), lesson.venue)
+            self.assertEqual(self.student_chat.index.day_lessons('Monday'), self.student_chat.index.rows)
+            self.assertEqual(self.student_chat.index.day_lessons('Tuesday'), [])
+
+        self.assertEqual(self.student_chat.remove_lesson(label), True)
+        self.assertEqual(self.student_chat.remove_lesson(label), False)
+        self.assertEqual(Lesson.objects.filter(pk=1).exists(), False)
+
+    def test_valid_period(self):
+        self.assertEqual(self.student_chat.valid_period(['07:00 AM', '10:00 AM', 'Tuesday']), True)
+        self.assertEqual(self.student_chat.valid_period(['10:00 AM', '11:00 AM', 'Monday']), True)
+        self.assertIn('Stop time', self.student_chat.valid_period(['10:00 AM', '07:00 AM', 'Monday']))
+        self.assertIn('Lesson overlap', self.student_chat.valid_period(['09:00 AM', '11:00 AM', 'Monday']))
+
+        # A lesson being edited does not collide with itself
+        label = self.student_chat.get_lessons_keyboard()[0]
+        self.assertEqual(self.student_chat.valid_period(['09:00 AM', '11:00 AM', 'Monday'], lesson=label), True)
+
+        period = Period.objects.get(pk=1)
+        period.full_clean()
+        period.stop = datetime.strptime('11:00:00', '%H:%M:%S').time()
+        period.full_clean()
+
+        # Nor do lessons of other classes
+        other_class = StudentClass.objects.create(
+            year=StudentClass.YEAR[2][0],
+            semester=StudentClass.SEMESTER[1][0],
+            course=Course.objects.get(name='BSc. Mechatronics Engineering'),
+        )
+        Student.objects.create(name="Another Student", student_class=other_class, chat_id=987654321)
+        other_chat = StudentChatting(chat_id=987654321)
+        self.assertEqual(other_chat.valid_period(['09:00 AM', '11:00 AM', 'Monday']), True)
+
     def test_add_unit(self):
         self.student_chat.add_unit(code='XYZ 123',
                                    name='Testing Add Unit')
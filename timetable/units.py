@@ -0,0 +1,257 @@
+"""
+This module contains the in-memory search indexes of the units, of:
+    1. :class: `timetable.units.UnitSearch`
+    2. :class: `timetable.units.UnitIndex`
+
+They find units by a loosely typed code or name, like "emt2445", "2442", "hydr" or even
+"hydrualics", without a query per keystroke. Each class's units are indexed on their own, for the
+unit flows of :mod: `timetable.chats.private_chat`, and all the units together, for the inline
+queries of :mod: `timetable.inline`.
+
+An index is loaded in a single query the first time it's searched, and dropped by the signal
+callbacks below whenever a unit is saved or deleted, or a class's units change, to be loaded again
+on the next search. The units edited in other processes, like the admin, don't fire the signals
+here, so an index is also loaded again once it's older than the `UNIT_INDEX` setting's `TTL`.
+"""
+
+import re
+import threading
+import time
+from bisect import bisect_left
+from django.conf import settings
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from timetable.models import Unit, StudentClass
+
+
+class UnitSearch(object):
+    """
+    An index of some units, by code prefix, name, the tokens of the name, and trigrams.
+
+    Attributes:
+        units (list): Tuples of the form (pk, code, name), in the order given.
+        codes (list): Tuples of the form (normalized code, pk), sorted, for the code prefixes.
+        tokens (list): Tuples of the form (token, pk), sorted, for the prefixes of the names' words.
+        trigrams (dict): The trigrams of the normalized codes and names mapped to the sets of
+            the primary keys of the units that have them.
+
+    Args:
+        units (iterable): Tuples of the form (pk, code, name).
+    """
+    def __init__(self, units):
+        self.units = list(units)
+        self._units = dict((unit[0], unit) for unit in self.units)
+        self._exact = dict()
+        self._grams = dict()
+        self.codes = []
+        self.tokens = []
+        self.trigrams = dict()
+        for pk, code, name in self.units:
+            self._exact.setdefault(self.normalize(code), (pk, code, name))
+            self._exact.setdefault(self.normalize(name), (pk, code, name))
+            self.codes.append((self.normalize(code), pk))
+            for token in self.tokenize(name):
+                self.tokens.append((token, pk))
+            self._grams[pk] = (self.trigram(code), self.trigram(name))
+            for gram in self._grams[pk][0] | self._grams[pk][1]:
+                self.trigrams.setdefault(gram, set()).add(pk)
+        self.codes.sort()
+        self.tokens.sort()
+
+    @staticmethod
+    def normalize(text):
+        """
+        Lower cases a code or name, and drops all but its letters and digits, so that "EMT 2445",
+        "emt2445" and "EMT-2445" are all the same.
+        """
+        return re.sub(r'[^a-z0-9]', '', text.lower())
+
+    @staticmethod
+    def tokenize(text):
+        return re.findall(r'[a-z0-9]+', text.lower())
+
+    @classmethod
+    def trigram(cls, text):
+        text = '  %s ' % cls.normalize(text)
+        return set(text[i:i + 3] for i in range(len(text) - 2))
+
+    def __len__(self):
+        return len(self.units)
+
+    @staticmethod
+    def prefixed(entries, prefix):
+        """
+        Args:
+            entries (list): Sorted tuples of the form (key, pk).
+            prefix (str): The prefix of the keys.
+
+        Returns:
+            set: The primary keys of the entries whose keys start with the prefix.
+        """
+        found = set()
+        for key, pk in entries[bisect_left(entries, (prefix,)):]:
+            if not key.startswith(prefix):
+                break
+            found.add(pk)
+        return found
+
+    def get(self, text):
+        """
+        Get the unit with exactly the given code or name, ignoring case and spaces.
+
+        Returns:
+            tuple: Of the form (pk, code, name). None if there's no such unit.
+        """
+        return self._exact.get(self.normalize(text))
+
+    def search(self, text, limit=5):
+        """
+        Finds the units matching the given text. The units whose code starts with the text come
+        first, then those whose code has its digits, like "2442", then those whose name's words
+        start with the text's words, and, failing all these, those sharing enough trigrams with it,
+        for the misspellings.
+
+        Args:
+            text (str): Like "EMT 2445", "2442", "hydr" or "control eng".
+            limit (Optional[int]): The most units returned. Default is 5.
+
+        Returns:
+            list: Tuples of the form (pk, code, name), the best matches first.
+        """
+        query = self.normalize(text)
+        if not query:
+            return []
+
+        ranks = dict()
+        for pk in self.prefixed(self.codes, query):
+            ranks.setdefault(pk, 0)
+        if query.isdigit():
+            for code, pk in self.codes:
+                if query in code:
+                    ranks.setdefault(pk, 1)
+        words = self.tokenize(text)
+        if words:
+            matches = self.prefixed(self.tokens, words[0])
+            for word in words[1:]:
+                matches &= self.prefixed(self.tokens, word)
+            for pk in matches:
+                ranks.setdefault(pk, 2)
+        if ranks:
+            found = sorted(ranks, key=lambda pk: (ranks[pk], self._units[pk][1]))
+            return [self._units[pk] for pk in found[:limit]]
+
+        grams = self.trigram(text)
+        similarity = dict()
+        for pk in set().union(*(self.trigrams.get(gram, ()) for gram in grams)):
+            similarity[pk] = max(float(len(grams & unit_grams)) / len(grams | unit_grams)
+                                 for unit_grams in self._grams[pk])
+        found = sorted((pk for pk in similarity if similarity[pk] >= 0.3), key=lambda pk: -similarity[pk])
+        return [self._units[pk] for pk in found[:limit]]
+
+
+class UnitIndex(object):
+    """
+    The search indexes of the classes' units, and of all the units.
+
+    Attributes:
+        indexes (dict): The primary keys of the classes, or None for all the units, mapped to
+            tuples of the form (expires, index), of when they expire and their
+            :class: `timetable.units.UnitSearch` objects.
+        ttl (float): Seconds an index is kept before it's loaded again.
+
+    Args:
+        ttl (Optional[float]): As above. Default is 60.
+    """
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self.indexes = dict()
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def load(student_class=None):
+        """
+        Loads the units of a class, or all the units, in a single query.
+
+        Args:
+            student_class (Optional[int]): The class's primary key. Default is all the units.
+
+        Returns:
+            timetable.units.UnitSearch
+        """
+        units = Unit.objects.all()
+        if student_class is not None:
+            units = units.filter(studentclass=student_class)
+        return UnitSearch(units.order_by('pk').values_list('pk', 'code', 'name'))
+
+    def get(self, student_class=None):
+        """
+        Get the index of a class's units, or of all the units, loading it if need be.
+
+        Args:
+            student_class (Optional[:class: `timetable.models.StudentClass` or int]): The class,
+                or its primary key. Default is all the units.
+
+        Returns:
+            timetable.units.UnitSearch
+        """
+        student_class = getattr(student_class, 'pk', student_class)
+        expires_index = self.indexes.get(student_class)
+        if expires_index is not None and expires_index[0] > time.monotonic():
+            return expires_index[1]
+        generation = self._generation
+        index = self.load(student_class)
+        with self._lock:
+            # Unless the units changed while they were being loaded
+            if self._generation == generation:
+                self.indexes[student_class] = (time.monotonic() + self.ttl, index)
+        return index
+
+    def search(self, text, limit=5, student_class=None):
+        """
+        Finds the units of a class, or of all the units, matching the given text.
+        See :func: `~timetable.units.UnitSearch.search`.
+
+        Returns:
+            list: Tuples of the form (pk, code, name), the best matches first.
+        """
+        return self.get(student_class).search(text, limit)
+
+    def invalidate(self, student_class=None):
+        """
+        Drops the index of a class's units, or, by default, all the indexes.
+        """
+        with self._lock:
+            self._generation += 1
+            if student_class is None:
+                self.indexes.clear()
+            else:
+                self.indexes.pop(student_class, None)
+
+
+_unit_index = UnitIndex(ttl=getattr(settings, 'UNIT_INDEX', {}).get('TTL', 60))
+
+
+def get_unit_index():
+    """
+    Get the process's :class: `timetable.units.UnitIndex`.
+
+    Returns:
+        timetable.units.UnitIndex
+    """
+    return _unit_index
+
+
+def unit_changed_callback(sender, **kwargs):
+    _unit_index.invalidate()
+
+
+def class_units_changed_callback(sender, **kwargs):
+    if kwargs['action'] in ('post_add', 'post_remove', 'post_clear'):
+        if kwargs['reverse']:
+            _unit_index.invalidate()
+        else:
+            _unit_index.invalidate(kwargs['instance'].pk)
+
+post_save.connect(unit_changed_callback, sender=Unit)
+post_delete.connect(unit_changed_callback, sender=Unit)
+m2m_changed.connect(class_units_changed_callback, sender=StudentClass.units.through)
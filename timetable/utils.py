@@ -1,6 +1,12 @@
 """This module contains utility functions that sort of interface between chats and models"""
 
 from timetable.models import Unit, Lesson, Student, Venue, Period, Lecturer
+from timetable.index import TimetableIndex
+from timetable.overlaps import TimetableOverlaps
+from timetable.cache import get_timetable_cache
+from timetable.schedule import get_schedule_index
+from timetable.units import get_unit_index
+from timetable.identity import get_identity_cache, STUDENT
 import re
 from django.core.exceptions import ValidationError
 import datetime as dt
@@ -16,7 +22,9 @@ class StudentChatting(object):
     Attributes:
         student (:class: `timetable.objects.Student`): A student
         lesson_type (list): Theory or Practical
-        lessons (dict): The student's lessons
+        index (:class: `timetable.index.TimetableIndex`): The student's lessons, indexed. Built
+            by :func: `~timetable.utils.StudentChatting.get_lessons`, and dropped whenever the
+            lessons are edited.
 
     Args:
         chat_id: Used to lookup the Student object, representing the
@@ -27,14 +35,35 @@ class StudentChatting(object):
     """
     def __init__(self, chat_id):
         assert chat_id is not None
-        try:
-            self.student = Student.objects.get(chat_id=chat_id)
-        except Student.DoesNotExist:
+        # Told by the identity cache, rather than a query on every message. Only the student's
+        # primary key, chat and class are known, the rest of the student isn't loaded.
+        identity = get_identity_cache().get(chat_id)
+        if identity.role != STUDENT:
             self.student = None
             raise Exception("No student with chat_id %s exists" % chat_id)
+        self.student = Student(pk=identity.pk, chat_id=int(chat_id), student_class_id=identity.student_class)
 
         self.lesson_type = [["Theory"], ["Practical"]]
-        self.lessons = dict()
+        self.index = None
+
+    @classmethod
+    def for_class(cls, student_class_id):
+        """
+        Get a chat about a class's timetable, like in the class's group, without looking up the
+        student asking. Only the timetable's methods, like
+        :func: `~timetable.utils.StudentChatting.get_day_lessons_string`, may be used on it.
+
+        Args:
+            student_class_id (int): The primary key of the class.
+
+        Returns:
+            timetable.utils.StudentChatting
+        """
+        chat = cls.__new__(cls)
+        chat.student = Student(student_class_id=student_class_id)
+        chat.lesson_type = [["Theory"], ["Practical"]]
+        chat.index = None
+        return chat
 
     def get_lessons(self):
         """
@@ -44,21 +73,20 @@ class StudentChatting(object):
             lessons (list): A list of the student's lessons, in their respective
                 string representations
         """
-        lessons = []
-        for item in self.student.student_class.lessons.all():
-            lesson = (str(item.period),
-                      str(item.unit),
-                      str(item.venue),
-                      item.get_type_display(),
-                      str(item.lecturer) or "")
-
-            self.lessons.update(
-                {"\n".join([lesson[0], lesson[1]]): item.pk}
-            )
+        # A single joined query, rather than one query per lesson's period, unit, venue and lecturer.
+        self.index = TimetableIndex.load(self.student.student_class_id)
+        return self.index.rows
 
-            lessons.append(lesson)
+    def get_index(self):
+        """
+        Get the index of the student's lessons, loading them if need be.
 
-        return lessons
+        Returns:
+            timetable.index.TimetableIndex
+        """
+        if self.index is None:
+            self.get_lessons()
+        return self.index
 
     def get_day_lessons(self):
         #TODO implement this function
@@ -74,7 +102,16 @@ class StudentChatting(object):
             (list): A list of lists of the Student's lesson. This is formatted
                 in Telegram's keyboard format.
         """
-        return ["\n".join([ls[0], ls[1]]) for ls in self.get_lessons()]
+        return self.get_index().keyboard()
+
+    def get_unit_search(self):
+        """
+        Get the search index of the student's units, from :mod: `timetable.units`.
+
+        Returns:
+            timetable.units.UnitSearch
+        """
+        return get_unit_index().get(self.student.student_class_id)
 
     def get_units(self, with_code=False):
         """
@@ -90,10 +127,39 @@ class StudentChatting(object):
             list of unit names
 
         """
+        units = self.get_unit_search().units
         if with_code:
-            return [(item.code, item.name) for item in self.student.student_class.units.all()]
+            return [(code, name) for pk, code, name in units]
         else:
-            return [item.name for item in self.student.student_class.units.all()]
+            return [name for pk, code, name in units]
+
+    def get_units_keyboard(self, limit=20):
+        """
+        Get the names of the student's units, for a keyboard. At most `limit` of them are given,
+        the rest are to be typed, see :func: `~timetable.utils.StudentChatting.find_units`.
+
+        Returns:
+            (list): The unit names. None if the student has no units.
+        """
+        return self.get_units(with_code=False)[:limit] or None
+
+    def find_units(self, text, limit=5):
+        """
+        Finds the student's units matching what was typed, like "hydr", "2442" or the full name.
+
+        Args:
+            text (str): Part of a unit's code or name.
+            limit (Optional[int]): The most units returned. Default is 5.
+
+        Returns:
+            (list): The names of the matching units, the best first. Just the one, if the text is
+                a unit's full code or name.
+        """
+        search = self.get_unit_search()
+        unit = search.get(text)
+        if unit is not None:
+            return [unit[2]]
+        return [name for pk, code, name in search.search(text, limit)]
 
     def add_unit(self, code, name):
         """
@@ -109,6 +175,7 @@ class StudentChatting(object):
         unit, created = Unit.objects.get_or_create(code=code, name=name)
         if created:  # New Unit entry made
             self.student.student_class.units.add(unit)
+            self.index = None
             return True
         else:  # Unit already exists
             return False
@@ -138,6 +205,7 @@ class StudentChatting(object):
         if new_name:
             unit.name = new_name
         unit.save()
+        self.index = None
         return True
 
     def remove_unit(self, name):
@@ -153,6 +221,7 @@ class StudentChatting(object):
             self.student.student_class.units.get(name=name).delete()
         except Unit.DoesNotExist:
             return False
+        self.index = None
         return True
 
     def verify_unit_name(self, name):
@@ -165,7 +234,8 @@ class StudentChatting(object):
         Returns:
             (bool): True if the unit exists. False otherwise.
         """
-        return self.student.student_class.units.filter(name=name).exists()
+        unit = self.get_unit_search().get(name)
+        return unit is not None and unit[2] == name
 
     def get_unit_code(self, name):
         """
@@ -178,11 +248,10 @@ class StudentChatting(object):
             timetable.models.Unit.code: The code of the unit with the given name.
                 Returns None if the unit does not exist.
         """
-        try:
-            unit = self.student.student_class.units.get(name=name)
-        except Unit.DoesNotExist:
+        unit = self.get_unit_search().get(name)
+        if unit is None or unit[2] != name:
             return None
-        return unit.code
+        return unit[1]
 
     @staticmethod
     def valid_unit_code(unit_code):
@@ -299,23 +368,29 @@ class StudentChatting(object):
         """
         Get a nicely formatted string of the lessons that the student has.
 
+        The string is the same for the whole class, so it is served from :mod: `timetable.cache`.
+
         Returns:
             lesson_str (str): A specially formatted string of lessons
         """
-        lessons = self.get_lessons()
-        lessons_dict = {}
+        return get_timetable_cache().get_or_render(
+            self.student.student_class_id, 'week', self.render_lessons_string)
 
-        for day in calendar.day_name[:5]:
-            lessons_dict.update({day: []})
+    def render_lessons_string(self):
+        """
+        Render the string returned by :func: `~timetable.utils.StudentChatting.get_lessons_string`
+        from the database.
 
-        for lesson in lessons:
-            lessons_dict[lesson[0].split(' ')[0]].append(lesson)
+        Returns:
+            lesson_str (str): A specially formatted string of lessons
+        """
+        self.get_lessons()
 
         lesson_str = str()
 
         for day in calendar.day_name[:5]:
             s_lesson = "".join("\n%s\n%s (%s)\n%s\n%s\n" % (l[0].split(' ', 1)[-1], l[1], l[3], l[2], l[4]) for l in
-                               lessons_dict[day]).join(['*' + day.upper() + '*', '\n\n'])
+                               self.index.day_lessons(day)).join(['*' + day.upper() + '*', '\n\n'])
             lesson_str += s_lesson
         return lesson_str
 
@@ -330,26 +405,91 @@ class StudentChatting(object):
             str: String of the lessons of the day.
         """
         if day in calendar.day_name[:5]:
-            lessons = self.get_lessons()
-            l_dict = {day: []}
-            for lesson in lessons:
-                if lesson[0].startswith(day):
-                    l_dict[day].append(lesson)
+            return get_timetable_cache().get_or_render(
+                self.student.student_class_id, 'day', lambda: self.render_day_lessons_string(day), day=day)
+
+    def render_day_lessons_string(self, day):
+        """
+        Render the string returned by :func: `~timetable.utils.StudentChatting.get_day_lessons_string`
+        from the database.
+
+        Args:
+            day (str): The day whose lessons are to be returned
+
+        Returns:
+            str: String of the lessons of the day.
+        """
+        if day in calendar.day_name[:5]:
+            self.get_lessons()
             return "".join("\n%s\n%s (%s)\n%s\n%s\n" % (l[0].split(' ', 1)[-1], l[1], l[3], l[2], l[4]) for l in
-                               l_dict[day]).join(['*TODAY\'S LESSONS*', '\n\n'])
+                           self.index.day_lessons(day)).join(['*TODAY\'S LESSONS*', '\n\n'])
+
+    @staticmethod
+    def render_lesson(row):
+        """
+        Render a lesson as a few lines: its period, unit and type, venue, and lecturer.
+
+        Args:
+            row (tuple): The lesson's tuple representation, of the form
+                (period, unit, venue, type, lecturer), all strings. See
+                :func: `~timetable.loaders.TimetableLoader.as_tuple`.
+
+        Returns:
+            str: The lesson's lines. The lecturer's line is left out when the unit has no
+                lecturer, which `str()` renders as 'None'.
+        """
+        lines = [row[0], "%s (%s)" % (row[1], row[3]), row[2]]
+        if row[4] and row[4] != 'None':
+            lines.append(row[4])
+        return "\n".join(lines)
+
+    def get_now_string(self, when=None):
+        """
+        Get a nicely formatted string of the lesson going on now, and the rest of today's.
+
+        Args:
+            when (Optional[:class: `datetime.datetime`]): Default is now.
+
+        Returns:
+            str
+        """
+        schedule = get_schedule_index().get(self.student.student_class_id)
+        current = schedule.current(when)
+        lesson_str = "*NOW*\n\n%s\n" % (self.render_lesson(current) if current else "No lesson right now.")
+        remaining = schedule.remaining_today(when)
+        if remaining:
+            lesson_str += "\n*LATER TODAY*\n" + "".join("\n%s\n" % self.render_lesson(row) for row in remaining)
+        return lesson_str
+
+    def get_next_string(self, when=None):
+        """
+        Get a nicely formatted string of the next lesson.
+
+        Args:
+            when (Optional[:class: `datetime.datetime`]): Default is now.
+
+        Returns:
+            str
+        """
+        lesson = get_schedule_index().get(self.student.student_class_id).next(when)
+        if lesson is None:
+            return "You have no lessons."
+        return "*NEXT*\n\n%s\n" % self.render_lesson(lesson)
 
     def get_week_lessons_string(self, week=None):
         # TODO Add a feature for week-specific edits and queries of the timetable
         return "*THIS WEEK'S LESSONS*\n" + self.get_lessons_string()
 
-    @staticmethod
-    def valid_period(period):
+    def valid_period(self, period, lesson=None):
         """
-        Validates the submitted period. Checks that there are no overlaps.
+        Validates the submitted period. Checks that there are no overlaps with the other lessons
+        of the student's class, through the index of the class's lessons.
 
         Args:
             period (list): A list of string representations of the following order:
                 [start, stop, day]
+            lesson (Optional[str]): String representation of the lesson whose period is being
+                edited. It is left out of the check, so it cannot collide with itself.
 
         Returns:
             bool: True if the period is valid. A string containing the error message otherwise.
@@ -360,9 +500,18 @@ class StudentChatting(object):
                 stop=dt.datetime.strptime(period[1], '%I:%M %p').time(),
                 day=calendar.day_name[:5].index(period[2])+2
             )
-            l_period.full_clean()
+            # Another class may already have a lesson at the very same period, and
+            # add_lesson simply reuses its Period.
+            l_period.full_clean(validate_unique=False)
         except ValidationError as ve:
             return '; '.join(ve.messages)
+
+        index = self.get_index()
+        exclude = [index.labels[lesson]] if lesson in index else []
+        collision = TimetableOverlaps.from_index(index, exclude=exclude).check(
+            l_period.day, l_period.start, l_period.stop)
+        if collision:
+            return "Lesson overlap! \n%s" % collision
         return True
 
     def add_lesson(self, unit, venue, period, l_type):
@@ -410,6 +559,7 @@ class StudentChatting(object):
 
         if l_created:
             self.student.student_class.lessons.add(lesson)
+            self.index = None
             return True
         else:
             return False
@@ -424,20 +574,11 @@ class StudentChatting(object):
         Returns:
             bool: True if the lesson is successfully deleted. False otherwise.
         """
-
-        # FIXME this may not be the most efficient way to go about retrieving the object to be deleted.
-        try:
-            if not self.lessons:
-                self.get_lessons()
-            if not self.lessons:
-                return False
-            # self.lessons now has the lesson's string representation as the keys, and the lesson's
-            # primary key as the value
-
-            self.student.student_class.lessons.get(
-                        pk=self.lessons[lesson]).delete()
-        except Lesson.DoesNotExist:
+        lesson = self.get_lesson(lesson)
+        if lesson is None:
             return False
+        lesson.delete()
+        self.index = None
         return True
 
     def valid_lesson(self, lesson):
@@ -450,10 +591,10 @@ class StudentChatting(object):
         Returns:
             bool: True if the lesson is valid. Otherwise false.
 
-        Validity is determined by checking if the lesson is in the list of lessons for the
+        Validity is determined by checking if the lesson is in the index of lessons for the
         particular student.
         """
-        return lesson in [lesson for lesson in self.get_lessons_keyboard()]
+        return lesson in self.get_index()
 
     def get_lesson(self, lesson):
         """
@@ -463,18 +604,10 @@ class StudentChatting(object):
             lesson (str): String representation fo the lesson to be retrieved
 
         Returns:
-            timetable.models.Lesson
+            timetable.models.Lesson: With its period, unit, lecturer and venue already loaded.
+                None if the student has no such lesson.
         """
-        try:
-            if not self.lessons:
-                self.get_lessons()
-            if not self.lessons:
-                return None
-            lesson = self.student.student_class.lessons.get(
-                pk=self.lessons[lesson])
-        except Lesson.DoesNotExist:
-            return None
-        return lesson
+        return self.get_index().get(lesson)
 
     def get_lesson_period(self, lesson):
         """
@@ -526,16 +659,24 @@ class StudentChatting(object):
 
         if lesson:
             if period:
-                lesson.period.start = dt.datetime.strptime(period[0], '%I:%M %p').time()
-                lesson.period.stop = dt.datetime.strptime(period[1], '%I:%M %p').time()
-                lesson.period.day = calendar.day_name[:5].index(period[2]) + 2
-                lesson.period.save()
+                # Periods are shared by lessons of different classes at the very same time,
+                # so the lesson moves to another period rather than editing its own.
+                old_period = lesson.period
+                lesson.period, p_created = Period.objects.get_or_create(
+                    start=dt.datetime.strptime(period[0], '%I:%M %p').time(),
+                    stop=dt.datetime.strptime(period[1], '%I:%M %p').time(),
+                    day=calendar.day_name[:5].index(period[2]) + 2
+                )
+                lesson.save()
+                if old_period and not old_period.lesson_set.exists():
+                    old_period.delete()
 
             if venue:
                 lesson.venue.name = venue.upper()
                 lesson.venue.save()
 
             lesson.save()
+            self.index = None
             return True
         else:
             return False